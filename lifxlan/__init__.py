@@ -1,4 +1,7 @@
 from .lifxlan import LifxLAN
+from .aio import AsyncLifxLAN, AsyncDevice, AsyncLight, AsyncMultiZoneLight, AsyncTileChain, AsyncSwitch
+from .codec import use_numpy_colors
+from .discovery import DEVICE_ADDED, DEVICE_REMOVED, DEVICE_IP_CHANGED
 from .message import *
 from .msgtypes import *
 from .unpack import unpack_lifx_message
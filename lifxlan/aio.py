@@ -0,0 +1,1112 @@
+# coding=utf-8
+# aio.py
+# asyncio versions of the LifxLAN, Device, Light, MultiZoneLight, TileChain and
+# Switch APIs. Every method that talks to a device is a coroutine, and all of
+# them share one AsyncTransport (a DatagramProtocol) per AsyncLifxLAN (or per
+# event loop, for devices created directly), so any number of requests can be
+# outstanding on a single event loop without threads.
+# Replies are matched to requests by (target, source_id, seq_num) exactly as
+# in the threaded Transport.
+#
+#     lan = AsyncLifxLAN()
+#     lights = await lan.get_lights()
+#     await asyncio.gather(*(light.set_color(BLUE) for light in lights))
+
+import asyncio
+import random
+from time import time
+
+from .device import DEFAULT_ATTEMPTS, DEFAULT_TIMEOUT, UDP_BROADCAST_IP_ADDRS, UDP_BROADCAST_PORT, StateCache, firmware_version, firmware_version_tuple
+from .discovery import DiscoveryReplies
+from .lifxlan import DEFAULT_QUIET_SECS, device_kind
+from .light import color_component_payload
+from .multizonelight import add_zone_colors, changed_zone_runs, extended_zone_colors, extended_zone_packets, extended_zone_payloads, \
+    is_extended_zones_answer, missing_zone_segments, multizone_effect_from_state, multizone_effect_payload, record_zone_frame, select_zones, \
+    zone_frame_colors, zone_run_payloads, zone_runs
+from .errors import InvalidParameterException, WorkflowException
+from .message import BROADCAST_MAC
+from .msgtypes import *
+from .products import extended_multizone_min_firmware, features_map, light_products, product_map, switch_products
+from .ratelimit import DEFAULT_DEVICE_BURST, DEFAULT_DEVICE_RATE, TokenBucket
+from .rtt import MAX_RETRANSMIT_SECS, RttEstimator
+from .tilechain import canvas_dimensions, make_tile_map, matrix_to_tile_colors, tile_effect_from_state, tile_effect_payload, tile_xy_vals, \
+    tiles_from_chain
+from .transport import Transport
+from . import codec
+
+
+# The queue of replies to one outstanding request
+class AsyncListener(asyncio.Queue):
+    def __init__(self, key):
+        asyncio.Queue.__init__(self)
+        self.key = key
+        self.target_addr, self.source_id, self.seq_num = key
+
+
+class AsyncTransport(Transport, asyncio.DatagramProtocol):
+    listener_class = AsyncListener
+
+    def __init__(self, verbose=False):
+        Transport.__init__(self, verbose)
+        self.endpoint = None
+        self.opening = None
+
+    async def open(self):
+        if self.endpoint == None:
+            if self.opening == None:
+                loop = asyncio.get_running_loop()
+                self.opening = loop.create_task(loop.create_datagram_endpoint(lambda: self, local_addr=("0.0.0.0", 0), allow_broadcast=True))
+            opening = self.opening
+            try:
+                await opening
+            except OSError as err:
+                if self.opening is opening:
+                    self.opening = None
+                raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
+        return self.endpoint
+
+    def close(self):
+        if self.endpoint != None:
+            self.endpoint.close()
+        self.endpoint = None
+        self.opening = None
+
+    def sendto(self, packet, addr):
+        if self.endpoint == None:
+            raise WorkflowException("WorkflowException: AsyncTransport must be opened before sending")
+        self.endpoint.sendto(packet, addr)
+
+    async def listen(self, target_addr, source_id):
+        await self.open()
+        return self.add_listener(target_addr, source_id)
+
+    ### DatagramProtocol callbacks
+
+    def connection_made(self, transport):
+        self.endpoint = transport
+
+    def connection_lost(self, exc):
+        self.endpoint = None
+        self.opening = None
+
+    def datagram_received(self, data, addr):
+        self.handle_datagram(data, addr[0])
+
+    def error_received(self, exc):
+        # e.g. a broadcast address on an interface that is down
+        if self.verbose:
+            print("OSError: {}".format(exc))
+
+# Shared by AsyncDevices that were created directly rather than by an
+# AsyncLifxLAN. An AsyncTransport's socket belongs to the event loop that
+# opened it, so there is one per loop.
+default_transports = {} # event loop: AsyncTransport
+
+def get_default_transport():
+    loop = asyncio.get_running_loop()
+    for closed_loop in [l for l in default_transports if l.is_closed()]:
+        del default_transports[closed_loop]
+    if loop not in default_transports:
+        default_transports[loop] = AsyncTransport()
+    return default_transports[loop]
+
+
+class AsyncDevice(StateCache):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
+        super(AsyncDevice, self).__init__()
+        self.verbose = verbose
+        self.mac_addr = mac_addr.lower()
+        self.port = port
+        self.service = service
+        self.source_id = source_id
+        self.ip_addr = ip_addr
+        self._transport = transport # None for the running event loop's default transport
+        self.rate_limiter = TokenBucket(DEFAULT_DEVICE_RATE, DEFAULT_DEVICE_BURST)
+        self.rtt = RttEstimator()
+
+        self.label = None
+        self.location = None
+        self.group = None
+        self.power_level = None
+        self.level = None # for relay
+        self.host_firmware_build_timestamp = None
+        self.host_firmware_version = None
+        self.wifi_firmware_build_timestamp = None
+        self.wifi_firmware_version = None
+        self.vendor = None
+        self.product = None
+        self.version = None
+        self.product_name = None
+        self.product_features = None
+
+    @property
+    def transport(self):
+        if self._transport == None:
+            return get_default_transport()
+        return self._transport
+
+    @transport.setter
+    def transport(self, transport):
+        self._transport = transport
+
+    ############################################################################
+    #                                                                          #
+    #                            Device API Methods                            #
+    #                                                                          #
+    ############################################################################
+
+    # update the device's (relatively) persistent attributes, all queries at once
+    async def refresh(self):
+        (self.label, self.location, self.group, self.power_level, host_firmware, wifi_firmware, version) = await asyncio.gather(
+            self.get_label(), self.get_location(), self.get_group(), self.get_power(),
+            self.get_host_firmware_tuple(), self.get_wifi_firmware_tuple(), self.get_version_tuple())
+        self.host_firmware_build_timestamp, self.host_firmware_version = host_firmware
+        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = wifi_firmware
+        self.vendor, self.product, self.version = version
+        self.product_name = await self.get_product_name()
+        self.product_features = await self.get_product_features()
+
+    def get_mac_addr(self):
+        return self.mac_addr
+
+    def get_service(self):
+        return self.service
+
+    def get_port(self):
+        return self.port
+
+    def get_ip_addr(self):
+        return self.ip_addr
+
+    def get_source_id(self):
+        return self.source_id
+
+    async def get_label(self, max_age=None):
+        if not self.is_cached("label", max_age):
+            response = await self.req_with_resp(GetLabel, StateLabel)
+            self.label = self.cache_state("label", response.label)
+        return self.state_cache["label"][0]
+
+    async def get_location(self, max_age=None):
+        if not self.is_cached("location", max_age):
+            response = await self.req_with_resp(GetLocation, StateLocation)
+            self.location = self.cache_state("location", response.label)
+        return self.state_cache["location"][0]
+
+    async def get_group(self, max_age=None):
+        if not self.is_cached("group", max_age):
+            response = await self.req_with_resp(GetGroup, StateGroup)
+            self.group = self.cache_state("group", response.label)
+        return self.state_cache["group"][0]
+
+    async def set_label(self, label):
+        if len(label) > 32:
+            label = label[:32]
+        await self.req_with_ack(SetLabel, {"label": label})
+        self.label = self.cache_state("label", label)
+
+    async def get_power(self, max_age=None):
+        if not self.is_cached("power_level", max_age):
+            response = await self.req_with_resp(GetPower, StatePower)
+            self.power_level = self.cache_state("power_level", response.power_level)
+        return self.state_cache["power_level"][0]
+
+    async def set_power(self, power, rapid=False):
+        on = [True, 1, "on"]
+        off = [False, 0, "off"]
+        if power in on:
+            power_level = 65535
+        elif power in off:
+            power_level = 0
+        else:
+            raise InvalidParameterException("{} is not a valid power level.".format(power))
+        if rapid:
+            await self.fire_and_forget(SetPower, {"power_level": power_level})
+        else:
+            await self.req_with_ack(SetPower, {"power_level": power_level})
+
+    async def get_host_firmware_tuple(self, max_age=None):
+        if not self.is_cached("host_firmware", max_age):
+            response = await self.req_with_resp(GetHostFirmware, StateHostFirmware)
+            self.cache_state("host_firmware_version_tuple", firmware_version_tuple(response.version))
+            self.cache_state("host_firmware", (response.build, firmware_version(response.version)))
+        return self.state_cache["host_firmware"][0]
+
+    # (major, minor) as integers, for comparing versions
+    async def get_host_firmware_version_tuple(self, max_age=None):
+        if not self.is_cached("host_firmware_version_tuple", max_age):
+            await self.get_host_firmware_tuple()
+        return self.state_cache["host_firmware_version_tuple"][0]
+
+    async def get_host_firmware_build_timestamp(self, max_age=None):
+        self.host_firmware_build_timestamp, self.host_firmware_version = await self.get_host_firmware_tuple(max_age)
+        return self.host_firmware_build_timestamp
+
+    async def get_host_firmware_version(self, max_age=None):
+        self.host_firmware_build_timestamp, self.host_firmware_version = await self.get_host_firmware_tuple(max_age)
+        return self.host_firmware_version
+
+    async def get_wifi_info_tuple(self, max_age=None):
+        if not self.is_cached("wifi_info", max_age):
+            response = await self.req_with_resp(GetWifiInfo, StateWifiInfo)
+            self.cache_state("wifi_info", (response.signal, response.tx, response.rx))
+        return self.state_cache["wifi_info"][0]
+
+    async def get_wifi_signal_mw(self, max_age=None):
+        signal, tx, rx = await self.get_wifi_info_tuple(max_age)
+        return signal
+
+    async def get_wifi_tx_bytes(self, max_age=None):
+        signal, tx, rx = await self.get_wifi_info_tuple(max_age)
+        return tx
+
+    async def get_wifi_rx_bytes(self, max_age=None):
+        signal, tx, rx = await self.get_wifi_info_tuple(max_age)
+        return rx
+
+    async def get_wifi_firmware_tuple(self, max_age=None):
+        if not self.is_cached("wifi_firmware", max_age):
+            response = await self.req_with_resp(GetWifiFirmware, StateWifiFirmware)
+            self.cache_state("wifi_firmware", (response.build, firmware_version(response.version)))
+        return self.state_cache["wifi_firmware"][0]
+
+    async def get_wifi_firmware_build_timestamp(self, max_age=None):
+        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = await self.get_wifi_firmware_tuple(max_age)
+        return self.wifi_firmware_build_timestamp
+
+    async def get_wifi_firmware_version(self, max_age=None):
+        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = await self.get_wifi_firmware_tuple(max_age)
+        return self.wifi_firmware_version
+
+    async def get_version_tuple(self, max_age=None):
+        if not self.is_cached("version", max_age):
+            response = await self.req_with_resp(GetVersion, StateVersion)
+            self.cache_state("version", (response.vendor, response.product, response.version))
+        return self.state_cache["version"][0]
+
+    async def get_product_name(self):
+        if self.product == None:
+            self.vendor, self.product, self.version = await self.get_version_tuple()
+        return product_map[self.product] if self.product in product_map else product_map[None]
+
+    async def get_product_features(self):
+        if self.product == None:
+            self.vendor, self.product, self.version = await self.get_version_tuple()
+        return features_map[self.product] if self.product in product_map else features_map[None]
+
+    async def get_vendor(self, max_age=None):
+        self.vendor, self.product, self.version = await self.get_version_tuple(max_age)
+        return self.vendor
+
+    async def get_product(self, max_age=None):
+        self.vendor, self.product, self.version = await self.get_version_tuple(max_age)
+        return self.product
+
+    async def get_version(self, max_age=None):
+        self.vendor, self.product, self.version = await self.get_version_tuple(max_age)
+        return self.version
+
+    async def get_location_tuple(self, max_age=None):
+        if not self.is_cached("location_tuple", max_age):
+            response = await self.req_with_resp(GetLocation, StateLocation)
+            self.cache_state("location_tuple", (response.location, response.label, response.updated_at))
+        (self.location, label, updated_at) = self.state_cache["location_tuple"][0]
+        return self.location, label, updated_at
+
+    async def get_location_label(self, max_age=None):
+        self.location, label, updated_at = await self.get_location_tuple(max_age)
+        return label
+
+    async def get_location_updated_at(self, max_age=None):
+        self.location, label, updated_at = await self.get_location_tuple(max_age)
+        return updated_at
+
+    async def get_group_tuple(self, max_age=None):
+        if not self.is_cached("group_tuple", max_age):
+            response = await self.req_with_resp(GetGroup, StateGroup)
+            self.cache_state("group_tuple", (response.group, response.label, response.updated_at))
+        (self.group, label, updated_at) = self.state_cache["group_tuple"][0]
+        return self.group, label, updated_at
+
+    async def get_group_label(self, max_age=None):
+        self.group, label, updated_at = await self.get_group_tuple(max_age)
+        return label
+
+    async def get_group_updated_at(self, max_age=None):
+        self.group, label, updated_at = await self.get_group_tuple(max_age)
+        return updated_at
+
+    async def get_info_tuple(self, max_age=None):
+        if not self.is_cached("info", max_age):
+            response = await self.req_with_resp(GetInfo, StateInfo)
+            self.cache_state("info", (response.time, response.uptime, response.downtime))
+        return self.state_cache["info"][0]
+
+    async def get_time(self, max_age=None):
+        time, uptime, downtime = await self.get_info_tuple(max_age)
+        return time
+
+    async def get_uptime(self, max_age=None):
+        time, uptime, downtime = await self.get_info_tuple(max_age)
+        return uptime
+
+    async def get_downtime(self, max_age=None):
+        time, uptime, downtime = await self.get_info_tuple(max_age)
+        return downtime
+
+    async def is_switch(self):
+        if self.product == None:
+            self.vendor, self.product, self.version = await self.get_version_tuple()
+        return self.product in switch_products
+
+    async def is_light(self):
+        if self.product == None:
+            self.vendor, self.product, self.version = await self.get_version_tuple()
+        return self.product in light_products
+
+    async def supports_feature(self, feature):
+        if self.product_features == None:
+            self.product_features = await self.get_product_features()
+        return self.product_features[feature]
+
+    async def supports_color(self):
+        return await self.supports_feature('color')
+
+    async def supports_temperature(self):
+        return await self.supports_feature('temperature')
+
+    async def supports_multizone(self):
+        return await self.supports_feature('multizone')
+
+    async def supports_infrared(self):
+        return await self.supports_feature('infrared')
+
+    async def supports_chain(self):
+        return await self.supports_feature('chain')
+
+    ############################################################################
+    #                                                                          #
+    #                            Workflow Methods                              #
+    #                                                                          #
+    ############################################################################
+
+    # Don't wait for Acks or Responses, just send the same message repeatedly
+    async def fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS):
+        await self.transport.open()
+        seq_num = self.transport.next_seq_num(self.mac_addr, self.source_id)
+        msg = msg_type(self.mac_addr, self.source_id, seq_num=seq_num, payload=payload, ack_requested=False, response_requested=False)
+        self.invalidate_state(msg_type)
+        sleep_interval = 0.05 if num_repeats > 20 else 0
+        for i in range(num_repeats):
+            if i > 0:
+                await asyncio.sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
+            await self.wait_for_rate_limit()
+            self.send_packet(msg.packed_message)
+            if self.verbose:
+                print("SEND: " + str(msg))
+
+    # Usually used for Set messages
+    async def req_with_ack(self, msg_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        await self.req_with_resp(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
+
+    # Usually used for Get messages, or for state confirmation after Set (hence the optional payload)
+    async def req_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        responses = await self.request(msg_type, response_type, payload, timeout_secs, max_attempts, self.is_single_response)
+        return responses[-1]
+
+    # Sends one packet asking for both an acknowledgement and a state response, and returns (ack, response)
+    async def req_with_ack_resp(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        replies = {}
+        def is_complete(response):
+            replies[type(response)] = response
+            return len(replies) == 2
+        await self.request(msg_type, [Acknowledgement, response_type], payload, timeout_secs, max_attempts, is_complete)
+        return (replies[Acknowledgement], replies[response_type])
+
+    # For requests that expect multiple response packets (like GetExtendedColorZones).
+    # With partial=True, whatever replies arrived are returned once the device
+    # goes quiet, rather than resending the request for all of them.
+    async def req_with_multiple_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, is_complete=None, partial=False):
+        if is_complete == None:
+            is_complete = self.is_last_zone_segment
+        return await self.request(msg_type, response_type, payload, timeout_secs, max_attempts, is_complete, partial)
+
+    # Sends msg_type and collects matching replies until is_complete(reply) is
+    # True, resending up to max_attempts times (see req_with_multiple_resp for partial).
+    async def request(self, msg_type, response_type, payload, timeout_secs, max_attempts, is_complete, partial=False):
+        if type(response_type) != type([]):
+            response_type = [response_type]
+        loop = asyncio.get_running_loop()
+        listener = await self.transport.listen(self.mac_addr, self.source_id)
+        ack_requested = Acknowledgement in response_type
+        response_requested = len(response_type) > 1 or not ack_requested
+        msg = msg_type(self.mac_addr, self.source_id, seq_num=listener.seq_num, payload=payload, ack_requested=ack_requested, response_requested=response_requested)
+        self.invalidate_state(msg_type)
+        deadline = loop.time() + timeout_secs * max_attempts
+        retransmit_secs = self.rtt.get_retransmit_secs()
+        retransmitted = False
+        responses = []
+        seen = set()
+        try:
+            while loop.time() < deadline:
+                await self.wait_for_rate_limit()
+                self.send_packet(msg.packed_message)
+                sent_time = time()
+                if self.verbose:
+                    print("SEND: " + str(msg))
+                next_send_time = min(loop.time() + retransmit_secs, deadline)
+                while loop.time() < next_send_time:
+                    try:
+                        response = await asyncio.wait_for(listener.get(), next_send_time - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    if self.verbose:
+                        print("RECV: " + str(response))
+                    if type(response) in response_type and response.source_id == self.source_id:
+                        if response.packed_message in seen:
+                            continue
+                        seen.add(response.packed_message)
+                        if not responses and not retransmitted:
+                            self.rtt.add_sample(response.received_time - sent_time)
+                        self.ip_addr = response.ip_addr
+                        responses.append(response)
+                        if is_complete(response):
+                            return responses
+                        if partial:
+                            next_send_time = min(loop.time() + retransmit_secs, deadline)
+                if partial and responses:
+                    return responses
+                # no reply within the retransmit timeout, so resend and back off
+                self.rtt.backoff()
+                retransmit_secs = min(retransmit_secs * 2, MAX_RETRANSMIT_SECS)
+                retransmitted = True
+        finally:
+            self.transport.stop_listening(listener)
+        raise WorkflowException("WorkflowException: Did not receive {} from {} (Name: {}) in response to {}".format(str(response_type), str(self.mac_addr), str(self.label), str(msg_type)))
+
+    def is_single_response(self, response):
+        return True
+
+    def is_last_zone_segment(self, response):
+        if not (hasattr(response, 'index') and hasattr(response, 'count') and hasattr(response, 'cCount')):
+            raise WorkflowException("WorkflowException: Response type {} does not have expected attributes for req_with_multiple_resp".format(type(response)))
+        return response.index + response.cCount >= response.count
+
+    async def wait_for_rate_limit(self):
+        delay = max(self.rate_limiter.reserve(), self.transport.rate_limiter.reserve())
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def set_rate_limit(self, rate, burst=None):
+        self.rate_limiter.set_rate(rate, burst)
+
+    def get_rate_limit_stats(self):
+        return self.rate_limiter.get_stats()
+
+    def get_rtt_stats(self):
+        return self.rtt.get_stats()
+
+    def send_packet(self, packet):
+        if self.ip_addr:
+            self.transport.sendto(packet, (self.ip_addr, self.port))
+        else:
+            for ip_addr in UDP_BROADCAST_IP_ADDRS:
+                self.transport.sendto(packet, (ip_addr, self.port))
+
+    def __repr__(self):
+        return '<{cls}: {mac} ({label!r})>'.format(cls=self.__class__.__name__, mac=self.mac_addr, label=self.label)
+
+
+class AsyncLight(AsyncDevice):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
+        super(AsyncLight, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
+        self.color = None
+        self.infrared_brightness = None
+
+    ############################################################################
+    #                                                                          #
+    #                            Light API Methods                             #
+    #                                                                          #
+    ############################################################################
+
+    async def get_power(self, max_age=None):
+        if not self.is_cached("power_level", max_age):
+            response = await self.req_with_resp(LightGetPower, LightStatePower)
+            self.power_level = self.cache_state("power_level", response.power_level)
+        return self.state_cache["power_level"][0]
+
+    async def set_power(self, power, duration=0, rapid=False):
+        on = [True, 1, "on", 65535]
+        off = [False, 0, "off"]
+        if power in on:
+            power_level = 65535
+        elif power in off:
+            power_level = 0
+        else:
+            raise InvalidParameterException("{} is not a valid power level.".format(power))
+        await self.send_set(LightSetPower, {"power_level": power_level, "duration": duration}, rapid)
+
+    # color is [Hue, Saturation, Brightness, Kelvin]
+    async def set_waveform(self, is_transient, color, period, cycles, duty_cycle, waveform, rapid=False):
+        if len(color) == 4:
+            await self.send_set(LightSetWaveform, {"transient": is_transient, "color": color, "period": period, "cycles": cycles, "duty_cycle": duty_cycle, "waveform": waveform}, rapid)
+
+    # color is [Hue, Saturation, Brightness, Kelvin], duration in ms
+    async def set_color(self, color, duration=0, rapid=False):
+        if len(color) == 4:
+            await self.send_set(LightSetColor, {"color": color, "duration": duration}, rapid)
+
+    async def get_color(self, max_age=None):
+        if not self.is_cached("color", max_age):
+            response = await self.req_with_resp(LightGet, LightState)
+            self.power_level = self.cache_state("power_level", response.power_level)
+            self.label = self.cache_state("label", response.label)
+            self.color = self.cache_state("color", response.color)
+        return self.state_cache["color"][0]
+
+    # hue in range [0 - 65535]
+    async def set_hue(self, hue, duration=0, rapid=False):
+        await self.set_color_component(0, hue, duration, rapid)
+
+    # saturation in range [0 - 65535]
+    async def set_saturation(self, saturation, duration=0, rapid=False):
+        await self.set_color_component(1, saturation, duration, rapid)
+
+    # brightness in range [0 - 65535]
+    async def set_brightness(self, brightness, duration=0, rapid=False):
+        await self.set_color_component(2, brightness, duration, rapid)
+
+    # kelvin in range [2500 - 9000]
+    async def set_colortemp(self, kelvin, duration=0, rapid=False):
+        await self.set_color_component(3, kelvin, duration, rapid)
+
+    async def get_infrared(self, max_age=None):
+        if self.is_cached("infrared_brightness", max_age):
+            return self.state_cache["infrared_brightness"][0]
+        if await self.supports_infrared():
+            response = await self.req_with_resp(LightGetInfrared, LightStateInfrared)
+            self.infrared_brightness = self.cache_state("infrared_brightness", response.infrared_brightness)
+        return self.infrared_brightness
+
+    async def set_infrared(self, infrared_brightness, rapid=False):
+        await self.send_set(LightSetInfrared, {"infrared_brightness": infrared_brightness}, rapid)
+
+    async def get_min_kelvin(self):
+        return await self.supports_feature('min_kelvin')
+
+    async def get_max_kelvin(self):
+        return await self.supports_feature('max_kelvin')
+
+    ### helpers
+
+    async def set_color_component(self, index, value, duration, rapid):
+        await self.send_set(LightSetWaveformOptional, color_component_payload(index, value, duration), rapid)
+
+    async def send_set(self, msg_type, payload, rapid):
+        if rapid:
+            await self.fire_and_forget(msg_type, payload, num_repeats=1)
+        else:
+            await self.req_with_ack(msg_type, payload)
+
+
+class AsyncMultiZoneLight(AsyncLight):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
+        super(AsyncMultiZoneLight, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
+        self.extended_multizone = None
+        self.zone_frame_stats = {"frames": 0, "packets": 0, "last_frame_packets": 0}
+
+    # 0 indexed, NOT inclusive, works like python list indices. Read with the
+    # extended multizone messages if the device supports them. Returns an
+    # (N, 4) array instead of a list when NumPy colors are enabled.
+    async def get_color_zones(self, start=None, end=None):
+        if await self.supports_extended_multizone():
+            try:
+                all_zones = await self.extended_get_color_zones()
+            except WorkflowException:
+                # a StateUnhandled reply turns extended_multizone off
+                if self.extended_multizone:
+                    raise
+        if not self.extended_multizone:
+            all_zones = codec.color_array(await self.get_all_color_zones())
+        self.color = select_zones(all_zones, start, end)
+        self.cache_state("zone_frame", zone_frame_colors(all_zones))
+        return self.color
+
+    # every StateMultiZone comes back from one GetColorZones(0, 255); only
+    # missing segments are asked for again
+    async def get_all_color_zones(self):
+        zones = {}
+        def has_all_zones(response):
+            return add_zone_colors(zones, response) <= len(zones)
+        responses = await self.req_with_multiple_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":0, "end_index":255},
+                                                      is_complete=has_all_zones, partial=True)
+        total_zones = responses[0].count
+        requests = [self.req_with_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":first, "end_index":last})
+                    for (first, last) in missing_zone_segments(zones, total_zones)]
+        for response in await asyncio.gather(*requests):
+            add_zone_colors(zones, response)
+        if len(zones) < total_zones:
+            raise WorkflowException("WorkflowException: Did not receive all {} zones from {} (Name: {}) in response to {}".format(total_zones, self.mac_addr, self.label, MultiZoneGetColorZones))
+        return [zones[i] for i in range(total_zones)]
+
+    async def set_zone_color(self, start_index, end_index, color, duration=0, rapid=False, apply=1):
+        if len(color) == 4:
+            await self.send_set(MultiZoneSetColorZones, {"start_index": start_index, "end_index": end_index, "color": color,
+                                                         "duration": duration, "apply": apply}, rapid)
+
+    # Sets colors for all zones given a list of HSVK colors, as runs of equal
+    # colors or as extended messages, whichever takes fewer packets. Returns
+    # the number of packets sent.
+    async def set_zone_colors(self, colors, duration=0, rapid=False):
+        colors = [tuple(color) for color in colors]
+        return await self.write_zone_frame(colors, zone_runs(colors), duration, rapid)
+
+    # Like set_zone_colors, but only sends the zones that changed since the
+    # last frame written or read (see MultiZoneLight.push_zone_frame)
+    async def push_zone_frame(self, colors, duration=0, rapid=False):
+        colors = [tuple(color) for color in colors]
+        previous = self.state_cache.get("zone_frame", (None, None))[0]
+        return await self.write_zone_frame(colors, changed_zone_runs(previous, colors), duration, rapid)
+
+    # Writes colors with a message per run in runs, or in full with extended
+    # messages if that takes fewer packets
+    async def write_zone_frame(self, colors, runs, duration=0, rapid=False):
+        extended_packets = extended_zone_packets(len(colors))
+        if extended_packets < len(runs) and await self.supports_extended_multizone():
+            await self.extended_set_zone_color(colors, 0, duration, rapid)
+            packets = extended_packets
+        else:
+            await self.set_zone_runs(runs, duration, rapid)
+            packets = len(runs)
+        self.cache_state("zone_frame", colors)
+        record_zone_frame(self.zone_frame_stats, packets)
+        return packets
+
+    # runs is a list of (start, end, color) with inclusive zone indices
+    async def set_zone_runs(self, runs, duration=0, rapid=False, apply=1):
+        if len(runs) == 0:
+            return
+        payloads = zone_run_payloads(runs, duration, apply)
+        if rapid:
+            for payload in payloads:
+                await self.fire_and_forget(MultiZoneSetColorZones, payload, num_repeats=1)
+        else:
+            # the message that applies the queued changes goes out after they have all arrived
+            await asyncio.gather(*(self.req_with_ack(MultiZoneSetColorZones, payload) for payload in payloads[:-1]))
+            await self.req_with_ack(MultiZoneSetColorZones, payloads[-1])
+
+    # worked out once from the product and host firmware, or by asking the device
+    async def supports_extended_multizone(self):
+        if self.extended_multizone == None:
+            product = self.product if self.product != None else await self.get_product()
+            min_firmware = extended_multizone_min_firmware.get(product)
+            if min_firmware == None:
+                self.extended_multizone = await self.probe_extended_multizone()
+            else:
+                self.extended_multizone = min_firmware == (0, 0) or await self.get_host_firmware_version_tuple() >= min_firmware
+        return self.extended_multizone
+
+    async def probe_extended_multizone(self):
+        try:
+            responses = await self.req_with_multiple_resp(MultiZoneGetExtendedColorZones, [MultiZoneStateExtendedColorZones, StateUnhandled], is_complete=is_extended_zones_answer)
+        except WorkflowException:
+            return False
+        return type(responses[-1]) != StateUnhandled
+
+    def get_zone_frame_stats(self):
+        return dict(self.zone_frame_stats)
+
+    # Uses new protocol for extended color zones, 0-indexed, end is exclusive.
+    async def extended_get_color_zones(self, start=None, end=None):
+        responses = await self.req_with_multiple_resp(MultiZoneGetExtendedColorZones, [MultiZoneStateExtendedColorZones, StateUnhandled], is_complete=is_extended_zones_answer)
+        if type(responses[-1]) == StateUnhandled:
+            self.extended_multizone = False
+            raise WorkflowException("WorkflowException: {} (Name: {}) does not support extended multizone messages".format(self.mac_addr, self.label))
+        return extended_zone_colors(responses, start, end)
+
+    async def extended_set_zone_color(self, colors, index=0, duration=0, rapid=False, apply=1):
+        for payload in extended_zone_payloads(colors, index, duration, apply):
+            await self.send_set(MultiZoneSetExtendedColorZones, payload, rapid)
+
+    async def get_multizone_effect(self):
+        response = await self.req_with_resp(GetMultiZoneEffect, StateMultiZoneEffect)
+        return multizone_effect_from_state(response)
+
+    async def set_multizone_effect(self, effect_type=0, speed=0, duration=0, instanceid=0, parameters=[], rapid=False):
+        await self.send_set(SetMultiZoneEffect, multizone_effect_payload(effect_type, speed, duration, instanceid, parameters), rapid)
+
+
+# Unlike TileChain, the tile layout is not fetched in the constructor (it can't
+# await); it is fetched on first use, or explicitly with get_tile_info().
+class AsyncTileChain(AsyncLight):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
+        super(AsyncTileChain, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
+        self.tile_info = None
+        self.tile_count = None
+        self.tile_map = None
+        self.canvas_dimensions = None
+
+    async def get_tile_info(self, refresh_cache=False):
+        if (self.tile_info == None) or (refresh_cache == True):
+            response = await self.req_with_resp(GetDeviceChain, StateDeviceChain)
+            self.tile_info = tiles_from_chain(response)
+            self.tile_count = response.total_count
+        return self.tile_info
+
+    async def get_tile_count(self, refresh_cache=False):
+        if (self.tile_count == None) or (refresh_cache == True):
+            await self.get_tile_info(refresh_cache=True)
+        return self.tile_count
+
+    async def get_tile_colors(self, start_index, tile_count=1, x=0, y=0, width=8):
+        num_tiles = await self.get_tile_count()
+        if (start_index < 0) or (start_index >= num_tiles):
+            raise InvalidParameterException("{} is not a valid start_index for TileChain with {} tiles.".format(start_index, num_tiles))
+        requests = [self.req_with_resp(GetTileState64, StateTileState64, {"tile_index": start_index + i, "length": 1, "reserved": 0, "x": x, "y": y, "width": width})
+                    for i in range(tile_count)]
+        return codec.stack_colors([response.colors for response in await asyncio.gather(*requests)])
+
+    async def get_tilechain_colors(self):
+        return await self.get_tile_colors(0, await self.get_tile_count())
+
+    async def set_tile_colors(self, start_index, colors, duration=0, tile_count=1, x=0, y=0, width=8, rapid=False):
+        num_tiles = await self.get_tile_count()
+        if (start_index < 0) or (start_index >= num_tiles):
+            raise InvalidParameterException("{} is not a valid start_index for TileChain with {} tiles.".format(start_index, num_tiles))
+        payload = {"tile_index": start_index,
+                   "length": tile_count,
+                   "colors": colors,
+                   "duration": duration,
+                   "reserved": 0,
+                   "x": x,
+                   "y": y,
+                   "width": width}
+        await self.send_set(SetTileState64, payload, rapid)
+
+    async def set_tilechain_colors(self, tilechain_colors, duration=0, rapid=False):
+        num_tiles = await self.get_tile_count()
+        await asyncio.gather(*(self.set_tile_colors(i, tilechain_colors[i], duration, 1, 0, 0, 8, rapid) for i in range(num_tiles)))
+
+    async def project_matrix(self, hsvk_matrix, duration=0, rapid=False):
+        num_tiles = await self.get_tile_count()
+        canvas_x, canvas_y = await self.get_canvas_dimensions()
+        matrix_x = len(hsvk_matrix[0])
+        matrix_y = len(hsvk_matrix)
+        if (matrix_x != canvas_x) or (matrix_y != canvas_y):
+            raise InvalidParameterException("Warning: TileChain canvas wants a {} x {} matrix, but given matrix is {} x {}.".format(canvas_x, canvas_y, matrix_x, matrix_y))
+        tile_colors = matrix_to_tile_colors(hsvk_matrix, await self.get_tile_map(), num_tiles)
+        await asyncio.gather(*(self.set_tile_colors(i, tile_color, duration, 1, 0, 0, 8, rapid) for (i, tile_color) in enumerate(tile_colors)))
+
+    async def set_tile_coordinates(self, tile_index, x, y):
+        await self.req_with_ack(SetUserPosition, {"tile_index": tile_index, "reserved": 0, "user_x": x, "user_y": y})
+        await self.get_tile_info(refresh_cache=True)
+        self.tile_map = None
+        self.canvas_dimensions = None
+
+    async def recenter_coordinates(self):
+        x_vals, y_vals = await self.get_xy_vals()
+        for (tile_index, (user_x, user_y)) in enumerate(zip(x_vals, y_vals)):
+            await self.set_tile_coordinates(tile_index, user_x, user_y)
+
+    # The layout math is shared with TileChain (see tilechain.py); only fetching the tile info differs.
+    async def get_xy_vals(self):
+        tiles = await self.get_tile_info()
+        return tile_xy_vals(tiles[:self.tile_count])
+
+    async def get_canvas_dimensions(self, refresh_cache=False):
+        if (self.canvas_dimensions == None) or (refresh_cache == True):
+            x_vals, y_vals = await self.get_xy_vals()
+            self.canvas_dimensions = canvas_dimensions(x_vals, y_vals)
+        return self.canvas_dimensions
+
+    async def get_tile_map(self, refresh_cache=False):
+        if (self.tile_map == None) or (refresh_cache == True):
+            x_vals, y_vals = await self.get_xy_vals()
+            self.tile_map = make_tile_map(x_vals, y_vals)
+        return self.tile_map
+
+    async def get_tile_effect(self):
+        response = await self.req_with_resp(GetTileEffect, StateTileEffect)
+        return tile_effect_from_state(response)
+
+    async def set_tile_effect(self, effect_type=0, speed=0, duration=0, palette=[], instanceid=0, parameters=[], rapid=False):
+        await self.send_set(SetTileEffect, tile_effect_payload(effect_type, speed, duration, palette, instanceid, parameters), rapid)
+
+
+class AsyncSwitch(AsyncDevice):
+
+    async def get_relay_power(self, relay_index):
+        response = await self.req_with_resp(GetRPower, StateRPower, {"relay_index": relay_index})
+        self.level = response.level
+        return self.level
+
+    async def set_relay_power(self, relay_index, level):
+        on = [True, 1, "on", 65535]
+        off = [False, 0, "off"]
+        if level in on:
+            await self.req_with_ack(SetRPower, {"relay_index": relay_index, "level": 65535})
+        elif level in off:
+            await self.req_with_ack(SetRPower, {"relay_index": relay_index, "level": 0})
+        else:
+            raise InvalidParameterException("{} is not a valid relay level.".format(level))
+
+
+# the class make_device creates for each kind of device (see lifxlan.device_kind)
+ASYNC_DEVICE_TYPES = {"switch": AsyncSwitch, "multizone": AsyncMultiZoneLight, "chain": AsyncTileChain, "light": AsyncLight, "device": AsyncDevice}
+
+
+class AsyncLifxLAN(object):
+    def __init__(self, num_lights=None, verbose=False):
+        self.source_id = random.randrange(2, 1 << 32)
+        self.num_devices = num_lights
+        self.num_lights = num_lights
+        self.devices = None
+        self.lights = None
+        self.verbose = verbose
+        self.transport = AsyncTransport(verbose)
+
+    ############################################################################
+    #                                                                          #
+    #                         LAN (Broadcast) API Methods                      #
+    #                                                                          #
+    ############################################################################
+
+    async def get_devices(self):
+        await self.discover_devices()
+        return self.devices
+
+    async def get_lights(self):
+        await self.discover_devices()
+        return self.lights
+
+    # forces a refresh of the internal list of available devices
+    async def discover_devices(self, timeout_secs=DEFAULT_TIMEOUT, quiet_secs=None):
+        devices = [d async for d in self.discover_iter(timeout_secs, quiet_secs)]
+        self.devices = devices
+        self.lights = [d for d in devices if isinstance(d, AsyncLight)]
+
+    # Yields an Async* device object as each new device answers, and stops
+    # like LifxLAN.discover_iter. GetVersion is broadcast along with
+    # GetService, and devices whose StateVersion went missing are asked again
+    # concurrently at the end.
+    async def discover_iter(self, timeout_secs=DEFAULT_TIMEOUT, quiet_secs=DEFAULT_QUIET_SECS):
+        listener = await self.transport.listen(BROADCAST_MAC, self.source_id)
+        msgs = [msg_type(BROADCAST_MAC, self.source_id, seq_num=listener.seq_num, payload={}, ack_requested=False, response_requested=True)
+                for msg_type in (GetService, GetVersion)]
+        replies = DiscoveryReplies(self.source_id, self.num_devices)
+        try:
+            for msg in msgs:
+                await self.wait_for_rate_limit()
+                self.send_broadcast(msg.packed_message)
+                if self.verbose:
+                    print("SEND: " + str(msg))
+            deadline = time() + timeout_secs
+            while replies.is_waiting():
+                try:
+                    response = await asyncio.wait_for(listener.get(), max(replies.get_stop_time(deadline, quiet_secs) - time(), 0))
+                except asyncio.TimeoutError:
+                    break
+                if self.verbose:
+                    print("RECV: " + str(response))
+                found = replies.add(response)
+                if found != None:
+                    yield self.make_device(*found)
+        finally:
+            self.transport.stop_listening(listener)
+        for device in await asyncio.gather(*(self.classify_device(r) for r in replies.get_unversioned())):
+            yield device
+
+    # asks the device that sent StateService r for its version, and returns the most specific Async* object for it
+    async def classify_device(self, r):
+        device = AsyncDevice(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
+        try:
+            version = await device.get_version_tuple()
+        except WorkflowException:
+            version = None
+        return self.make_device(r, version)
+
+    # returns the most specific Async* object for the device that sent
+    # StateService r, given its (vendor, product, version) (None if unknown)
+    def make_device(self, r, version):
+        device = ASYNC_DEVICE_TYPES[device_kind(version)](r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
+        if version != None:
+            device.vendor, device.product, device.version = version
+        return device
+
+    async def get_multizone_lights(self):
+        return [l for l in await self.get_lights() if isinstance(l, AsyncMultiZoneLight)]
+
+    async def get_infrared_lights(self):
+        lights = await self.get_lights()
+        supported = await asyncio.gather(*(l.supports_infrared() for l in lights))
+        return [l for (l, s) in zip(lights, supported) if s]
+
+    async def get_color_lights(self):
+        lights = await self.get_lights()
+        supported = await asyncio.gather(*(l.supports_color() for l in lights))
+        return [l for (l, s) in zip(lights, supported) if s]
+
+    async def get_tilechain_lights(self):
+        return [l for l in await self.get_lights() if isinstance(l, AsyncTileChain)]
+
+    async def get_device_by_name(self, name):
+        devices = await self.get_devices_by_name([name])
+        return devices[0] if len(devices) > 0 else None
+
+    # takes in list of strings, returns list of devices
+    async def get_devices_by_name(self, names):
+        devices = await self.get_devices()
+        labels = await asyncio.gather(*(d.get_label() for d in devices), return_exceptions=True)
+        return [d for (d, label) in zip(devices, labels) if label in names]
+
+    async def get_devices_by_group(self, group):
+        devices = await self.get_devices()
+        groups = await asyncio.gather(*(d.get_group() for d in devices), return_exceptions=True)
+        return [d for (d, g) in zip(devices, groups) if g == group]
+
+    async def get_devices_by_location(self, location):
+        devices = await self.get_devices()
+        locations = await asyncio.gather(*(d.get_location() for d in devices), return_exceptions=True)
+        return [d for (d, l) in zip(devices, locations) if l == location]
+
+    # returns dict of AsyncLight: power_level pairs
+    async def get_power_all_lights(self):
+        responses = await self.broadcast_with_resp(LightGetPower, LightStatePower)
+        if self.lights == None:
+            await self.discover_devices()
+        by_mac = dict((r.target_addr, r.power_level) for r in responses)
+        return dict((light, by_mac[light.mac_addr]) for light in self.lights if light.mac_addr in by_mac)
+
+    async def set_power_all_lights(self, power_level, duration=0, rapid=False):
+        on = [True, 1, "on", 65535]
+        off = [False, 0, "off"]
+        if power_level in on:
+            payload = {"power_level": 65535, "duration": duration}
+        elif power_level in off:
+            payload = {"power_level": 0, "duration": duration}
+        else:
+            raise InvalidParameterException("{} is not a valid power level.".format(power_level))
+        if rapid:
+            await self.broadcast_fire_and_forget(LightSetPower, payload, num_repeats=1)
+        else:
+            await self.broadcast_with_ack(LightSetPower, payload)
+
+    # returns dict of AsyncLight: color pairs
+    async def get_color_all_lights(self):
+        responses = await self.broadcast_with_resp(LightGet, LightState)
+        if self.lights == None:
+            await self.discover_devices()
+        by_mac = dict((r.target_addr, r) for r in responses)
+        colors = {}
+        for light in self.lights:
+            if light.mac_addr in by_mac:
+                response = by_mac[light.mac_addr]
+                colors[light] = light.color = light.cache_state("color", response.color)
+                # LightState carries the power level and label too
+                light.power_level = light.cache_state("power_level", response.power_level)
+                light.label = light.cache_state("label", response.label)
+        return colors
+
+    async def set_color_all_lights(self, color, duration=0, rapid=False):
+        if len(color) != 4:
+            raise InvalidParameterException("{} is not a valid color.".format(color))
+        if rapid:
+            await self.broadcast_fire_and_forget(LightSetColor, {"color": color, "duration": duration}, num_repeats=1)
+        else:
+            await self.broadcast_with_ack(LightSetColor, {"color": color, "duration": duration})
+
+    async def set_waveform_all_lights(self, is_transient, color, period, cycles, duty_cycle, waveform, rapid=False):
+        if len(color) != 4:
+            raise InvalidParameterException("{} is not a valid color.".format(color))
+        payload = {"transient": is_transient, "color": color, "period": period, "cycles": cycles, "duty_cycle": duty_cycle, "waveform": waveform}
+        if rapid:
+            await self.broadcast_fire_and_forget(LightSetWaveform, payload, num_repeats=1)
+        else:
+            await self.broadcast_with_ack(LightSetWaveform, payload)
+
+    ############################################################################
+    #                                                                          #
+    #                            Workflow Methods                              #
+    #                                                                          #
+    ############################################################################
+
+    async def broadcast_fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS):
+        await self.transport.open()
+        seq_num = self.transport.next_seq_num(BROADCAST_MAC, self.source_id)
+        msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=seq_num, payload=payload, ack_requested=False, response_requested=False)
+        sleep_interval = 0.05 if num_repeats > 20 else 0
+        for i in range(num_repeats):
+            if i > 0:
+                await asyncio.sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
+            await self.wait_for_rate_limit()
+            self.send_broadcast(msg.packed_message)
+            if self.verbose:
+                print("SEND: " + str(msg))
+
+    async def broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        ack_requested = response_type == Acknowledgement
+        replies = await self.broadcast_request(msg_type, [response_type], payload, ack_requested, not ack_requested, timeout_secs, max_attempts)
+        return [device_replies[response_type] for device_replies in replies]
+
+    async def broadcast_with_ack(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT+0.5, max_attempts=DEFAULT_ATTEMPTS):
+        await self.broadcast_with_resp(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
+
+    # Returns an (ack, response) tuple for each device that sent both
+    async def broadcast_with_ack_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT+0.5, max_attempts=DEFAULT_ATTEMPTS):
+        replies = await self.broadcast_request(msg_type, [Acknowledgement, response_type], payload, True, True, timeout_secs, max_attempts)
+        return [(device_replies[Acknowledgement], device_replies[response_type]) for device_replies in replies]
+
+    # Returns a list with a {response_type: response} dict for each device that
+    # replied with every one of response_types, in the order they completed
+    async def broadcast_request(self, msg_type, response_types, payload, ack_requested, response_requested, timeout_secs, max_attempts):
+        loop = asyncio.get_running_loop()
+        listener = await self.transport.listen(BROADCAST_MAC, self.source_id)
+        msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=listener.seq_num, payload=payload, ack_requested=ack_requested, response_requested=response_requested)
+        replies = []
+        pending = {} # target_addr: {response_type: response}, until complete
+        addr_seen = set()
+        try:
+            for attempt in range(max_attempts):
+                if self.num_devices != None and len(addr_seen) >= self.num_devices:
+                    break
+                await self.wait_for_rate_limit()
+                self.send_broadcast(msg.packed_message)
+                if self.verbose:
+                    print("SEND: " + str(msg))
+                deadline = loop.time() + timeout_secs
+                while (self.num_devices == None or len(addr_seen) < self.num_devices) and loop.time() < deadline:
+                    try:
+                        response = await asyncio.wait_for(listener.get(), deadline - loop.time())
+                    except asyncio.TimeoutError:
+                        break
+                    if self.verbose:
+                        print("RECV: " + str(response))
+                    if type(response) in response_types and response.source_id == self.source_id:
+                        if response.target_addr not in addr_seen and response.target_addr != BROADCAST_MAC:
+                            device_replies = pending.setdefault(response.target_addr, {})
+                            device_replies[type(response)] = response
+                            if len(device_replies) == len(response_types):
+                                del pending[response.target_addr]
+                                addr_seen.add(response.target_addr)
+                                replies.append(device_replies)
+        finally:
+            self.transport.stop_listening(listener)
+        return replies
+
+    async def wait_for_rate_limit(self):
+        delay = self.transport.rate_limiter.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def set_rate_limit(self, rate, burst=None):
+        self.transport.rate_limiter.set_rate(rate, burst)
+
+    def get_rate_limit_stats(self):
+        return self.transport.rate_limiter.get_stats()
+
+    def send_broadcast(self, packet):
+        for ip_addr in UDP_BROADCAST_IP_ADDRS:
+            self.transport.sendto(packet, (ip_addr, UDP_BROADCAST_PORT))
+
+    def close(self):
+        self.transport.close()
@@ -0,0 +1,185 @@
+# coding=utf-8
+# codec.py
+# Precompiled struct layouts for the LIFX LAN protocol.
+#
+# Every field in the protocol is little endian and byte aligned (the only
+# sub-byte fields live in the header and are combined into whole integers
+# before packing), so the header and each message payload can be described by
+# a single struct.Struct that is compiled once at import time. Color arrays
+# are variable length in some messages, so their layouts are compiled lazily
+# per color count and cached.
+
+import struct
+from itertools import chain
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+##### HEADER #####
+
+# size, flags (origin/tagged/addressable/protocol), source, target (MAC + 2
+# padding bytes), 6 reserved, response flags (ack/res), sequence, 8 reserved,
+# message type, 2 reserved
+HEADER = struct.Struct("<HHI8s6xBB8xH2x")
+
+# offsets of the header fields that can be patched in place (see PacketTemplate)
+HEADER_FLAGS_OFFSET = 2
+HEADER_SOURCE_OFFSET = 4
+HEADER_TARGET_OFFSET = 8
+HEADER_SEQ_NUM_OFFSET = 23
+
+##### PAYLOADS #####
+
+# Device messages
+STATE_SERVICE = struct.Struct("<BI")
+STATE_HOST_INFO = struct.Struct("<fIIh")
+STATE_HOST_FIRMWARE = struct.Struct("<QQI")
+STATE_WIFI_INFO = STATE_HOST_INFO
+STATE_WIFI_FIRMWARE = STATE_HOST_FIRMWARE
+POWER = struct.Struct("<H")
+LABEL = struct.Struct("<32s")
+STATE_VERSION = struct.Struct("<III")
+STATE_INFO = struct.Struct("<QQQ")
+STATE_LOCATION = struct.Struct("<16s32sQ")
+STATE_GROUP = STATE_LOCATION
+ECHO_REQUEST = struct.Struct("<64s")
+STATE_UNHANDLED = struct.Struct("<H")
+
+# Light messages
+LIGHT_SET_COLOR = struct.Struct("<B4HI")
+LIGHT_SET_WAVEFORM = struct.Struct("<BB4HIfhB")
+LIGHT_SET_WAVEFORM_OPTIONAL = struct.Struct("<BB4HIfhB4B")
+LIGHT_STATE = struct.Struct("<4HHH32sQ")
+LIGHT_SET_POWER = struct.Struct("<HI")
+INFRARED = struct.Struct("<H")
+
+# Multizone messages
+MULTIZONE_SET_COLOR_ZONES = struct.Struct("<BB4HIB")
+MULTIZONE_GET_COLOR_ZONES = struct.Struct("<BB")
+MULTIZONE_STATE_ZONE = struct.Struct("<BB4H")
+MULTIZONE_STATE_MULTIZONE_HEADER = struct.Struct("<BB")
+MULTIZONE_EFFECT = struct.Struct("<IBHIQII8I")
+MULTIZONE_SET_EXTENDED_COLOR_ZONES_HEADER = struct.Struct("<IBHB")
+MULTIZONE_STATE_EXTENDED_COLOR_ZONES_HEADER = struct.Struct("<HHB")
+
+# Tile messages
+STATE_DEVICE_CHAIN_START = struct.Struct("<B")
+TILE = struct.Struct("<4h2f3B3I2Q2I")
+STATE_DEVICE_CHAIN_END = struct.Struct("<B")
+SET_USER_POSITION = struct.Struct("<BHff")
+GET_TILE_STATE_64 = struct.Struct("<6B")
+STATE_TILE_STATE_64_HEADER = struct.Struct("<5B")
+SET_TILE_STATE_64_HEADER = struct.Struct("<6BI")
+SET_TILE_EFFECT_HEADER = struct.Struct("<BBIBIQII8IB")
+STATE_TILE_EFFECT_HEADER = struct.Struct("<BIBIQII8IB")
+
+# Switch messages
+GET_RPOWER = struct.Struct("<B")
+RPOWER = struct.Struct("<BH")
+
+# HSBK, four uint16s
+COLOR = struct.Struct("<4H")
+
+# Single fields, for patching packets in place
+UINT8 = struct.Struct("<B")
+UINT16 = struct.Struct("<H")
+UINT32 = struct.Struct("<I")
+INT16 = struct.Struct("<h")
+FLOAT32 = struct.Struct("<f")
+TARGET = struct.Struct("<8s")
+
+# Order of the per-tile fields in StateDeviceChain, matching TILE
+TILE_FIELDS = ("reserved1", "reserved2", "reserved3", "reserved4", "user_x", "user_y", "width", "height", "reserved5",
+               "device_version_vendor", "device_version_product", "device_version_version", "firmware_build",
+               "reserved6", "firmware_version", "reserved7")
+
+_color_array_structs = {}
+
+def color_array_struct(count):
+    s = _color_array_structs.get(count)
+    if s == None:
+        s = struct.Struct("<{}H".format(count * 4))
+        _color_array_structs[count] = s
+    return s
+
+def pack_colors(colors):
+    if is_color_array(colors):
+        return colors.astype(COLOR_DTYPE, copy=False).tobytes()
+    return color_array_struct(len(colors)).pack(*chain.from_iterable(colors))
+
+def pack_color_into(buffer, offset, color):
+    COLOR.pack_into(buffer, offset, *color)
+
+def pack_colors_into(buffer, offset, colors):
+    if is_color_array(colors):
+        data = pack_colors(colors)
+        buffer[offset:offset + len(data)] = data
+    else:
+        color_array_struct(len(colors)).pack_into(buffer, offset, *chain.from_iterable(colors))
+
+##### NUMPY COLOR ARRAYS #####
+
+# Optional. When enabled, the color arrays of the zone and tile messages
+# (StateTileState64, SetTileState64, MultiZoneStateExtendedColorZones and
+# MultiZoneSetExtendedColorZones) decode to (N, 4) uint16 arrays that are
+# read-only views of the received datagram rather than lists of tuples, and
+# the TileChain and MultiZoneLight color getters return arrays. Outgoing
+# messages accept (N, 4) arrays either way.
+
+COLOR_DTYPE = "<u2"
+
+_numpy_colors = False
+
+def use_numpy_colors(enabled=True):
+    global _numpy_colors
+    if enabled and np == None:
+        raise ImportError("NumPy color arrays require numpy to be installed.")
+    _numpy_colors = enabled
+
+def numpy_colors_enabled():
+    return _numpy_colors
+
+def is_color_array(colors):
+    return np != None and isinstance(colors, np.ndarray)
+
+def unpack_color_array(buffer, offset, count):
+    if _numpy_colors:
+        return np.frombuffer(buffer, dtype=COLOR_DTYPE, count=count * 4, offset=offset).reshape(-1, 4)
+    return list(COLOR.iter_unpack(buffer[offset:offset + count * COLOR.size]))
+
+# concatenates color segments, e.g. the zones from several extended replies
+def join_colors(segments):
+    if _numpy_colors:
+        if len(segments) == 0:
+            return np.empty((0, 4), dtype=COLOR_DTYPE)
+        return np.concatenate(segments)
+    return list(chain.from_iterable(segments))
+
+# a list of HSBK tuples as an (N, 4) array in NumPy mode, e.g. zones read
+# with the original multizone messages
+def color_array(colors):
+    if _numpy_colors and not is_color_array(colors):
+        return np.array(colors, dtype=COLOR_DTYPE).reshape(-1, 4)
+    return colors
+
+# stacks per-tile color arrays into a (tiles, 64, 4) array in NumPy mode
+def stack_colors(tiles):
+    if _numpy_colors:
+        return np.stack(tiles)
+    return tiles
+
+##### HEADER PACKING #####
+
+def make_flags(tagged=0, origin=0, addressable=1, protocol=1024):
+    return (origin << 14) | (tagged << 13) | (addressable << 12) | protocol
+
+def pack_header(size, source_id, target_addr, seq_num, msg_type, tagged=0, ack_requested=0, response_requested=0,
+                origin=0, addressable=1, protocol=1024):
+    flags = make_flags(tagged, origin, addressable, protocol)
+    response_flags = (ack_requested << 1) | response_requested
+    return HEADER.pack(size, flags, source_id, mac_to_bytes(target_addr), response_flags, seq_num, msg_type)
+
+def mac_to_bytes(addr):
+    return bytes.fromhex(addr.replace(":", "")).ljust(8, b"\x00")
@@ -19,7 +19,9 @@
 # per device, and also to capture in real time when a service is down (port = 0).
 
 from datetime import datetime
-from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, socket, timeout, gethostbyname_ex, gethostname
+from collections import deque
+from queue import Empty
+from threading import Condition, Lock
 from time import sleep, time
 import ifaddr
 import platform
@@ -28,13 +30,32 @@ import struct
 from .errors import WorkflowException
 from .msgtypes import Acknowledgement, GetGroup, GetHostFirmware, GetInfo, GetLabel, GetLocation, GetPower, GetVersion, \
     GetWifiFirmware, GetWifiInfo, SERVICE_IDS, SetLabel, SetPower, StateGroup, StateHostFirmware, StateInfo, StateLabel, \
-    StateLocation, StatePower, StateVersion, StateWifiFirmware, StateWifiInfo, str_map
+    StateLocation, StatePower, StateVersion, StateWifiFirmware, StateWifiInfo, str_map, LightSetColor, LightSetInfrared, \
+    LightSetPower, LightSetWaveform, LightSetWaveformOptional, MultiZoneSetColorZones, MultiZoneSetExtendedColorZones, SetMultiZoneEffect
 from .message import BROADCAST_MAC
+from .packettemplate import PacketTemplate
 from .products import features_map, product_map, light_products, switch_products
-from .unpack import unpack_lifx_message
+from .ratelimit import DEFAULT_DEVICE_BURST, DEFAULT_DEVICE_RATE, TokenBucket, coalesce_key
+from .rtt import MAX_RETRANSMIT_SECS, RttEstimator
+from .transport import default_transport
 
 DEFAULT_TIMEOUT = 1 #second
-DEFAULT_ATTEMPTS = 1
+DEFAULT_ATTEMPTS = 1 # requests are retransmitted as needed within timeout_secs * max_attempts
+DEFAULT_REQUEST_WINDOW = 4 # max requests in flight to one device
+
+# Cached state (see cache_state) that each Set message makes out of date
+INVALIDATED_STATE = {
+    SetPower: ("power_level",),
+    SetLabel: ("label",),
+    LightSetPower: ("power_level",),
+    LightSetColor: ("color", "zone_frame"),
+    LightSetWaveform: ("color", "zone_frame"),
+    LightSetWaveformOptional: ("color", "zone_frame"),
+    LightSetInfrared: ("infrared_brightness",),
+    MultiZoneSetColorZones: ("zone_frame",),
+    MultiZoneSetExtendedColorZones: ("zone_frame",),
+    SetMultiZoneEffect: ("zone_frame",),
+}
 
 VERBOSE = False
 
@@ -71,13 +92,37 @@ def get_broadcast_addrs():
 UDP_BROADCAST_IP_ADDRS = get_broadcast_addrs()
 UDP_BROADCAST_PORT = 56700
 
-class Device(object):
+# Values returned by the getters, with the time they were received, so a
+# getter called with max_age can skip the round trip. Device and AsyncDevice
+# both keep their state this way.
+class StateCache(object):
+    def __init__(self):
+        self.state_cache = {} # name: (value, received_time)
+
+    # Remembers value as the latest name received from the device, and returns it
+    def cache_state(self, name, value):
+        self.state_cache[name] = (value, time())
+        return value
+
+    # True if name was received no more than max_age seconds ago (never if max_age is None)
+    def is_cached(self, name, max_age):
+        if max_age == None or name not in self.state_cache:
+            return False
+        return time() - self.state_cache[name][1] <= max_age
+
+    def invalidate_state(self, msg_type):
+        for name in INVALIDATED_STATE.get(msg_type, ()):
+            self.state_cache.pop(name, None)
+
+
+class Device(StateCache):
     # mac_addr is a string, with the ":" and everything.
     # service is an integer that maps to a service type. See SERVICE_IDS in msgtypes.py
     # source_id is a number unique to this client, will appear in responses to this client
-    def __init__(self, mac_addr, ip_addr, service, port, source_id, verbose=False):
+    # transport is the Transport whose socket this device sends and receives on (LifxLAN passes its own)
+    def __init__(self, mac_addr, ip_addr, service, port, source_id, verbose=False, transport=None):
         self.verbose = verbose
-        self.mac_addr = mac_addr
+        self.mac_addr = mac_addr.lower()
         self.port = port
         self.service = service
         self.source_id = source_id
@@ -115,10 +160,24 @@ class Device(object):
         # uptime
         # downtime
 
-        # The following attributes are used for handling multithreading requests
+        # All requests go through a shared Transport, which is safe to use from
+        # several threads at once (e.g. Group)
+
+        self.transport = transport if transport != None else default_transport
+        self.request_window_size = DEFAULT_REQUEST_WINDOW
+        self.request_window = RequestWindow(DEFAULT_REQUEST_WINDOW)
+        self.rate_limiter = TokenBucket(DEFAULT_DEVICE_RATE, DEFAULT_DEVICE_BURST)
+        # Measured round trip time, which decides when unanswered requests are resent
+        self.rtt = RttEstimator()
 
-        self.socket_counter = 0
-        self.socket_table = {}
+        # see StateCache
+        super(Device, self).__init__()
+
+        # Prebuilt packets reused by fire_and_forget, keyed by (msg_type, ack_requested, response_requested)
+        self.packet_templates = {}
+        self.packet_template_lock = Lock()
+        # Latest payload of each fire_and_forget send waiting on the rate limiter, keyed by coalesce_key
+        self.queued_payloads = {}
 
 
     ############################################################################
@@ -128,14 +187,25 @@ class Device(object):
     ############################################################################
 
     # update the device's (relatively) persistent attributes
+    # the queries are pipelined, so this takes about one round trip per request window
     def refresh(self):
-        self.label = self.get_label()
-        self.location = self.get_location()
-        self.group = self.get_group()
-        self.power_level = self.get_power()
-        self.host_firmware_build_timestamp, self.host_firmware_version = self.get_host_firmware_tuple()
-        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = self.get_wifi_firmware_tuple()
-        self.vendor, self.product, self.version = self.get_version_tuple()
+        responses = self.req_with_resp_pipelined([(GetLabel, StateLabel),
+                                                  (GetLocation, StateLocation),
+                                                  (GetGroup, StateGroup),
+                                                  (GetPower, StatePower),
+                                                  (GetHostFirmware, StateHostFirmware),
+                                                  (GetWifiFirmware, StateWifiFirmware),
+                                                  (GetVersion, StateVersion)])
+        label, location, group, power, host_firmware, wifi_firmware, version = responses
+        self.label = self.cache_state("label", label.label)
+        self.location = self.cache_state("location", location.label)
+        self.group = self.cache_state("group", group.label)
+        self.power_level = self.cache_state("power_level", power.power_level)
+        self.host_firmware_build_timestamp, self.host_firmware_version = \
+            self.cache_state("host_firmware", (host_firmware.build, firmware_version(host_firmware.version)))
+        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = \
+            self.cache_state("wifi_firmware", (wifi_firmware.build, firmware_version(wifi_firmware.version)))
+        self.vendor, self.product, self.version = self.cache_state("version", (version.vendor, version.product, version.version))
         self.product_name = self.get_product_name()
         self.product_features = self.get_product_features()
 
@@ -154,7 +224,9 @@ class Device(object):
     def get_source_id(self):
         return self.source_id
 
-    def get_label(self):
+    def get_label(self, max_age=None):
+        if self.is_cached("label", max_age):
+            return self.state_cache["label"][0]
         try:
             response = self.req_with_resp(GetLabel, StateLabel)
             self.label = response.label.encode('utf-8')
@@ -162,9 +234,11 @@ class Device(object):
                 self.label = self.label.decode('utf-8')
         except:
             raise
-        return self.label
+        return self.cache_state("label", self.label)
 
-    def get_location(self):
+    def get_location(self, max_age=None):
+        if self.is_cached("location", max_age):
+            return self.state_cache["location"][0]
         try:
             response = self.req_with_resp(GetLocation, StateLocation)
             self.location = response.label.encode('utf-8')
@@ -172,9 +246,11 @@ class Device(object):
                 self.location = self.location.decode('utf-8')
         except:
             raise
-        return self.location
+        return self.cache_state("location", self.location)
 
-    def get_group(self):
+    def get_group(self, max_age=None):
+        if self.is_cached("group", max_age):
+            return self.state_cache["group"][0]
         try:
             response = self.req_with_resp(GetGroup, StateGroup)
             self.group = response.label.encode('utf-8')
@@ -182,20 +258,23 @@ class Device(object):
                 self.group = self.group.decode('utf-8')
         except:
             raise
-        return self.group
+        return self.cache_state("group", self.group)
 
     def set_label(self, label):
         if len(label) > 32:
             label = label[:32]
         self.req_with_ack(SetLabel, {"label": label})
+        self.label = self.cache_state("label", label)
 
-    def get_power(self):
+    def get_power(self, max_age=None):
+        if self.is_cached("power_level", max_age):
+            return self.state_cache["power_level"][0]
         try:
             response = self.req_with_resp(GetPower, StatePower)
             self.power_level = response.power_level
         except:
             raise
-        return self.power_level
+        return self.cache_state("power_level", self.power_level)
 
     def set_power(self, power, rapid=False):
         on = [True, 1, "on"]
@@ -209,26 +288,38 @@ class Device(object):
         elif power in off and rapid:
             success = self.fire_and_forget(SetPower, {"power_level": 0})
 
-    def get_host_firmware_tuple(self):
+    def get_host_firmware_tuple(self, max_age=None):
+        if self.is_cached("host_firmware", max_age):
+            return self.state_cache["host_firmware"][0]
         build = None
         version = None
         try:
             response = self.req_with_resp(GetHostFirmware, StateHostFirmware)
             build = response.build
-            version = float(str(str(response.version >> 16) + "." + str(response.version & 0xff)))
+            version = firmware_version(response.version)
+            self.cache_state("host_firmware_version_tuple", firmware_version_tuple(response.version))
         except:
             raise
-        return build, version
+        return self.cache_state("host_firmware", (build, version))
 
-    def get_host_firmware_build_timestamp(self):
-        self.host_firmware_build_timestamp, self.host_firmware_version = self.get_host_firmware_tuple()
+    def get_host_firmware_build_timestamp(self, max_age=None):
+        self.host_firmware_build_timestamp, self.host_firmware_version = self.get_host_firmware_tuple(max_age)
         return self.host_firmware_build_timestamp
 
-    def get_host_firmware_version(self):
-        self.host_firmware_build_timestamp, self.host_firmware_version = self.get_host_firmware_tuple()
+    def get_host_firmware_version(self, max_age=None):
+        self.host_firmware_build_timestamp, self.host_firmware_version = self.get_host_firmware_tuple(max_age)
         return self.host_firmware_version
 
-    def get_wifi_info_tuple(self):
+    # (major, minor) as integers, for comparing versions: unlike the float
+    # from get_host_firmware_version, 2.100 comes after 2.8 here
+    def get_host_firmware_version_tuple(self, max_age=None):
+        if not self.is_cached("host_firmware_version_tuple", max_age):
+            self.get_host_firmware_tuple()
+        return self.state_cache["host_firmware_version_tuple"][0]
+
+    def get_wifi_info_tuple(self, max_age=None):
+        if self.is_cached("wifi_info", max_age):
+            return self.state_cache["wifi_info"][0]
         signal = None
         tx = None
         rx = None
@@ -239,40 +330,44 @@ class Device(object):
             rx = response.rx
         except:
             raise
-        return signal, tx, rx
+        return self.cache_state("wifi_info", (signal, tx, rx))
 
-    def get_wifi_signal_mw(self):
-        signal, tx, rx = self.get_wifi_info_tuple()
+    def get_wifi_signal_mw(self, max_age=None):
+        signal, tx, rx = self.get_wifi_info_tuple(max_age)
         return signal
 
-    def get_wifi_tx_bytes(self):
-        signal, tx, rx = self.get_wifi_info_tuple()
+    def get_wifi_tx_bytes(self, max_age=None):
+        signal, tx, rx = self.get_wifi_info_tuple(max_age)
         return tx
 
-    def get_wifi_rx_bytes(self):
-        signal, tx, rx = self.get_wifi_info_tuple()
+    def get_wifi_rx_bytes(self, max_age=None):
+        signal, tx, rx = self.get_wifi_info_tuple(max_age)
         return rx
 
-    def get_wifi_firmware_tuple(self):
+    def get_wifi_firmware_tuple(self, max_age=None):
+        if self.is_cached("wifi_firmware", max_age):
+            return self.state_cache["wifi_firmware"][0]
         build = None
         version = None
         try:
             response = self.req_with_resp(GetWifiFirmware, StateWifiFirmware)
             build = response.build
-            version = float(str(str(response.version >> 16) + "." + str(response.version & 0xff)))
+            version = firmware_version(response.version)
         except:
             raise
-        return build, version
+        return self.cache_state("wifi_firmware", (build, version))
 
-    def get_wifi_firmware_build_timestamp(self):
-        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = self.get_wifi_firmware_tuple()
+    def get_wifi_firmware_build_timestamp(self, max_age=None):
+        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = self.get_wifi_firmware_tuple(max_age)
         return self.wifi_firmware_build_timestamp
 
-    def get_wifi_firmware_version(self):
-        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = self.get_wifi_firmware_tuple()
+    def get_wifi_firmware_version(self, max_age=None):
+        self.wifi_firmware_build_timestamp, self.wifi_firmware_version = self.get_wifi_firmware_tuple(max_age)
         return self.wifi_firmware_version
 
-    def get_version_tuple(self):
+    def get_version_tuple(self, max_age=None):
+        if self.is_cached("version", max_age):
+            return self.state_cache["version"][0]
         vendor = None
         product = None
         version = None
@@ -283,7 +378,7 @@ class Device(object):
             version = response.version
         except:
             raise
-        return vendor, product, version
+        return self.cache_state("version", (vendor, product, version))
 
     def get_product_name(self):
         product_name = None
@@ -305,19 +400,21 @@ class Device(object):
             product_features = features_map[None]
         return product_features
 
-    def get_vendor(self):
-        self.vendor, self.product, self.version = self.get_version_tuple()
+    def get_vendor(self, max_age=None):
+        self.vendor, self.product, self.version = self.get_version_tuple(max_age)
         return self.vendor
 
-    def get_product(self):
-        self.vendor, self.product, self.version = self.get_version_tuple()
+    def get_product(self, max_age=None):
+        self.vendor, self.product, self.version = self.get_version_tuple(max_age)
         return self.product
 
-    def get_version(self):
-        self.vendor, self.product, self.version = self.get_version_tuple()
+    def get_version(self, max_age=None):
+        self.vendor, self.product, self.version = self.get_version_tuple(max_age)
         return self.version
 
-    def get_location_tuple(self):
+    def get_location_tuple(self, max_age=None):
+        if self.is_cached("location_tuple", max_age):
+            return self.state_cache["location_tuple"][0]
         label = None
         updated_at = None
         try:
@@ -327,17 +424,19 @@ class Device(object):
             updated_at = response.updated_at
         except:
             raise
-        return self.location, label, updated_at
+        return self.cache_state("location_tuple", (self.location, label, updated_at))
 
-    def get_location_label(self):
-        self.location, label, updated_at = self.get_location_tuple()
+    def get_location_label(self, max_age=None):
+        self.location, label, updated_at = self.get_location_tuple(max_age)
         return label
 
-    def get_location_updated_at(self):
-        self.location, label, updated_at = self.get_location_tuple()
+    def get_location_updated_at(self, max_age=None):
+        self.location, label, updated_at = self.get_location_tuple(max_age)
         return updated_at
 
-    def get_group_tuple(self):
+    def get_group_tuple(self, max_age=None):
+        if self.is_cached("group_tuple", max_age):
+            return self.state_cache["group_tuple"][0]
         try:
             response = self.req_with_resp(GetGroup, StateGroup)
             self.group = response.group
@@ -345,17 +444,19 @@ class Device(object):
             updated_at = response.updated_at
         except:
             raise
-        return self.group, label, updated_at
+        return self.cache_state("group_tuple", (self.group, label, updated_at))
 
-    def get_group_label(self):
-        self.group, label, updated_at = self.get_group_tuple()
+    def get_group_label(self, max_age=None):
+        self.group, label, updated_at = self.get_group_tuple(max_age)
         return label
 
-    def get_group_updated_at(self):
-        self.group, label, updated_at = self.get_group_tuple()
+    def get_group_updated_at(self, max_age=None):
+        self.group, label, updated_at = self.get_group_tuple(max_age)
         return updated_at
 
-    def get_info_tuple(self):
+    def get_info_tuple(self, max_age=None):
+        if self.is_cached("info", max_age):
+            return self.state_cache["info"][0]
         time = None
         uptime = None
         downtime = None
@@ -366,18 +467,18 @@ class Device(object):
             downtime = response.downtime
         except:
             raise
-        return time, uptime, downtime
+        return self.cache_state("info", (time, uptime, downtime))
 
-    def get_time(self):
-        time, uptime, downtime = self.get_info_tuple()
+    def get_time(self, max_age=None):
+        time, uptime, downtime = self.get_info_tuple(max_age)
         return time
 
-    def get_uptime(self):
-        time, uptime, downtime = self.get_info_tuple()
+    def get_uptime(self, max_age=None):
+        time, uptime, downtime = self.get_info_tuple(max_age)
         return uptime
 
-    def get_downtime(self):
-        time, uptime, downtime = self.get_info_tuple()
+    def get_downtime(self, max_age=None):
+        time, uptime, downtime = self.get_info_tuple(max_age)
         return downtime
 
     # Support for Lifx Product ID 70, 71 and 89
@@ -486,23 +587,60 @@ class Device(object):
 
     # Don't wait for Acks or Responses, just send the same message repeatedly as fast as possible
     def fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS):
-        socket_id = self.initialize_socket(timeout_secs)
-        sock = self.socket_table[socket_id]
-        msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=False)
-        sent_msg_count = 0
+        self.invalidate_state(msg_type)
+        key = coalesce_key(msg_type, payload) if num_repeats == 1 else None
+        if key != None:
+            with self.packet_template_lock:
+                if key in self.queued_payloads:
+                    # the same message is already waiting on the rate limiter,
+                    # so it goes out once, with the newest payload
+                    self.queued_payloads[key] = payload
+                    self.rate_limiter.record_coalesced()
+                    return
+                self.queued_payloads[key] = payload
+        self.wait_for_rate_limit()
+        # the template is shared with other threads sending to this device, so
+        # patch it and snapshot what we are about to send while holding the lock
+        with self.packet_template_lock:
+            if key != None:
+                payload = self.queued_payloads.pop(key)
+            template = self.get_packet_template(msg_type, payload)
+            template.set_seq_num(self.transport.next_seq_num(self.mac_addr, self.source_id))
+            packet = template.packed_message if num_repeats == 1 else bytes(template.packed_message)
+            self.transmit(packet)
+            if self.verbose:
+                print("SEND: " + str(template))
+        sent_msg_count = 1
         sleep_interval = 0.05 if num_repeats > 20 else 0
         while(sent_msg_count < num_repeats):
-            if self.ip_addr:
-                sock.sendto(msg.packed_message, (self.ip_addr, self.port))
-            else:
-                for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                    sock.sendto(msg.packed_message, (ip_addr, self.port))
-            if self.verbose:
-                print("SEND: " + str(msg))
+            sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
+            self.send_packet(packet)
             sent_msg_count += 1
-            if sent_msg_count < num_repeats:
-                sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
-        self.close_socket(socket_id)
+
+    # Returns this device's PacketTemplate for msg_type, patched with payload.
+    # The template is rebuilt only when payload doesn't fit its layout.
+    # Callers sharing the device between threads should hold packet_template_lock.
+    def get_packet_template(self, msg_type, payload={}, ack_requested=False, response_requested=False):
+        key = (msg_type, ack_requested, response_requested)
+        template = self.packet_templates.get(key)
+        if template != None and template.fits(payload):
+            template.set_payload(payload)
+        else:
+            template = PacketTemplate(msg_type, self.mac_addr, self.source_id, payload, ack_requested, response_requested)
+            self.packet_templates[key] = template
+        return template
+
+    def send_packet(self, packet):
+        self.wait_for_rate_limit()
+        self.transmit(packet)
+
+    # sends packet right away, ignoring the rate limits
+    def transmit(self, packet):
+        if self.ip_addr:
+            self.transport.sendto(packet, (self.ip_addr, self.port))
+        else:
+            for ip_addr in UDP_BROADCAST_IP_ADDRS:
+                self.transport.sendto(packet, (ip_addr, self.port))
 
     # Usually used for Set messages
     def req_with_ack(self, msg_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
@@ -510,163 +648,106 @@ class Device(object):
 
     # Usually used for Get messages, or for state confirmation after Set (hence the optional payload)
     def req_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        # Need to put error checking here for aguments
-        
-        if type(response_type) != type([]):
-            response_type = [response_type]
-        success = False
-        device_response = None
-        socket_id = self.initialize_socket(timeout_secs)
-        sock = self.socket_table[socket_id]
-        if len(response_type) == 1 and Acknowledgement in response_type:
-            msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=True, response_requested=False)
-        else:
-            msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=True)
-        response_seen = False
-        attempts = 0
-        while not response_seen and attempts < max_attempts:
-            sent = False
-            start_time = time()
-            timedout = False
-            while not response_seen and not timedout:
-                if not sent:
-                    if self.ip_addr:
-                        sock.sendto(msg.packed_message, (self.ip_addr, self.port))
-                    else:
-                        for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                            sock.sendto(msg.packed_message, (ip_addr, self.port))
-                    sent = True
-                    if self.verbose:
-                        print("SEND: " + str(msg))
-                try:
-                    data, (ip_addr, port) = sock.recvfrom(1024)
-                    response = unpack_lifx_message(data)
-                    if self.verbose:
-                        print (type(response))
-                        print("RECV: " + str(response))
-                    if type(response) in response_type:
-                        if response.source_id == self.source_id and (response.target_addr == self.mac_addr or response.target_addr == BROADCAST_MAC):
-                            response_seen = True
-                            device_response = response
-                            self.ip_addr = ip_addr
-                            success = True
-                except timeout:
-                    pass
-                elapsed_time = time() - start_time
-                timedout = True if elapsed_time > timeout_secs else False
-            attempts += 1
-        if not success:
-            self.close_socket(socket_id)
-            raise WorkflowException("WorkflowException: Did not receive {} from {} (Name: {}) in response to {}".format(str(response_type), str(self.mac_addr), str(self.label), str(msg_type)))
-        else:
-            self.close_socket(socket_id)
-        return device_response
+        request = self.start_request(msg_type, response_type, payload)
+        return request.wait(timeout_secs, max_attempts)[-1]
 
-    # For requests that expect multiple response packets (like GetExtendedColorZones)
-    def req_with_multiple_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+    # Sends one packet asking for both an acknowledgement and a state response
+    # (usually a Set, to confirm the new state without a separate Get), and
+    # returns (ack, response)
+    def req_with_ack_resp(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        request = self.start_request(msg_type, [Acknowledgement, response_type], payload)
+        replies = {}
+        def is_complete(response):
+            replies[type(response)] = response
+            return len(replies) == 2
+        request.wait(timeout_secs, max_attempts, is_complete)
+        return (replies[Acknowledgement], replies[response_type])
+
+    # For requests that expect multiple response packets (like GetExtendedColorZones).
+    # With partial=True, whatever replies arrived are returned once the device
+    # goes quiet, rather than resending the request for all of them; the
+    # caller asks again for what's missing.
+    def req_with_multiple_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, is_complete=None, partial=False):
+        if is_complete == None:
+            is_complete = is_last_zone_segment
+        request = self.start_request(msg_type, response_type, payload)
+        return request.wait(timeout_secs, max_attempts, is_complete, partial)
+
+    # Sends several requests without waiting for each reply in turn, keeping up
+    # to request_window of them in flight, and returns their responses in order.
+    # requests is a list of (msg_type, response_type) or (msg_type, response_type, payload).
+    def req_with_resp_pipelined(self, requests, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
+        responses = [None] * len(requests)
+        in_flight = deque()
+        try:
+            for (i, request) in enumerate(requests):
+                # Other threads may hold part of the window, so only block on
+                # it once this call has nothing of its own left to wait for.
+                while in_flight and not self.request_window.acquire(False):
+                    j, oldest = in_flight.popleft()
+                    responses[j] = oldest.wait(timeout_secs, max_attempts)[-1]
+                if not in_flight:
+                    self.request_window.acquire()
+                in_flight.append((i, self.start_request(*request, reserved_window=True)))
+            while in_flight:
+                j, oldest = in_flight.popleft()
+                responses[j] = oldest.wait(timeout_secs, max_attempts)[-1]
+        finally:
+            for (j, request) in in_flight:
+                request.finish()
+        return responses
+
+    # Sends msg_type and returns a PendingRequest for its replies. Blocks while
+    # request_window requests to this device are already in flight.
+    def start_request(self, msg_type, response_type, payload={}, reserved_window=False):
         if type(response_type) != type([]):
             response_type = [response_type]
-        
-        all_responses = []
-        success = False
-        socket_id = self.initialize_socket(timeout_secs)
-        sock = self.socket_table[socket_id]
-        msg = msg_type(self.mac_addr, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=True)
-        
-        attempts = 0
-        while attempts < max_attempts:
-            sent = False
-            start_time = time()
-            responses_this_attempt = []
-            
-            # Keep collecting responses until timeout or we have all expected responses
-            while True:
-                if not sent:
-                    if self.ip_addr:
-                        sock.sendto(msg.packed_message, (self.ip_addr, self.port))
-                    else:
-                        for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                            sock.sendto(msg.packed_message, (ip_addr, self.port))
-                    sent = True
-                    if self.verbose:
-                        print("SEND: " + str(msg))
-                
-                try:
-                    data, (ip_addr, port) = sock.recvfrom(1024)
-                    response = unpack_lifx_message(data)
-                    
-                    if self.verbose:
-                        print(type(response))
-                        print("RECV: " + str(response))
-                    
-                    if type(response) in response_type:
-                        if response.source_id == self.source_id and (response.target_addr == self.mac_addr or response.target_addr == BROADCAST_MAC):
-                            responses_this_attempt.append(response)
-                            self.ip_addr = ip_addr
-                            
-                            # Check if we have all expected responses
-                            # if len(responses_this_attempt) >= expected_responses:
-                            #     success = True
-                            #     all_responses = responses_this_attempt
-                            #     break
-                            
-                            # For ExtendedColorZones, check if this is the last packet
-                            if hasattr(response, 'index') and hasattr(response, 'count') and hasattr(response, 'cCount'):
-                                # If index + cCount >= count, this should be the last packet
-                                if response.index + response.cCount >= response.count:
-                                    success = True
-                                    all_responses = responses_this_attempt
-                                    break
-                            else:
-                                raise WorkflowException("WorkflowException: Response type {} does not have expected attributes for req_with_multiple_resp".format(type(response)))
-
-                except timeout:
-                    pass
-                
-                elapsed_time = time() - start_time
-                if elapsed_time > timeout_secs:
-                    break
-            
-            if success:
-                break
-            attempts += 1
-        
-        if not success:
-            self.close_socket(socket_id)
-            raise WorkflowException("WorkflowException: Did not receive complete {} response from {} (Name: {}) in response to {}".format(str(response_type), str(self.mac_addr), str(self.label), str(msg_type)))
-        else:
-            self.close_socket(socket_id)
-        
-        return all_responses
+        self.invalidate_state(msg_type)
+        if not reserved_window:
+            self.request_window.acquire()
+        try:
+            request = PendingRequest(self, msg_type, response_type, payload)
+        except:
+            self.request_window.release()
+            raise
+        try:
+            request.send()
+        except:
+            # e.g. the network is unreachable; give back the window slot and listener
+            request.finish()
+            raise
+        return request
 
-    # Not currently implemented, although the LIFX LAN protocol supports this kind of workflow natively
-    def req_with_ack_resp(self, msg_type, response_type, payload, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        pass
+    # Blocks until both this device's and the transport's rate limits allow another packet
+    def wait_for_rate_limit(self):
+        delay = max(self.rate_limiter.reserve(), self.transport.rate_limiter.reserve())
+        if delay > 0:
+            sleep(delay)
 
-    ############################################################################
-    #                                                                          #
-    #                              Socket Methods                              #
-    #                                                                          #
-    ############################################################################
+    # rate in messages per second (None for unlimited)
+    def set_rate_limit(self, rate, burst=None):
+        self.rate_limiter.set_rate(rate, burst)
+
+    # returns how often sends to this device were delayed or coalesced
+    def get_rate_limit_stats(self):
+        return self.rate_limiter.get_stats()
+
+    # returns the smoothed round trip time and current retransmit timeout
+    def get_rtt_stats(self):
+        return self.rtt.get_stats()
+
+    # Can be called while requests are in flight: they keep their slots, and
+    # no new request starts until fewer than size are outstanding.
+    def set_request_window(self, size):
+        self.request_window_size = size
+        self.request_window.resize(size)
+
+    # True if response is one of response_type and was sent by this device to this client
+    def is_response(self, response, response_type):
+        if type(response) in response_type:
+            return response.source_id == self.source_id and (response.target_addr == self.mac_addr or response.target_addr == BROADCAST_MAC)
+        return False
 
-    def initialize_socket(self, timeout):
-        sock = socket(AF_INET, SOCK_DGRAM)
-        sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-        sock.settimeout(timeout)
-        try:
-            sock.bind(("", 0))  # allow OS to assign next available source port
-            socket_id = self.socket_counter
-            self.socket_table[socket_id] = sock
-            self.socket_counter += 1
-            return socket_id
-        except Exception as err:
-            raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
-
-    def close_socket(self, socket_id):
-        sock = self.socket_table.pop(socket_id, None)
-        if sock != None:
-            sock.close()
 
     def __repr__(self):
         return '<{cls}: {label!r} ({group!r} @ {location!r})>'.format(
@@ -676,11 +757,146 @@ class Device(object):
             location=self.get_location_label())
 
 
+################################################################################
+#                                                                              #
+#                             Pending Requests                                 #
+#                                                                              #
+################################################################################
+
+# A request that has been sent to a device and is waiting for its replies.
+# It holds one slot of the device's request window until finish() is called.
+class PendingRequest(object):
+    def __init__(self, device, msg_type, response_type, payload={}):
+        self.device = device
+        self.msg_type = msg_type
+        self.response_type = response_type
+        self.listener = device.transport.listen(device.mac_addr, device.source_id)
+        # an Acknowledgement and a state message can both be asked for in one packet
+        ack_requested = Acknowledgement in response_type
+        response_requested = len(response_type) > 1 or not ack_requested
+        self.msg = msg_type(device.mac_addr, device.source_id, seq_num=self.listener.seq_num, payload=payload,
+                            ack_requested=ack_requested, response_requested=response_requested)
+        self.sent_time = None
+        self.finished = False
+
+    def send(self):
+        self.device.send_packet(self.msg.packed_message)
+        self.sent_time = time()
+        if self.device.verbose:
+            print("SEND: " + str(self.msg))
+
+    # Returns the matching replies once is_complete(reply) is True (by default,
+    # the first reply). The request is resent whenever the device's retransmit
+    # timeout passes without a reply, doubling the timeout each time, until
+    # timeout_secs * max_attempts have passed since it was first sent. If
+    # partial, the request is not resent once replies start coming in, and the
+    # replies so far are returned when none arrives for a retransmit timeout.
+    def wait(self, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, is_complete=None, partial=False):
+        device = self.device
+        first_sent_time = self.sent_time
+        deadline = first_sent_time + timeout_secs * max_attempts
+        retransmit_secs = device.rtt.get_retransmit_secs()
+        next_send_time = first_sent_time + retransmit_secs
+        retransmitted = False
+        responses = []
+        seen = set()
+        try:
+            while True:
+                now = time()
+                try:
+                    # replies queued before the deadline still count after it has passed
+                    if now >= deadline:
+                        response = self.listener.get_nowait()
+                    else:
+                        response = self.listener.get(timeout=max(min(next_send_time, deadline) - now, 0))
+                except Empty:
+                    if now >= deadline:
+                        break
+                    if partial and responses:
+                        return responses
+                    if time() >= next_send_time and time() < deadline:
+                        device.rtt.backoff()
+                        retransmit_secs = min(retransmit_secs * 2, MAX_RETRANSMIT_SECS)
+                        self.send()
+                        retransmitted = True
+                        next_send_time = self.sent_time + retransmit_secs
+                    continue
+                if device.verbose:
+                    print("RECV: " + str(response))
+                if device.is_response(response, self.response_type):
+                    # every transmission is answered, so skip copies already seen
+                    if response.packed_message in seen:
+                        continue
+                    seen.add(response.packed_message)
+                    # only time replies that can't be answering a retransmission
+                    if not responses and not retransmitted:
+                        device.rtt.add_sample(response.received_time - first_sent_time)
+                    device.ip_addr = response.ip_addr
+                    responses.append(response)
+                    if is_complete == None or is_complete(response):
+                        return responses
+                    if partial:
+                        next_send_time = time() + retransmit_secs
+        finally:
+            self.finish()
+        if partial and responses:
+            return responses
+        if is_complete == None:
+            raise WorkflowException("WorkflowException: Did not receive {} from {} (Name: {}) in response to {}".format(str(self.response_type), str(device.mac_addr), str(device.label), str(self.msg_type)))
+        raise WorkflowException("WorkflowException: Did not receive complete {} response from {} (Name: {}) in response to {}".format(str(self.response_type), str(device.mac_addr), str(device.label), str(self.msg_type)))
+
+    def finish(self):
+        if not self.finished:
+            self.finished = True
+            self.device.transport.stop_listening(self.listener)
+            self.device.request_window.release()
+
+# Limits how many requests to one device are in flight at once. Works like a
+# BoundedSemaphore, except that it can be resized while slots are taken.
+class RequestWindow(object):
+    def __init__(self, size):
+        self.condition = Condition()
+        self.size = size
+        self.in_use = 0
+
+    def acquire(self, blocking=True):
+        with self.condition:
+            while self.in_use >= self.size:
+                if not blocking:
+                    return False
+                self.condition.wait()
+            self.in_use += 1
+            return True
+
+    def release(self):
+        with self.condition:
+            if self.in_use <= 0:
+                raise ValueError("RequestWindow released too many times")
+            self.in_use -= 1
+            self.condition.notify()
+
+    def resize(self, size):
+        with self.condition:
+            self.size = size
+            self.condition.notify_all()
+
+# For ExtendedColorZones: index + cCount >= count on the last packet
+def is_last_zone_segment(response):
+    if hasattr(response, 'index') and hasattr(response, 'count') and hasattr(response, 'cCount'):
+        return response.index + response.cCount >= response.count
+    raise WorkflowException("WorkflowException: Response type {} does not have expected attributes for req_with_multiple_resp".format(type(response)))
+
 ################################################################################
 #                                                                              #
 #                             Formatting Functions                             #
 #                                                                              #
 ################################################################################
 
+def firmware_version(version):
+    return float("{}.{}".format(*firmware_version_tuple(version)))
+
+def firmware_version_tuple(version):
+    return (version >> 16, version & 0xffff)
+
 def nanosec_to_hours(ns):
     return ns/(1000000000.0*60*60)
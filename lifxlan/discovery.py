@@ -0,0 +1,128 @@
+# coding=utf-8
+# discovery.py
+# Keeps a LifxLAN object's device list up to date from a background thread
+# (see LifxLAN.start_discovery), so get_devices() and friends can return right
+# away instead of rediscovering the LAN on every call.
+#
+# GetService is rebroadcast every min_interval_secs while devices are coming
+# and going, backing off to max_interval_secs while nothing changes. A device
+# is reported removed after it has missed missed_rounds discoveries in a row.
+
+from threading import Event, Thread
+from time import time
+
+from .message import BROADCAST_MAC
+from .msgtypes import StateService, StateVersion
+
+DEVICE_ADDED = "added"
+DEVICE_REMOVED = "removed"
+DEVICE_IP_CHANGED = "ip_changed"
+
+DEFAULT_MIN_INTERVAL_SECS = 5
+DEFAULT_MAX_INTERVAL_SECS = 60
+DEFAULT_MISSED_ROUNDS = 3
+
+
+class DiscoveryThread(Thread):
+    def __init__(self, lan, min_interval_secs=DEFAULT_MIN_INTERVAL_SECS, max_interval_secs=DEFAULT_MAX_INTERVAL_SECS, missed_rounds=DEFAULT_MISSED_ROUNDS):
+        super(DiscoveryThread, self).__init__()
+        self.daemon = True
+        self.lan = lan
+        self.min_interval_secs = min_interval_secs
+        self.max_interval_secs = max_interval_secs
+        self.missed_rounds = missed_rounds
+        self.missed = {} # mac_addr: discoveries missed in a row
+        self.rounds = 0
+        self.first_round_done = Event()
+        self.stopped = Event()
+
+    def run(self):
+        interval_secs = self.min_interval_secs
+        while not self.stopped.is_set():
+            try:
+                changed = self.discover()
+            except Exception as e:
+                # a bad round (say, the network went away) shouldn't end discovery
+                if self.lan.verbose:
+                    print("Background discovery failed: {}".format(e))
+                changed = False
+            self.rounds += 1
+            self.first_round_done.set()
+            interval_secs = self.min_interval_secs if changed else min(interval_secs * 2, self.max_interval_secs)
+            self.stopped.wait(interval_secs)
+
+    def stop(self):
+        self.stopped.set()
+
+    # Runs one discovery and applies it to the LifxLAN's device list. Returns
+    # True if any device was added, removed or moved.
+    def discover(self):
+        lan = self.lan
+        found = list(lan.discover_iter(quiet_secs=None))
+        events = lan.update_devices(found)
+        seen = set(d.mac_addr for d in found)
+        removed = []
+        for device in lan.devices:
+            if device.mac_addr in seen:
+                self.missed.pop(device.mac_addr, None)
+            else:
+                self.missed[device.mac_addr] = self.missed.get(device.mac_addr, 0) + 1
+                if self.missed[device.mac_addr] >= self.missed_rounds:
+                    removed.append(device)
+        if removed:
+            lan.set_devices([d for d in lan.devices if d not in removed])
+            for device in removed:
+                del self.missed[device.mac_addr]
+                if lan.registry != None:
+                    lan.registry.remove(device.mac_addr)
+                events.append((DEVICE_REMOVED, device))
+        if events and lan.registry != None:
+            lan.save_registry()
+        for (event, device) in events:
+            lan.emit_device_event(event, device)
+        return len(events) > 0
+
+
+# Pairs up the StateService and StateVersion replies to one discovery's
+# GetService and GetVersion broadcasts. LifxLAN.discover_iter and
+# AsyncLifxLAN.discover_iter feed it every reply they receive.
+class DiscoveryReplies(object):
+    def __init__(self, source_id, num_devices=None):
+        self.source_id = source_id
+        self.num_devices = num_devices
+        self.services = {} # target_addr: StateService, for devices not completed yet
+        self.versions = {} # target_addr: StateVersion
+        self.addr_seen = set()
+        self.last_seen_time = time()
+
+    # False once num_devices have answered (and been completed)
+    def is_waiting(self):
+        return self.num_devices == None or len(self.addr_seen) < self.num_devices or len(self.services) > 0
+
+    # when to stop listening if nothing else arrives
+    def get_stop_time(self, deadline, quiet_secs):
+        return deadline if quiet_secs == None else min(deadline, self.last_seen_time + quiet_secs)
+
+    # Returns (StateService, (vendor, product, version)) if response completes
+    # a device, otherwise None
+    def add(self, response):
+        if response.source_id != self.source_id or response.target_addr == BROADCAST_MAC:
+            return None
+        mac_addr = response.target_addr
+        if type(response) == StateService and mac_addr not in self.addr_seen:
+            self.addr_seen.add(mac_addr)
+            self.services[mac_addr] = response
+        elif type(response) == StateVersion and mac_addr not in self.versions:
+            self.versions[mac_addr] = response
+        else:
+            return None
+        # when it arrived, not when the caller got around to it
+        self.last_seen_time = response.received_time
+        if mac_addr in self.services and mac_addr in self.versions:
+            version = self.versions[mac_addr]
+            return (self.services.pop(mac_addr), (version.vendor, version.product, version.version))
+        return None
+
+    # the StateService replies of devices whose StateVersion never arrived
+    def get_unversioned(self):
+        return list(self.services.values())
@@ -6,6 +6,16 @@ import re
 import http.client
 import sys
 
+# Host firmware (major, minor) from which product supports the extended
+# multizone messages, or None if it never does
+def extended_multizone_min_firmware(product):
+    if product['features'].get('extended_multizone'):
+        return (0, 0)
+    for upgrade in product.get('upgrades', []):
+        if upgrade['features'].get('extended_multizone'):
+            return (upgrade['major'], upgrade['minor'])
+    return None
+
 def main():
     conn = http.client.HTTPSConnection("raw.githubusercontent.com")
     conn.request("GET", "/LIFX/products/master/products.json")
@@ -99,6 +109,16 @@ def main():
                     "relays": False,
                     "buttons": False}
                 }""")
+    print("")
+
+    print("# Host firmware (major, minor) from which each multizone product supports the")
+    print("# extended multizone messages. Products missing here have to be asked.")
+    print("extended_multizone_min_firmware = {")
+    for product in mapdata:
+        min_firmware = extended_multizone_min_firmware(product)
+        if min_firmware != None:
+            print(f"                                   {product['pid']}: {min_firmware},")
+    print("                                  }")
 
 
 if __name__ == "__main__":
@@ -60,13 +60,9 @@ class Group(object):
         for t in threads:
             t.join()
 
-    # Hue, saturation, brightness, and colortemp are a little different than the
-    # other functions. You can't just spawn a new thread with "set_saturation"
-    # or whatever for each device, because each command will first request the
-    # current color from the bulbs, which will take different amounts of time to
-    # receive, which makes the color change take different amounts for each
-    # bulb. So basically you gotta get all the colors up front and then make
-    # a set_color() call for each bulb.
+    # Hue, saturation, brightness, and colortemp each change one component of
+    # the color with a single packet per bulb, so there's no need to fetch
+    # everyone's current color first.
 
     def set_hue(self, hue, duration=0, rapid=False):
         # pre-calculate which devices to operate on
@@ -74,16 +70,10 @@ class Group(object):
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
         # "simultaneous" change
         threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            _, saturation, brightness, kelvin = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
+        for d in color_supporting_devices:
+            t = Thread(target = d.set_hue, args = (hue, duration, rapid))
             threads.append(t)
             t.start()
         for t in threads:
@@ -95,16 +85,10 @@ class Group(object):
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
         # "simultaneous" change
         threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            hue, saturation, _, kelvin = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
+        for d in color_supporting_devices:
+            t = Thread(target = d.set_brightness, args = (brightness, duration, rapid))
             threads.append(t)
             t.start()
         for t in threads:
@@ -116,16 +100,10 @@ class Group(object):
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
         # "simultaneous" change
         threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            hue, _, brightness, kelvin = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
+        for d in color_supporting_devices:
+            t = Thread(target = d.set_saturation, args = (saturation, duration, rapid))
             threads.append(t)
             t.start()
         for t in threads:
@@ -137,16 +115,10 @@ class Group(object):
         for d in self.devices:
             if d.supports_color:
                 color_supporting_devices.append(d)
-        # get colors
-        colors = []
-        for d in color_supporting_devices:
-            colors.append(d.get_color())
         # "simultaneous" change
         threads = []
-        for (i, d) in enumerate(color_supporting_devices):
-            hue, saturation, brightness, _ = colors[i]
-            color = [hue, saturation, brightness, kelvin]
-            t = Thread(target = d.set_color, args = (color, duration, rapid))
+        for d in color_supporting_devices:
+            t = Thread(target = d.set_colortemp, args = (kelvin, duration, rapid))
             threads.append(t)
             t.start()
         for t in threads:
@@ -2,32 +2,80 @@
 # lifxlan.py
 # Author: Meghan Clark
 
+from queue import Empty
 from random import randint
-from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, socket, timeout
+from threading import Thread
 from time import sleep, time
+from traceback import print_exc
 import random
 
+from .discovery import DEFAULT_MAX_INTERVAL_SECS, DEFAULT_MIN_INTERVAL_SECS, DEFAULT_MISSED_ROUNDS, DEVICE_ADDED, \
+    DEVICE_IP_CHANGED, DiscoveryReplies, DiscoveryThread
 from .device import DEFAULT_ATTEMPTS, DEFAULT_TIMEOUT, Device, UDP_BROADCAST_IP_ADDRS, UDP_BROADCAST_PORT
 from .errors import InvalidParameterException, WorkflowException
 from .light import Light
 from .switch import Switch
 from .message import BROADCAST_MAC
-from .msgtypes import Acknowledgement, GetService, LightGet, LightGetPower, LightSetColor, LightSetPower, \
-    LightSetWaveform, LightState, LightStatePower, StateService
+from .msgtypes import Acknowledgement, GetGroup, GetLabel, GetLocation, GetService, GetVersion, LightGet, LightGetPower, \
+    LightSetColor, LightSetPower, LightSetWaveform, LightState, LightStatePower, StateGroup, StateLabel, StateLocation, \
+    StateVersion
 from .multizonelight import MultiZoneLight
+from .products import features_map, light_products, product_map, switch_products
+from .membership import MembershipIndex
+from .registry import DeviceRegistry
 from .tilechain import TileChain
-from .unpack import unpack_lifx_message
+from .transport import Transport
 from .group import Group
 
+# discover_iter stops once no new device has answered for this long
+DEFAULT_QUIET_SECS = 0.3
+# how long a name that matched no device is answered from cache
+UNKNOWN_LABEL_CACHE_SECS = 10
+# how old group and location memberships can get before every device is asked again
+DEFAULT_MEMBERSHIP_MAX_AGE = 30
+
+# the class make_device creates for each kind of device (see device_kind)
+DEVICE_TYPES = {"switch": Switch, "multizone": MultiZoneLight, "chain": TileChain, "light": Light, "device": Device}
+
+# The kind of device a (vendor, product, version) tuple describes: "switch",
+# "multizone", "chain", "light" or "device". AsyncLifxLAN goes by it too.
+def device_kind(version):
+    if version == None:
+        # cheating -- it just so happens that all LIFX devices are lights right now
+        return "light"
+    product = version[1]
+    features = features_map[product] if product in product_map else features_map[None]
+    if product in switch_products: # alas, it is possible to have a non-light item
+        return "switch"
+    elif product in light_products and features["multizone"]:
+        return "multizone"
+    elif product in light_products and features["chain"]:
+        return "chain"
+    elif product in light_products:
+        return "light"
+    return "device"
 
 class LifxLAN:
-    def __init__(self, num_lights=None, verbose=False):
+    # registry_path names a file that remembers devices between runs (see registry.py)
+    def __init__(self, num_lights=None, verbose=False, registry_path=None):
         self.source_id = random.randrange(2, 1 << 32)
         self.num_devices = num_lights
         self.num_lights = num_lights
         self.devices = None
         self.lights = None
         self.verbose = verbose
+        # one socket shared by all broadcasts and by every device discovered through this object
+        self.transport = Transport(verbose)
+        self.registry = DeviceRegistry(registry_path) if registry_path != None else None
+        self.revalidation = None
+        self.discovery = None
+        self.device_callbacks = []
+        # filled by broadcasts and kept across calls (see get_devices_by_label)
+        self.label_index = {} # label: set of mac_addrs
+        self.device_labels = {} # mac_addr: label, as indexed
+        self.unknown_labels = {} # label: time it was last looked up and not found
+        self.group_index = MembershipIndex(GetGroup, StateGroup, "group")
+        self.location_index = MembershipIndex(GetLocation, StateLocation, "location")
 
     ############################################################################
     #                                                                          #
@@ -36,37 +84,229 @@ class LifxLAN:
     ############################################################################
 
     def get_devices(self):
-        self.discover_devices()
+        self.update_device_list()
         return self.devices
 
     def get_lights(self):
-        self.discover_devices()
+        self.update_device_list()
         return self.lights
 
+    # Rediscovers, unless the list is already being kept up to date in the
+    # background or can be started from the registry
+    def update_device_list(self):
+        if self.discovery != None:
+            if self.devices == None:
+                self.discovery.first_round_done.wait()
+        elif not self.warm_start():
+            self.discover_devices()
+
     # more of an internal helper function
     # forces a refresh of the internal list of available devices
-    def discover_devices(self):
-        self.lights = []
-        self.devices = []
-        responses = self.broadcast_with_resp(GetService, StateService,)
+    def discover_devices(self, timeout_secs=DEFAULT_TIMEOUT, quiet_secs=None):
+        self.set_devices(list(self.discover_iter(timeout_secs, quiet_secs)))
+        if self.registry != None:
+            self.save_registry()
+
+    def set_devices(self, devices):
+        self.devices = devices
+        self.lights = [d for d in devices if isinstance(d, Light)]
+
+    # The first time devices are asked for, if the registry knows some, they
+    # are returned right away and revalidated by a discovery in the background.
+    # Returns False if there was nothing to start from.
+    def warm_start(self):
+        if self.registry == None or self.devices != None:
+            return False
+        entries = self.registry.get_entries()
+        if len(entries) == 0:
+            return False
+        devices = []
+        for (mac_addr, entry) in entries.items():
+            version = (entry.get("vendor"), entry["product"], entry.get("version")) if "product" in entry else None
+            device = self.make_device(mac_addr, entry["ip_addr"], entry.get("service", 1), entry.get("port", UDP_BROADCAST_PORT), version)
+            self.registry.restore(device, entry)
+            devices.append(device)
+        self.set_devices(devices)
+        self.revalidation = Thread(target=self.revalidate)
+        self.revalidation.daemon = True
+        self.revalidation.start()
+        return True
+
+    # Rediscovers the LAN and brings the current devices up to date (see
+    # update_devices), including what was restored from the registry. Devices
+    # that did not answer are kept.
+    def revalidate(self, timeout_secs=DEFAULT_TIMEOUT):
+        found = list(self.discover_iter(timeout_secs, None))
+        self.update_devices(found)
+        answered = set(d.mac_addr for d in found)
+        self.refresh_restored_state([d for d in self.devices if d.mac_addr in answered])
+        if self.registry != None:
+            self.save_registry()
+
+    # Rereads the label, group and location of devices (one broadcast each),
+    # and the tile layout of TileChains that have one, since any of them may
+    # have changed since they were saved to the registry
+    def refresh_restored_state(self, devices):
+        by_mac = dict((d.mac_addr, d) for d in devices)
+        if len(by_mac) == 0:
+            return
+        for (get_type, state_type, name) in ((GetLabel, StateLabel, "label"), (GetGroup, StateGroup, "group"), (GetLocation, StateLocation, "location")):
+            try:
+                responses = self.broadcast_with_resp(get_type, state_type, {}, DEFAULT_TIMEOUT, 2, list(by_mac))
+            except WorkflowException:
+                continue
+            for r in responses:
+                if r.target_addr in by_mac:
+                    device = by_mac[r.target_addr]
+                    setattr(device, name, device.cache_state(name, r.label))
+        for device in devices:
+            if getattr(device, "tile_info", None) != None:
+                try:
+                    device.get_tile_info(refresh_cache=True)
+                except WorkflowException:
+                    pass
+
+    # Merges freshly discovered devices into the device list: new addresses are
+    # applied in place (so Device objects already handed out keep working) and
+    # new devices are added. Returns a list of (event, device) for what changed.
+    # A device whose StateVersion went missing this time (so it came back as a
+    # plain Light) keeps the object it already has.
+    def update_devices(self, found):
+        current = dict((d.mac_addr, d) for d in (self.devices or []))
+        devices = list(current.values())
+        events = []
+        for new in found:
+            device = current.get(new.mac_addr)
+            if device == None or (type(device) != type(new) and new.product != None):
+                if device != None:
+                    devices.remove(device)
+                devices.append(new)
+                events.append((DEVICE_ADDED, new))
+                continue
+            if (device.ip_addr, device.port) != (new.ip_addr, new.port):
+                events.append((DEVICE_IP_CHANGED, device))
+            device.ip_addr, device.port, device.service = new.ip_addr, new.port, new.service
+            if new.product != None:
+                device.vendor, device.product, device.version = new.vendor, new.product, new.version
+                device.product_features = new.product_features
+        self.set_devices(devices)
+        return events
+
+    # Writes everything the current devices know about themselves to the registry
+    def save_registry(self):
+        for device in self.devices or []:
+            self.registry.update(device)
+        self.registry.save()
+
+    # Broadcasts GetService and yields a Device (of the most specific subclass)
+    # as each new device answers. Stops after timeout_secs, once num_lights
+    # devices have answered, or once quiet_secs pass without a new reply
+    # (None to always wait out timeout_secs).
+    #
+    # GetVersion is broadcast along with GetService, so every device is
+    # classified from the products table as soon as both of its replies are in.
+    # Only devices whose StateVersion went missing are asked again, all at once.
+    def discover_iter(self, timeout_secs=DEFAULT_TIMEOUT, quiet_secs=DEFAULT_QUIET_SECS):
+        listener = self.transport.listen(BROADCAST_MAC, self.source_id)
+        # both broadcasts carry the same sequence number, so one listener gets all replies
+        msgs = [msg_type(BROADCAST_MAC, self.source_id, seq_num=listener.seq_num, payload={}, ack_requested=False, response_requested=True)
+                for msg_type in (GetService, GetVersion)]
+        replies = DiscoveryReplies(self.source_id, self.num_devices)
+        try:
+            for msg in msgs:
+                self.wait_for_rate_limit()
+                self.send_broadcast(msg.packed_message)
+                if self.verbose:
+                    print("SEND: " + str(msg))
+            deadline = time() + timeout_secs
+            while replies.is_waiting():
+                try:
+                    response = listener.get(timeout=max(replies.get_stop_time(deadline, quiet_secs) - time(), 0))
+                except Empty:
+                    break
+                if self.verbose:
+                    print("RECV: " + str(response))
+                found = replies.add(response)
+                if found != None:
+                    (r, version) = found
+                    yield self.make_device(r.target_addr, r.ip_addr, r.service, r.port, version)
+        finally:
+            self.transport.stop_listening(listener)
+        for device in self.classify_devices(replies.get_unversioned()):
+            yield device
+
+    # Unicasts GetVersion to each device that sent one of responses (a list of
+    # StateService), keeping all of the requests in flight at once, and returns
+    # a Device for each
+    def classify_devices(self, responses):
+        requests = []
         for r in responses:
-            device = Device(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
+            device = Device(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose, self.transport)
             try:
-                if device.is_light():
-                    if device.supports_multizone():
-                        device = MultiZoneLight(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
-                    elif device.supports_chain():
-                        device = TileChain(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
-                    else:
-                        device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
-                    self.lights.append(device)
+                requests.append((r, device.start_request(GetVersion, StateVersion)))
             except WorkflowException:
-                # cheating -- it just so happens that all LIFX devices are lights right now
-                device = Light(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
-                self.lights.append(device)
-            if device.is_switch(): # alas, it is possible to have a non-light item
-                device = Switch(r.target_addr, r.ip_addr, r.service, r.port, self.source_id, self.verbose)
-            self.devices.append(device)
+                requests.append((r, None))
+        devices = []
+        for (r, request) in requests:
+            version = None
+            if request != None:
+                try:
+                    response = request.wait()[-1]
+                    version = (response.vendor, response.product, response.version)
+                except WorkflowException:
+                    pass
+            devices.append(self.make_device(r.target_addr, r.ip_addr, r.service, r.port, version))
+        return devices
+
+    # returns the most specific Device object for a device with the given
+    # (vendor, product, version) (None if unknown)
+    def make_device(self, mac_addr, ip_addr, service, port, version):
+        kind = device_kind(version)
+        if kind == "chain":
+            device = TileChain(mac_addr, ip_addr, service, port, self.source_id, self.verbose, self.transport, load_tiles=False)
+        else:
+            device = DEVICE_TYPES[kind](mac_addr, ip_addr, service, port, self.source_id, self.verbose, self.transport)
+        if version != None:
+            device.vendor, device.product, device.version = version
+            device.product_features = features_map[device.product] if device.product in product_map else features_map[None]
+        return device
+
+    ############################################################################
+    #                                                                          #
+    #                          Background Discovery                            #
+    #                                                                          #
+    ############################################################################
+
+    # Starts keeping the device list up to date from a background thread.
+    # While it runs, get_devices() and the other getters return the current
+    # list instead of rediscovering.
+    def start_discovery(self, min_interval_secs=DEFAULT_MIN_INTERVAL_SECS, max_interval_secs=DEFAULT_MAX_INTERVAL_SECS, missed_rounds=DEFAULT_MISSED_ROUNDS):
+        if self.discovery == None:
+            self.discovery = DiscoveryThread(self, min_interval_secs, max_interval_secs, missed_rounds)
+            self.discovery.start()
+
+    def stop_discovery(self):
+        if self.discovery != None:
+            self.discovery.stop()
+            self.discovery = None
+
+    # callback(event, device) is called from the discovery thread whenever a
+    # device is added, removed, or changes address; event is one of
+    # DEVICE_ADDED, DEVICE_REMOVED and DEVICE_IP_CHANGED
+    def add_device_callback(self, callback):
+        self.device_callbacks.append(callback)
+
+    def remove_device_callback(self, callback):
+        self.device_callbacks.remove(callback)
+
+    # A callback that raises is reported and doesn't keep the others from running
+    def emit_device_event(self, event, device):
+        for callback in list(self.device_callbacks):
+            try:
+                callback(event, device)
+            except Exception:
+                print("Device callback {} failed on {} event for {}:".format(callback, event, device.mac_addr))
+                print_exc()
 
     def get_multizone_lights(self):
         multizone_lights = []
@@ -101,33 +341,70 @@ class LifxLAN:
         return chain_lights
 
     def get_device_by_name(self, name):
-        device = None
-        all_devices = self.get_devices()
-        for d in all_devices:
-            if d.get_label() == name:
-                device = d
-        if device == None:               # didn't find it?
-            self.discover_devices()      # update list in case it is out of date
-            all_devices = self.get_devices()
-            for d in all_devices:            # and try again
-                if d.get_label() == name:
-                    device = d
-        return device
+        devices = self.get_devices_by_label([name])
+        return devices[-1] if len(devices) > 0 else None
 
     # takes in list of strings, returns Group of devices
     def get_devices_by_name(self, names):
+        return Group(self.get_devices_by_label(names))
+
+    # Returns the devices labeled with any of names, looked up in the label
+    # index. Names that aren't there cause one rediscovery and one read of
+    # every label, after which names that are still missing are remembered as
+    # unknown for UNKNOWN_LABEL_CACHE_SECS rather than triggering another.
+    def get_devices_by_label(self, names):
+        listed = self.devices != None
+        if not listed:
+            self.update_device_list()
+        self.update_label_index()
+        missing = [name for name in names if name not in self.label_index and not self.is_unknown_label(name)]
+        if len(missing) > 0:
+            if listed:
+                self.update_device_list()   # update list in case it is out of date
+            self.update_label_index(True)
+            now = time()
+            for name in missing:
+                if name not in self.label_index:
+                    self.unknown_labels[name] = now
+        by_mac = dict((d.mac_addr, d) for d in self.devices)
         devices = []
-        all_devices = self.get_devices()
-        for d in all_devices:
-            if d.get_label() in names:
-                devices.append(d)
-        if len(devices) != len(names):  # didn't find everything?
-            self.discover_devices()     # update list in case it is out of date
-            all_devices = self.get_devices()
-            for d in all_devices:       # and try again
-                if d.get_label() in names:
-                    devices.append(d)
-        return Group(devices)
+        for name in names:
+            devices.extend(by_mac[mac_addr] for mac_addr in sorted(self.label_index.get(name, ())))
+        return devices
+
+    # Brings the label index up to date with the current device list. Only
+    # devices whose label isn't known (or every device, if read_all) are asked,
+    # with one broadcast GetLabel; labels changed locally, e.g. by set_label,
+    # are picked up, and devices that are gone are dropped.
+    def update_label_index(self, read_all=False):
+        devices = self.devices or []
+        unread = dict((d.mac_addr, d) for d in devices if read_all or d.label == None)
+        if len(unread) > 0:
+            for r in self.broadcast_with_resp(GetLabel, StateLabel, {}, DEFAULT_TIMEOUT, 2, list(unread)):
+                if r.target_addr in unread:
+                    unread[r.target_addr].label = r.label
+            if read_all:
+                self.unknown_labels = {}
+        present = set(d.mac_addr for d in devices)
+        for mac_addr in [m for m in self.device_labels if m not in present]:
+            self.index_label(mac_addr, None)
+        for d in devices:
+            if self.device_labels.get(d.mac_addr) != d.label:
+                self.index_label(d.mac_addr, d.label)
+
+    def index_label(self, mac_addr, label):
+        old = self.device_labels.pop(mac_addr, None)
+        if old != None:
+            self.label_index[old].discard(mac_addr)
+            if len(self.label_index[old]) == 0:
+                del self.label_index[old]
+        if label != None:
+            self.device_labels[mac_addr] = label
+            self.label_index.setdefault(label, set()).add(mac_addr)
+
+    def is_unknown_label(self, name):
+        missed_time = self.unknown_labels.get(name)
+        return missed_time != None and time() - missed_time < UNKNOWN_LABEL_CACHE_SECS
 
     def get_devices_by_product(self, names):
         devices = []
@@ -136,7 +413,7 @@ class LifxLAN:
             if d.get_label() in names:
                 devices.append(d)
         if len(devices) != len(names):  # didn't find everything?
-            self.discover_devices()     # update list in case it is out of date
+            self.update_device_list()   # update list in case it is out of date
             all_devices = self.get_devices()
             for d in all_devices:       # and try again
                 if d.get_product_name() in names:
@@ -144,21 +421,35 @@ class LifxLAN:
         return Group(devices)
 
 
-    def get_devices_by_group(self, group):
-        devices = []
-        all_devices = self.get_devices()
-        for d in all_devices:
-            if d.get_group() == group:
-                devices.append(d)
-        return Group(devices)
+    # max_age is how many seconds old the group memberships can be (see get_devices_by_membership)
+    def get_devices_by_group(self, group, max_age=DEFAULT_MEMBERSHIP_MAX_AGE):
+        return Group(self.get_devices_by_membership(self.group_index, group, max_age))
+
+    def get_devices_by_location(self, location, max_age=DEFAULT_MEMBERSHIP_MAX_AGE):
+        return Group(self.get_devices_by_membership(self.location_index, location, max_age))
+
+    # Returns the devices in the group or location (depending on index) with
+    # the given label, from the cached device list. Every device is asked
+    # again once the memberships are more than max_age seconds old, in case
+    # one has moved; in between, only devices whose membership isn't known
+    # yet are asked.
+    def get_devices_by_membership(self, index, label, max_age=DEFAULT_MEMBERSHIP_MAX_AGE):
+        if self.devices == None:
+            self.update_device_list()
+        devices = self.devices
+        index.prune([d.mac_addr for d in devices])
+        if index.refresh_time == None or time() - index.refresh_time > max_age:
+            index.refresh_time = time()
+            self.read_memberships(index, [d.mac_addr for d in devices])
+        else:
+            self.read_memberships(index, [d.mac_addr for d in devices if d.mac_addr not in index.entries])
+        members = index.get_mac_addrs(label)
+        return [d for d in devices if d.mac_addr in members]
 
-    def get_devices_by_location(self, location):
-        devices = []
-        all_devices = self.get_devices()
-        for d in all_devices:
-            if d.get_location() == location:
-                devices.append(d)
-        return Group(devices)
+    def read_memberships(self, index, mac_addrs):
+        if len(mac_addrs) > 0:
+            responses = self.broadcast_with_resp(index.get_type, index.state_type, {}, DEFAULT_TIMEOUT, 2, mac_addrs)
+            index.update(mac_addrs, responses)
 
     # returns dict of Light: power_level pairs
     def get_power_all_lights(self):
@@ -197,7 +488,10 @@ class LifxLAN:
         for light in self.lights:
             for response in responses:
                 if light.mac_addr == response.target_addr:
-                    colors[light] = response.color
+                    colors[light] = light.color = light.cache_state("color", response.color)
+                    # LightState carries the power level and label too
+                    light.power_level = light.cache_state("power_level", response.power_level)
+                    light.label = light.cache_state("label", response.label)
         return colors
 
     def set_color_all_lights(self, color, duration=0, rapid=False):
@@ -231,74 +525,82 @@ class LifxLAN:
     ############################################################################
 
     def broadcast_fire_and_forget(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, num_repeats=DEFAULT_ATTEMPTS):
-        self.initialize_socket(timeout_secs)
-        msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=False)
+        seq_num = self.transport.next_seq_num(BROADCAST_MAC, self.source_id)
+        msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=seq_num, payload=payload, ack_requested=False, response_requested=False)
         sent_msg_count = 0
         sleep_interval = 0.05 if num_repeats > 20 else 0
         while(sent_msg_count < num_repeats):
+            self.wait_for_rate_limit()
             for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                self.sock.sendto(msg.packed_message, (ip_addr, UDP_BROADCAST_PORT))
+                self.transport.sendto(msg.packed_message, (ip_addr, UDP_BROADCAST_PORT))
             if self.verbose:
                 print("SEND: " + str(msg))
             sent_msg_count += 1
             if sent_msg_count < num_repeats:
                 sleep(sleep_interval) # Max num of messages device can handle is 20 per second.
-        self.close_socket()
 
-    def broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS):
-        self.initialize_socket(timeout_secs)
-        if response_type == Acknowledgement:
-            msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=0, payload=payload, ack_requested=True, response_requested=False)
-        else:
-            msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=0, payload=payload, ack_requested=False, response_requested=True)
-        responses = []
-        addr_seen = []
-        num_devices_seen = 0
-        attempts = 0
-        while (self.num_devices == None or num_devices_seen < self.num_devices) and attempts < max_attempts:
-            sent = False
-            start_time = time()
-            timedout = False
-            while (self.num_devices == None or num_devices_seen < self.num_devices) and not timedout:
-                if not sent:
-                    for ip_addr in UDP_BROADCAST_IP_ADDRS:
-                        try:
-                            self.sock.sendto(msg.packed_message, (ip_addr, UDP_BROADCAST_PORT))
-                        except OSError as e:
-                            # sendto will fail for interfaces that do not support multicast or are not up.
-                            # An example of the first case is a wireguard vpn interface.
-                            # In either case just log as debug and ignore the error.
-                            if self.verbose:
-                                print("OSError: Interface for %s does not support multicast or is not UP. ip_addr: ",
-                                      ip_addr)
-                    sent = True
-                    if self.verbose:
-                        print("SEND: " + str(msg))
-                try:
-                    data, (ip_addr, port) = self.sock.recvfrom(1024)
-                    response = unpack_lifx_message(data)
-                    response.ip_addr = ip_addr
-                    if self.verbose:
-                        print("RECV: " + str(response))
-                    if type(response) == response_type and response.source_id == self.source_id:
-                        if response.target_addr not in addr_seen and response.target_addr != BROADCAST_MAC:
-                            addr_seen.append(response.target_addr)
-                            num_devices_seen += 1
-                            responses.append(response)
-                except timeout:
-                    pass
-                elapsed_time = time() - start_time
-                timedout = True if elapsed_time > timeout_secs else False
-            attempts += 1
-        self.close_socket()
-        return responses
+    # With mac_addrs, stops waiting as soon as all of those devices have replied
+    def broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT, max_attempts=DEFAULT_ATTEMPTS, mac_addrs=None):
+        ack_requested = response_type == Acknowledgement
+        replies = self.broadcast_request(msg_type, [response_type], payload, ack_requested, not ack_requested, timeout_secs, max_attempts, mac_addrs)
+        return [device_replies[response_type] for device_replies in replies]
 
     def broadcast_with_ack(self, msg_type, payload={}, timeout_secs=DEFAULT_TIMEOUT+0.5, max_attempts=DEFAULT_ATTEMPTS):
         self.broadcast_with_resp(msg_type, Acknowledgement, payload, timeout_secs, max_attempts)
 
-    # Not currently implemented, although the LIFX LAN protocol supports this kind of workflow natively
+    # Sends one packet asking for both an acknowledgement and a state response,
+    # and returns an (ack, response) tuple for each device that sent both
     def broadcast_with_ack_resp(self, msg_type, response_type, payload={}, timeout_secs=DEFAULT_TIMEOUT+0.5, max_attempts=DEFAULT_ATTEMPTS):
-        pass
+        replies = self.broadcast_request(msg_type, [Acknowledgement, response_type], payload, True, True, timeout_secs, max_attempts)
+        return [(device_replies[Acknowledgement], device_replies[response_type]) for device_replies in replies]
+
+    # Returns a list with a {response_type: response} dict for each device that
+    # replied with every one of response_types, in the order they completed
+    def broadcast_request(self, msg_type, response_types, payload, ack_requested, response_requested, timeout_secs, max_attempts, mac_addrs=None):
+        listener = self.transport.listen(BROADCAST_MAC, self.source_id)
+        msg = msg_type(BROADCAST_MAC, self.source_id, seq_num=listener.seq_num, payload=payload, ack_requested=ack_requested, response_requested=response_requested)
+        replies = []
+        pending = {} # target_addr: {response_type: response}, until complete
+        addr_seen = set()
+        num_devices_seen = 0
+        attempts = 0
+        def all_seen():
+            if mac_addrs != None:
+                return addr_seen.issuperset(mac_addrs)
+            return self.num_devices != None and num_devices_seen >= self.num_devices
+        try:
+            while not all_seen() and attempts < max_attempts:
+                sent = False
+                start_time = time()
+                timedout = False
+                while not all_seen() and not timedout:
+                    if not sent:
+                        self.wait_for_rate_limit()
+                        self.send_broadcast(msg.packed_message)
+                        sent = True
+                        if self.verbose:
+                            print("SEND: " + str(msg))
+                    try:
+                        response = listener.get(timeout=max(timeout_secs - (time() - start_time), 0))
+                        if self.verbose:
+                            print("RECV: " + str(response))
+                        if type(response) in response_types and response.source_id == self.source_id:
+                            if response.target_addr not in addr_seen and response.target_addr != BROADCAST_MAC:
+                                device_replies = pending.setdefault(response.target_addr, {})
+                                device_replies[type(response)] = response
+                                if len(device_replies) == len(response_types):
+                                    del pending[response.target_addr]
+                                    addr_seen.add(response.target_addr)
+                                    num_devices_seen += 1
+                                    replies.append(device_replies)
+                    except Empty:
+                        pass
+                    elapsed_time = time() - start_time
+                    timedout = True if elapsed_time > timeout_secs else False
+                attempts += 1
+        finally:
+            self.transport.stop_listening(listener)
+        return replies
 
     ############################################################################
     #                                                                          #
@@ -306,19 +608,40 @@ class LifxLAN:
     #                                                                          #
     ############################################################################
 
-    def initialize_socket(self, timeout):
-        self.sock = socket(AF_INET, SOCK_DGRAM)
-        self.sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
-        self.sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
-        self.sock.settimeout(timeout)
-        try:
-            self.sock.bind(("", 0))  # allow OS to assign next available source port
-        except Exception as err:
-            raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
+    # Blocks until the transport's rate limit allows another packet
+    def wait_for_rate_limit(self):
+        delay = self.transport.rate_limiter.reserve()
+        if delay > 0:
+            sleep(delay)
+
+    # Limits the total rate of packets sent by this object and all of its
+    # devices, in messages per second (None for unlimited). Each device also
+    # has its own limit, see Device.set_rate_limit.
+    def set_rate_limit(self, rate, burst=None):
+        self.transport.rate_limiter.set_rate(rate, burst)
 
+    def get_rate_limit_stats(self):
+        return self.transport.rate_limiter.get_stats()
 
-    def close_socket(self):
-        self.sock.close()
+    def send_broadcast(self, packet):
+        for ip_addr in UDP_BROADCAST_IP_ADDRS:
+            try:
+                self.transport.sendto(packet, (ip_addr, UDP_BROADCAST_PORT))
+            except OSError as e:
+                # sendto will fail for interfaces that do not support multicast or are not up.
+                # An example of the first case is a wireguard vpn interface.
+                # In either case just log as debug and ignore the error.
+                if self.verbose:
+                    print("OSError: Interface for %s does not support multicast or is not UP. ip_addr: ",
+                          ip_addr)
+
+    # Closes the shared socket (it is reopened automatically by the next
+    # request), and saves what the devices learned to the registry, if any.
+    def close(self):
+        self.stop_discovery()
+        if self.registry != None and self.devices != None:
+            self.save_registry()
+        self.transport.close()
 
 def test():
     pass
@@ -6,7 +6,7 @@ import random
 from .device import Device
 from .errors import InvalidParameterException, WorkflowException
 from .msgtypes import LightGet, LightGetInfrared, LightGetPower,\
-                      LightSetColor, LightSetInfrared, LightSetPower, LightSetWaveform,\
+                      LightSetColor, LightSetInfrared, LightSetPower, LightSetWaveform, LightSetWaveformOptional,\
                       LightState, LightStateInfrared, LightStatePower
 
 RED = [65535, 65535, 65535, 3500]
@@ -22,10 +22,25 @@ COLD_WHITE = [58275, 0, 65535, 9000]
 WARM_WHITE = [58275, 0, 65535, 3200]
 GOLD = [58275, 0, 65535, 2500]
 
+# LightSetWaveformOptional flags for each HSBK component, in color order
+COLOR_COMPONENT_FLAGS = ("set_hue", "set_saturation", "set_brightness", "set_kelvin")
+SAW_WAVEFORM = 0
+
+# Payload that changes only component index of the color (0 is hue, 3 is
+# kelvin) over duration ms and leaves the rest as it is on the light: a single
+# non-transient cycle of a waveform ends on the new value and stays there.
+def color_component_payload(index, value, duration=0):
+    color = [0, 0, 0, 0]
+    color[index] = value
+    payload = {"transient": 0, "color": color, "period": duration, "cycles": 1, "duty_cycle": 0, "waveform": SAW_WAVEFORM}
+    for (i, flag) in enumerate(COLOR_COMPONENT_FLAGS):
+        payload[flag] = int(i == index)
+    return payload
+
 class Light(Device):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
         mac_addr = mac_addr.lower()
-        super(Light, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+        super(Light, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
         self.color = None
         self.infrared_brightness = None
 
@@ -36,13 +51,15 @@ class Light(Device):
     ############################################################################
 
     # GetPower - power level
-    def get_power(self):
+    def get_power(self, max_age=None):
+        if self.is_cached("power_level", max_age):
+            return self.state_cache["power_level"][0]
         try:
             response = self.req_with_resp(LightGetPower, LightStatePower)
             self.power_level = response.power_level
         except WorkflowException as e:
             raise
-        return self.power_level
+        return self.cache_state("power_level", self.power_level)
 
     def set_power(self, power, duration=0, rapid=False):
         on = [True, 1, "on", 65535]
@@ -83,78 +100,61 @@ class Light(Device):
             except WorkflowException as e:
                 raise
 
-    def get_color(self):
+    def get_color(self, max_age=None):
+        if self.is_cached("color", max_age):
+            return self.state_cache["color"][0]
         try:
             response = self.req_with_resp(LightGet, LightState)
             self.color = response.color
-            self.power_level = response.power_level
-            self.label = response.label
+            self.power_level = self.cache_state("power_level", response.power_level)
+            self.label = self.cache_state("label", response.label)
         except WorkflowException as e:
             raise
-        return self.color
+        return self.cache_state("color", self.color)
 
     # hue in range [0 - 65535]
     def set_hue(self, hue, duration=0, rapid=False):
         """ hue to set
             duration in ms"""
-        color = self.get_color()
-        color2 = (hue, color[1], color[2], color[3])
-        try:
-            if rapid:
-                self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
-            else:
-                self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
-        except WorkflowException as e:
-            raise
+        self.set_color_component(0, hue, duration, rapid)
 
     # saturation in range [0 - 65535]
     def set_saturation(self, saturation, duration=0, rapid=False):
         """ saturation to set
             duration in ms"""
-        color = self.get_color()
-        color2 = (color[0], saturation, color[2], color[3])
-        try:
-            if rapid:
-                self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
-            else:
-                self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
-        except WorkflowException as e:
-            raise
+        self.set_color_component(1, saturation, duration, rapid)
 
     # brightness in range [0 - 65535]
     def set_brightness(self, brightness, duration=0, rapid=False):
         """ brightness to set
             duration in ms"""
-        color = self.get_color()
-        color2 = (color[0], color[1], brightness, color[3])
-        try:
-            if rapid:
-                self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
-            else:
-                self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
-        except WorkflowException as e:
-            raise
+        self.set_color_component(2, brightness, duration, rapid)
 
     # kelvin in range [2500 - 9000]
     def set_colortemp(self, kelvin, duration=0, rapid=False):
         """ kelvin: color temperature to set
             duration in ms"""
-        color = self.get_color()
-        color2 = (color[0], color[1], color[2], kelvin)
+        self.set_color_component(3, kelvin, duration, rapid)
+
+    # Sets one component of the color (0 is hue, 3 is kelvin) in a single
+    # packet, without fetching the current color first
+    def set_color_component(self, index, value, duration=0, rapid=False):
         try:
             if rapid:
-                self.fire_and_forget(LightSetColor, {"color": color2, "duration": duration}, num_repeats=1)
+                self.fire_and_forget(LightSetWaveformOptional, color_component_payload(index, value, duration), num_repeats=1)
             else:
-                self.req_with_ack(LightSetColor, {"color": color2, "duration": duration})
+                self.req_with_ack(LightSetWaveformOptional, color_component_payload(index, value, duration))
         except WorkflowException as e:
             raise
 
     # Infrared get maximum brightness, infrared_brightness
-    def get_infrared(self):
+    def get_infrared(self, max_age=None):
+        if self.is_cached("infrared_brightness", max_age):
+            return self.state_cache["infrared_brightness"][0]
         if self.supports_infrared():
             try:
                 response = self.req_with_resp(LightGetInfrared, LightStateInfrared)
-                self.infrared_brightness = response.infrared_brightness
+                self.infrared_brightness = self.cache_state("infrared_brightness", response.infrared_brightness)
             except WorkflowException as e:
                 raise
         return self.infrared_brightness
@@ -0,0 +1,63 @@
+# coding=utf-8
+# membership.py
+# Which devices belong to which group (or location), as reported by
+# StateGroup/StateLocation. Groups are keyed by UUID, since several groups can
+# share a label and a group's label can change. Each reply carries an
+# updated_at timestamp: the newest one seen for a UUID decides its label, and
+# a reply whose (uuid, updated_at) hasn't changed since last time is skipped.
+
+from binascii import hexlify
+
+
+class MembershipIndex(object):
+    # field is the name of the UUID field of state_type ("group" or "location")
+    def __init__(self, get_type, state_type, field):
+        self.get_type = get_type
+        self.state_type = state_type
+        self.field = field
+        self.entries = {} # mac_addr: (uuid, updated_at), or None if it didn't answer
+        self.labels = {} # uuid: (label, updated_at)
+        self.members = {} # uuid: set of mac_addrs
+        self.refresh_time = None # when every device was last asked
+
+    # Applies the replies to a broadcast sent to mac_addrs
+    def update(self, mac_addrs, responses):
+        for response in responses:
+            uuid = hexlify(bytearray(getattr(response, self.field))).decode()
+            membership = (uuid, response.updated_at)
+            old = self.entries.get(response.target_addr)
+            if old == membership:
+                continue
+            if old != None:
+                self.remove_member(old[0], response.target_addr)
+            self.entries[response.target_addr] = membership
+            self.members.setdefault(uuid, set()).add(response.target_addr)
+            if uuid not in self.labels or response.updated_at >= self.labels[uuid][1]:
+                self.labels[uuid] = (response.label, response.updated_at)
+        for mac_addr in mac_addrs:
+            self.entries.setdefault(mac_addr, None)
+
+    # Forgets the devices that aren't in mac_addrs any more
+    def prune(self, mac_addrs):
+        mac_addrs = set(mac_addrs)
+        for mac_addr in [m for m in self.entries if m not in mac_addrs]:
+            old = self.entries.pop(mac_addr)
+            if old != None:
+                self.remove_member(old[0], mac_addr)
+
+    def remove_member(self, uuid, mac_addr):
+        self.members[uuid].discard(mac_addr)
+        if len(self.members[uuid]) == 0:
+            del self.members[uuid]
+            del self.labels[uuid]
+
+    def get_mac_addrs(self, label):
+        mac_addrs = set()
+        for (uuid, (uuid_label, updated_at)) in self.labels.items():
+            if uuid_label == label:
+                mac_addrs.update(self.members[uuid])
+        return mac_addrs
+
+    # returns {uuid: label} for every group with members
+    def get_labels(self):
+        return dict((uuid, label) for (uuid, (label, updated_at)) in self.labels.items())
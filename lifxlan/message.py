@@ -4,18 +4,17 @@
 
 import struct
 
-import bitstring
+from . import codec
 
 BROADCAST_MAC = "00:00:00:00:00:00"
 BROADCAST_SOURCE_ID = 0
 
-HEADER_SIZE_BYTES = 36
+HEADER_SIZE_BYTES = codec.HEADER.size # 36
 
 class Message(object):
     def __init__(self, msg_type, target_addr, source_id, seq_num, ack_requested=False, response_requested=False):
 
         # Frame
-        self.frame_format = ["uint:16", "uint:2, uint:1, uint:1, uint:12", "uint:32"]
         self.size = None                                                # 16 bits/uint16
         self.origin = 0                                                 # 2 bits/uint8, must be zero
         self.tagged = 1 if target_addr == BROADCAST_MAC else 0          # 1 bit/bool, also must be one if getservice
@@ -24,7 +23,6 @@ class Message(object):
         self.source_id = source_id                                      # 32 bits/uint32, unique ID set by client. If zero, broadcast reply requested. If non-zero, unicast reply requested.
 
         # Frame Address
-        self.frame_addr_format = ["uint:64", "uint:48", "uint:6, uint:1, uint:1", "uint:8"]
         self.target_addr = target_addr                                  # 64 bits/uint64, either single MAC address or all zeroes for broadcast.
         self.reserved = 0                                               # 48 bits/uint8 x 6, all zero
         self.reserved = 0                                               # 6 bits, all zero
@@ -33,14 +31,48 @@ class Message(object):
         self.seq_num = seq_num                                          # 8 bits/uint8, wraparound
 
         # Protocol Header
-        self.protocol_header_format = ["uint:64", "uint:16", "uint:16"]
         self.reserved = 0                                               # 64 bits/uint64, all zero
         self.message_type = msg_type                                    # 16 bits/uint16
         self.reserved = 0                                               # 16 bits/uint16, all zero
 
         self.payload_fields = [] # tuples of ("label", value)
 
-        self.packed_message = self.generate_packed_message()
+        # Packed on first access (see packed_message below). Received messages
+        # are handed their datagram by unpack_lifx_message and never repacked.
+        self._packed_message = None
+
+    @property
+    def packed_message(self):
+        if self._packed_message == None:
+            self._packed_message = self.generate_packed_message()
+        return self._packed_message
+
+    @packed_message.setter
+    def packed_message(self, packed_message):
+        self._packed_message = packed_message
+
+    # Received messages hold their payload undecoded until one of its fields
+    # is first read (see unpack_lifx_message), and their header and payload
+    # bytes aren't copied out of the datagram until they are asked for. Only
+    # called for attributes that aren't already set, so after the first
+    # decode this is never hit again.
+    def __getattr__(self, name):
+        packed_message = self.__dict__.get("_packed_message")
+        if name in ("header", "payload") and packed_message != None:
+            self.header = bytes(packed_message[:HEADER_SIZE_BYTES])
+            self.payload = bytes(packed_message[HEADER_SIZE_BYTES:])
+            return getattr(self, name)
+        decode_payload = self.__dict__.pop("_decode_payload", None)
+        if decode_payload == None:
+            raise AttributeError("'{}' object has no attribute '{}'".format(self.__class__.__name__, name))
+        try:
+            fields = decode_payload()
+        except (struct.error, ValueError, IndexError) as e:
+            # a short or malformed payload leaves the message without its fields
+            raise AttributeError("'{}' payload could not be decoded: {}".format(self.__class__.__name__, e))
+        for (attr, value) in fields.items():
+            self.__dict__.setdefault(attr, value)
+        return getattr(self, name)
 
     def generate_packed_message(self):
         self.payload = self.get_payload()
@@ -52,53 +84,32 @@ class Message(object):
     def get_header(self):
         if self.size == None:
             self.size = self.get_msg_size()
-        frame_addr = self.get_frame_addr()
-        frame = self.get_frame()
-        protocol_header = self.get_protocol_header()
-        header = frame + frame_addr + protocol_header
-        return header
+        return codec.pack_header(self.size, self.source_id, self.target_addr, self.seq_num, self.message_type,
+                                 self.tagged, self.ack_requested, self.response_requested,
+                                 self.origin, self.addressable, self.protocol)
 
     # Default: No payload unless method overridden
     def get_payload(self):
-        return little_endian(bitstring.pack(""))
+        return b""
 
+    # The three header sections, kept for callers that build packets piecemeal
     def get_frame(self):
-        size_format = self.frame_format[0]
-        flags_format = self.frame_format[1]
-        source_id_format = self.frame_format[2]
-        size = little_endian(bitstring.pack(size_format, self.size))
-        flags = little_endian(bitstring.pack(flags_format, self.origin, self.tagged, self.addressable, self.protocol))
-        source_id = little_endian(bitstring.pack(source_id_format, self.source_id))
-        frame = size + flags + source_id
-        return frame
+        return self.get_header()[0:8]
 
     def get_frame_addr(self):
-        mac_addr_format = self.frame_addr_format[0]
-        reserved_48_format = self.frame_addr_format[1]
-        response_flags_format = self.frame_addr_format[2]
-        seq_num_format = self.frame_addr_format[3]
-        mac_addr = little_endian(bitstring.pack(mac_addr_format, convert_MAC_to_int(self.target_addr)))
-        reserved_48 = little_endian(bitstring.pack(reserved_48_format, self.reserved))
-        response_flags = little_endian(bitstring.pack(response_flags_format, self.reserved, self.ack_requested, self.response_requested))
-        seq_num = little_endian(bitstring.pack(seq_num_format, self.seq_num))
-        frame_addr = mac_addr + reserved_48 + response_flags + seq_num
-        return frame_addr
+        return self.get_header()[8:24]
 
     def get_protocol_header(self):
-        reserved_64_format = self.protocol_header_format[0]
-        message_type_format = self.protocol_header_format[1]
-        reserved_16_format = self.protocol_header_format[2]
-        reserved_64 = little_endian(bitstring.pack(reserved_64_format, self.reserved))
-        message_type = little_endian(bitstring.pack(message_type_format, self.message_type))
-        reserved_16 = little_endian(bitstring.pack(reserved_16_format, self.reserved))
-        protocol_header = reserved_64 + message_type + reserved_16
-        return protocol_header
+        return self.get_header()[24:HEADER_SIZE_BYTES]
 
     def get_msg_size(self):
         payload_size_bytes = len(self.payload)
         return HEADER_SIZE_BYTES + payload_size_bytes
 
     def __str__(self):
+        packed_message = self.packed_message
+        if len(self.payload_fields) == 0:
+            self.get_payload() # received messages skip packing, so collect their fields here
         indent = "  "
         s = self.__class__.__name__ + "\n"
         s += indent + "Size: {}\n".format(self.size)
@@ -118,21 +129,6 @@ class Message(object):
             s += "\n" + indent*2 + "<empty>"
         s += "\n"
         s += indent + "Bytes:\n"
-        s += indent*2 + str([hex(b) for b in struct.unpack("B"*(len(self.packed_message)),self.packed_message)])
+        s += indent*2 + str([hex(b) for b in struct.unpack("B"*(len(packed_message)),packed_message)])
         s += "\n"
         return s
-
-# reverses bytes for little endian, then converts to int
-def convert_MAC_to_int(addr):
-    reverse_bytes_str = addr.split(':')
-    reverse_bytes_str.reverse()
-    addr_str = "".join(reverse_bytes_str)
-    return int(addr_str, 16)
-
-def little_endian(bs):
-    shifts = [i*8 for i in range(int(len(bs)/8))]
-    int_bytes_little_endian = [int(bs.uintbe >> i & 0xff) for i in shifts]
-    packed_message_little_endian = b""
-    for b in int_bytes_little_endian:
-        packed_message_little_endian += struct.pack("B", b)
-    return packed_message_little_endian
@@ -6,9 +6,8 @@
 # Need to look into assert-type frameworks or something, there has to be a tool for that.
 # Also need to make custom errors possibly, though tool may have those.
 
-import bitstring
-
-from .message import BROADCAST_MAC, Message, little_endian
+from . import codec
+from .message import BROADCAST_MAC, Message
 
 
 ##### DEVICE MESSAGES #####
@@ -28,9 +27,7 @@ class StateService(Message):
     def get_payload(self):
         self.payload_fields.append(("Service", self.service))
         self.payload_fields.append(("Port", self.port))
-        service = little_endian(bitstring.pack("uint:8", self.service))
-        port = little_endian(bitstring.pack("uint:32", self.port))
-        payload = service + port
+        payload = codec.STATE_SERVICE.pack(self.service, self.port)
         return payload
 
 
@@ -52,11 +49,7 @@ class StateHostInfo(Message):
         self.payload_fields.append(("TX (bytes since on)", self.tx))
         self.payload_fields.append(("RX (bytes since on)", self.rx))
         self.payload_fields.append(("Reserved", self.reserved1))
-        signal = little_endian(bitstring.pack("uint:32", self.signal))
-        tx = little_endian(bitstring.pack("uint:32", self.tx))
-        rx = little_endian(bitstring.pack("uint:32", self.rx))
-        reserved1 = little_endian(bitstring.pack("uint:16", self.reserved1))
-        payload = signal + tx + rx + reserved1
+        payload = codec.STATE_HOST_INFO.pack(self.signal, self.tx, self.rx, self.reserved1)
         return payload
 
 
@@ -76,10 +69,7 @@ class StateHostFirmware(Message):
         self.payload_fields.append(("Timestamp of Build", self.build))
         self.payload_fields.append(("Reserved", self.reserved1))
         self.payload_fields.append(("Version", self.version))
-        build = little_endian(bitstring.pack("uint:64", self.build))
-        reserved1 = little_endian(bitstring.pack("uint:64", self.reserved1))
-        version = little_endian(bitstring.pack("uint:32", self.version))
-        payload = build + reserved1 + version
+        payload = codec.STATE_HOST_FIRMWARE.pack(self.build, self.reserved1, self.version)
         return payload
 
 
@@ -101,11 +91,7 @@ class StateWifiInfo(Message):
         self.payload_fields.append(("TX (bytes since on)", self.tx))
         self.payload_fields.append(("RX (bytes since on)", self.rx))
         self.payload_fields.append(("Reserved", self.reserved1))
-        signal = little_endian(bitstring.pack("uint:32", self.signal))
-        tx = little_endian(bitstring.pack("uint:32", self.tx))
-        rx = little_endian(bitstring.pack("uint:32", self.rx))
-        reserved1 = little_endian(bitstring.pack("uint:16", self.reserved1))
-        payload = signal + tx + rx + reserved1
+        payload = codec.STATE_WIFI_INFO.pack(self.signal, self.tx, self.rx, self.reserved1)
         return payload
 
 
@@ -125,10 +111,7 @@ class StateWifiFirmware(Message):
         self.payload_fields.append(("Timestamp of Build", self.build))
         self.payload_fields.append(("Reserved", self.reserved1))
         self.payload_fields.append(("Version", self.version))
-        build = little_endian(bitstring.pack("uint:64", self.build))
-        reserved1 = little_endian(bitstring.pack("uint:64", self.reserved1))
-        version = little_endian(bitstring.pack("uint:32", self.version))
-        payload = build + reserved1 + version
+        payload = codec.STATE_WIFI_FIRMWARE.pack(self.build, self.reserved1, self.version)
         return payload
 
 
@@ -144,8 +127,7 @@ class SetPower(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Power", self.power_level))
-        power_level = little_endian(bitstring.pack("uint:16", self.power_level))
-        payload = power_level
+        payload = codec.POWER.pack(self.power_level)
         return payload
 
 
@@ -156,8 +138,7 @@ class StatePower(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Power", self.power_level))
-        power_level = little_endian(bitstring.pack("uint:16", self.power_level))
-        payload = power_level
+        payload = codec.POWER.pack(self.power_level)
         return payload
 
 
@@ -173,13 +154,7 @@ class SetLabel(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Label", self.label))
-        field_len_bytes = 32
-        try:
-            label = b"".join(little_endian(bitstring.pack("uint:8", c)) for c in self.label.encode('utf-8'))
-        except ValueError: # because of differences in Python 2 and 3
-            label = b"".join(little_endian(bitstring.pack("uint:8", ord(c))) for c in self.label.encode('utf-8'))
-        padding = b"".join(little_endian(bitstring.pack("uint:8", 0)) for i in range(field_len_bytes-len(self.label)))
-        payload = label + padding
+        payload = codec.LABEL.pack(self.label.encode('utf-8'))
         return payload
 
 
@@ -190,13 +165,7 @@ class StateLabel(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Label", self.label))
-        field_len_bytes = 32
-        try:
-            label = b"".join(little_endian(bitstring.pack("uint:8", c)) for c in self.label.encode('utf-8'))
-        except ValueError: # because of differences in Python 2 and 3
-            label = b"".join(little_endian(bitstring.pack("uint:8", ord(c))) for c in self.label.encode('utf-8'))
-        padding = b"".join(little_endian(bitstring.pack("uint:8", 0)) for i in range(field_len_bytes-len(self.label)))
-        payload = label + padding
+        payload = codec.LABEL.pack(self.label.encode('utf-8'))
         return payload
 
 
@@ -216,10 +185,7 @@ class StateVersion(Message):
         self.payload_fields.append(("Vendor", self.vendor))
         self.payload_fields.append(("Reserved", self.product))
         self.payload_fields.append(("Version", self.version))
-        vendor = little_endian(bitstring.pack("uint:32", self.vendor))
-        product = little_endian(bitstring.pack("uint:32", self.product))
-        version = little_endian(bitstring.pack("uint:32", self.version))
-        payload = vendor + product + version
+        payload = codec.STATE_VERSION.pack(self.vendor, self.product, self.version)
         return payload
 
 
@@ -239,10 +205,7 @@ class StateInfo(Message):
         self.payload_fields.append(("Current Time", self.time))
         self.payload_fields.append(("Uptime (ns)", self.uptime))
         self.payload_fields.append(("Last Downtime Duration (ns) (5 second error)", self.downtime))
-        time = little_endian(bitstring.pack("uint:64", self.time))
-        uptime = little_endian(bitstring.pack("uint:64", self.uptime))
-        downtime = little_endian(bitstring.pack("uint:64", self.downtime))
-        payload = time + uptime + downtime
+        payload = codec.STATE_INFO.pack(self.time, self.uptime, self.downtime)
         return payload
 
 class GetLocation(Message):
@@ -261,15 +224,7 @@ class StateLocation(Message):
         self.payload_fields.append(("Location", self.location))
         self.payload_fields.append(("Label", self.label))
         self.payload_fields.append(("Updated At", self.updated_at))
-        location = b"".join(little_endian(bitstring.pack("uint:8", b)) for b in self.location)
-        try:
-            label = b"".join(little_endian(bitstring.pack("uint:8", c)) for c in self.label.encode('utf-8'))
-        except ValueError: # because of differences in Python 2 and 3
-            label = b"".join(little_endian(bitstring.pack("uint:8", ord(c))) for c in self.label.encode('utf-8'))
-        label_padding = b"".join(little_endian(bitstring.pack("uint:8", 0)) for i in range(32-len(self.label)))
-        label += label_padding
-        updated_at = little_endian(bitstring.pack("uint:64", self.updated_at))
-        payload = location + label + updated_at
+        payload = codec.STATE_LOCATION.pack(bytes(self.location), self.label.encode('utf-8'), self.updated_at)
         return payload
 
 class GetGroup(Message):
@@ -288,15 +243,7 @@ class StateGroup(Message):
         self.payload_fields.append(("Group", self.group))
         self.payload_fields.append(("Label", self.label))
         self.payload_fields.append(("Updated At", self.updated_at))
-        group = b"".join(little_endian(bitstring.pack("uint:8", b)) for b in self.group)
-        try:
-            label = b"".join(little_endian(bitstring.pack("uint:8", c)) for c in self.label.encode('utf-8'))
-        except ValueError: # because of differences in Python 2 and 3
-            label = b"".join(little_endian(bitstring.pack("uint:8", ord(c))) for c in self.label.encode('utf-8'))
-        label_padding = b"".join(little_endian(bitstring.pack("uint:8", 0)) for i in range(32-len(self.label)))
-        label += label_padding
-        updated_at = little_endian(bitstring.pack("uint:64", self.updated_at))
-        payload = group + label + updated_at
+        payload = codec.STATE_GROUP.pack(bytes(self.group), self.label.encode('utf-8'), self.updated_at)
         return payload
 
 class Acknowledgement(Message):
@@ -311,14 +258,7 @@ class EchoRequest(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Byte Array", self.byte_array))
-        field_len = 64
-        byte_array = b"".join(little_endian(bitstring.pack("uint:8", b)) for b in self.byte_array)
-        byte_array_len = len(byte_array)
-        if byte_array_len < field_len:
-            byte_array += b"".join(little_endian(bitstring.pack("uint:8", 0)) for i in range(field_len-byte_array_len))
-        elif byte_array_len > field_len:
-            byte_array = byte_array[:field_len]
-        payload = byte_array
+        payload = codec.ECHO_REQUEST.pack(bytes(self.byte_array))
         return payload
 
 
@@ -329,8 +269,19 @@ class EchoResponse(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Byte Array", self.byte_array))
-        byte_array = b"".join(little_endian(bitstring.pack("uint:8", b)) for b in self.byte_array)
-        payload = byte_array
+        payload = bytes(self.byte_array)
+        return payload
+
+
+# Sent (by newer firmware) in reply to a message type the device doesn't support
+class StateUnhandled(Message):
+    def __init__(self, target_addr, source_id, seq_num, payload, ack_requested=False, response_requested=False):
+        self.unhandled_type = payload["unhandled_type"]
+        super(StateUnhandled, self).__init__(MSG_IDS[StateUnhandled], target_addr, source_id, seq_num, ack_requested, response_requested)
+
+    def get_payload(self):
+        self.payload_fields.append(("Unhandled Type", self.unhandled_type))
+        payload = codec.STATE_UNHANDLED.pack(self.unhandled_type)
         return payload
 
 
@@ -351,10 +302,7 @@ class LightSetColor(Message):
     def get_payload(self):
         self.payload_fields.append(("Color", self.color))
         self.payload_fields.append(("Duration", self.duration))
-        reserved_8 = little_endian(bitstring.pack("uint:8", self.reserved))
-        color = b"".join(little_endian(bitstring.pack("uint:16", field)) for field in self.color)
-        duration = little_endian(bitstring.pack("uint:32", self.duration))
-        payload = reserved_8 + color + duration
+        payload = codec.LIGHT_SET_COLOR.pack(self.reserved, *self.color, self.duration)
         return payload
 
 
@@ -375,14 +323,39 @@ class LightSetWaveform(Message):
         self.payload_fields.append(("Cycles", self.cycles))
         self.payload_fields.append(("Duty Cycle", self.duty_cycle))
         self.payload_fields.append(("Waveform", self.waveform))
-        reserved_8 = little_endian(bitstring.pack("uint:8", self.reserved))
-        transient = little_endian(bitstring.pack("uint:8", self.transient))
-        color = b"".join(little_endian(bitstring.pack("uint:16", field)) for field in self.color)
-        period = little_endian(bitstring.pack("uint:32", self.period))
-        cycles = little_endian(bitstring.pack("float:32", self.cycles))
-        duty_cycle = little_endian(bitstring.pack("int:16", self.duty_cycle))
-        waveform = little_endian(bitstring.pack("uint:8", self.waveform))
-        payload = reserved_8 + transient + color + period + cycles + duty_cycle + waveform
+        payload = codec.LIGHT_SET_WAVEFORM.pack(self.reserved, self.transient, *self.color, self.period, self.cycles, self.duty_cycle, self.waveform)
+        return payload
+
+
+# Like LightSetWaveform, but only the components of color whose set_* flag is
+# true are changed; the others are left as they are on the device.
+class LightSetWaveformOptional(Message):
+    def __init__(self, target_addr, source_id, seq_num, payload, ack_requested=False, response_requested=False):
+        self.transient = payload["transient"]
+        self.color = payload["color"]
+        self.period = payload["period"]
+        self.cycles = payload["cycles"]
+        self.duty_cycle = payload["duty_cycle"]
+        self.waveform = payload["waveform"]
+        self.set_hue = payload["set_hue"]
+        self.set_saturation = payload["set_saturation"]
+        self.set_brightness = payload["set_brightness"]
+        self.set_kelvin = payload["set_kelvin"]
+        super(LightSetWaveformOptional, self).__init__(MSG_IDS[LightSetWaveformOptional], target_addr, source_id, seq_num, ack_requested, response_requested)
+
+    def get_payload(self):
+        self.payload_fields.append(("Is Transient", self.transient))
+        self.payload_fields.append(("Color", self.color))
+        self.payload_fields.append(("Period", self.period))
+        self.payload_fields.append(("Cycles", self.cycles))
+        self.payload_fields.append(("Duty Cycle", self.duty_cycle))
+        self.payload_fields.append(("Waveform", self.waveform))
+        self.payload_fields.append(("Set Hue", self.set_hue))
+        self.payload_fields.append(("Set Saturation", self.set_saturation))
+        self.payload_fields.append(("Set Brightness", self.set_brightness))
+        self.payload_fields.append(("Set Kelvin", self.set_kelvin))
+        payload = codec.LIGHT_SET_WAVEFORM_OPTIONAL.pack(self.reserved, self.transient, *self.color, self.period, self.cycles, self.duty_cycle, self.waveform,
+                                                         self.set_hue, self.set_saturation, self.set_brightness, self.set_kelvin)
         return payload
 
 
@@ -401,17 +374,7 @@ class LightState(Message):
         self.payload_fields.append(("Power Level", self.power_level))
         self.payload_fields.append(("Label", self.label))
         self.payload_fields.append(("Reserved", self.reserved2))
-        color = b"".join(little_endian(bitstring.pack("uint:16", field)) for field in self.color)
-        reserved1 = little_endian(bitstring.pack("uint:16", self.reserved1))
-        power_level = little_endian(bitstring.pack("uint:16", self.power_level))
-        try:
-            label = b"".join(little_endian(bitstring.pack("uint:8", c)) for c in self.label.encode('utf-8'))
-        except ValueError: # because of differences in Python 2 and 3
-            label = b"".join(little_endian(bitstring.pack("uint:8", ord(c))) for c in self.label.encode('utf-8'))
-        label_padding = b"".join(little_endian(bitstring.pack("uint:8", 0)) for i in range(32-len(self.label)))
-        label += label_padding
-        reserved2 = little_endian(bitstring.pack("uint:64", self.reserved1))
-        payload = color + reserved1 + power_level + label + reserved2
+        payload = codec.LIGHT_STATE.pack(*self.color, self.reserved1, self.power_level, self.label.encode('utf-8'), self.reserved2)
         return payload
 
 
@@ -429,9 +392,7 @@ class LightSetPower(Message):
     def get_payload(self):
         self.payload_fields.append(("Power Level", self.power_level))
         self.payload_fields.append(("Duration", self.duration))
-        power_level = little_endian(bitstring.pack("uint:16", self.power_level))
-        duration = little_endian(bitstring.pack("uint:32", self.duration))
-        payload = power_level + duration
+        payload = codec.LIGHT_SET_POWER.pack(self.power_level, self.duration)
         return payload
 
 
@@ -442,8 +403,7 @@ class LightStatePower(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Power Level", self.power_level))
-        power_level = little_endian(bitstring.pack("uint:16", self.power_level))
-        payload = power_level
+        payload = codec.POWER.pack(self.power_level)
         return payload
 
 ##### INFRARED MESSAGES #####
@@ -459,8 +419,7 @@ class LightStateInfrared(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Infrared Brightness", self.infrared_brightness))
-        infrared_brightness = little_endian(bitstring.pack("uint:16", self.infrared_brightness))
-        payload = infrared_brightness
+        payload = codec.INFRARED.pack(self.infrared_brightness)
         return payload
 
 class LightSetInfrared(Message):
@@ -470,8 +429,7 @@ class LightSetInfrared(Message):
 
     def get_payload(self):
         self.payload_fields.append(("Infrared Brightness", self.infrared_brightness))
-        infrared_brightness = little_endian(bitstring.pack("uint:16", self.infrared_brightness))
-        payload = infrared_brightness
+        payload = codec.INFRARED.pack(self.infrared_brightness)
         return payload
 
 ##### MULTIZONE MESSAGES #####
@@ -487,11 +445,7 @@ class MultiZoneStateMultiZone(Message):
         self.payload_fields.append(("Count", self.count))
         self.payload_fields.append(("Index", self.index))
         self.payload_fields.append(("Color (HSBK)", self.color))
-        count = little_endian(bitstring.pack("uint:8", self.count))
-        index = little_endian(bitstring.pack("uint:8", self.index))
-        payload = count + index
-        for color in self.color:
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
+        payload = codec.MULTIZONE_STATE_MULTIZONE_HEADER.pack(self.count, self.index) + codec.pack_colors(self.color)
         return payload
 
 class MultiZoneStateZone(Message): #503
@@ -505,10 +459,7 @@ class MultiZoneStateZone(Message): #503
         self.payload_fields.append(("Count", self.count))
         self.payload_fields.append(("Index", self.index))
         self.payload_fields.append(("Color (HSBK)", self.color))
-        count = little_endian(bitstring.pack("uint:8", self.count))
-        index = little_endian(bitstring.pack("uint:8", self.index))
-        color = b"".join(little_endian(bitstring.pack("uint:16", field)) for field in self.color)
-        payload = count + index + color
+        payload = codec.MULTIZONE_STATE_ZONE.pack(self.count, self.index, *self.color)
         return payload
 
 class MultiZoneSetColorZones(Message):
@@ -526,12 +477,7 @@ class MultiZoneSetColorZones(Message):
         self.payload_fields.append(("Color", self.color))
         self.payload_fields.append(("Duration", self.duration))
         self.payload_fields.append(("Apply", self.apply))
-        start_index = little_endian(bitstring.pack("uint:8", self.start_index))
-        end_index = little_endian(bitstring.pack("uint:8", self.end_index))
-        color = b"".join(little_endian(bitstring.pack("uint:16", field)) for field in self.color)
-        duration = little_endian(bitstring.pack("uint:32", self.duration))
-        apply = little_endian(bitstring.pack("uint:8", self.apply))
-        payload = start_index + end_index + color + duration + apply
+        payload = codec.MULTIZONE_SET_COLOR_ZONES.pack(self.start_index, self.end_index, *self.color, self.duration, self.apply)
         return payload
 
 class MultiZoneGetColorZones(Message):
@@ -543,9 +489,7 @@ class MultiZoneGetColorZones(Message):
     def get_payload(self):
         self.payload_fields.append(("Start Index", self.start_index))
         self.payload_fields.append(("End Index", self.end_index))
-        start_index = little_endian(bitstring.pack("uint:8", self.start_index))
-        end_index = little_endian(bitstring.pack("uint:8", self.end_index))
-        payload = start_index + end_index
+        payload = codec.MULTIZONE_GET_COLOR_ZONES.pack(self.start_index, self.end_index)
         return payload
 
 class GetMultiZoneEffect(Message):
@@ -573,16 +517,7 @@ class SetMultiZoneEffect(Message):
         self.payload_fields.append(("Reserved", self.reserved2))
         self.payload_fields.append(("Reserved", self.reserved3))
         self.payload_fields.append(("Parameters", self.parameters))
-        instanceid = little_endian(bitstring.pack("uint:32", self.instanceid))
-        effect_type = little_endian(bitstring.pack("uint:8", self.effect_type))
-        reserved1 = little_endian(bitstring.pack("uint:16", self.reserved1))
-        speed = little_endian(bitstring.pack("uint:32", self.speed))
-        duration = little_endian(bitstring.pack("uint:64", self.duration))
-        reserved2 = little_endian(bitstring.pack("uint:32", self.reserved2))
-        reserved3 = little_endian(bitstring.pack("uint:32", self.reserved3))
-        payload = instanceid + effect_type + reserved1 + speed + duration + reserved2 + reserved3
-        for parameter in self.parameters:
-            payload += little_endian(bitstring.pack("uint:32", parameter))
+        payload = codec.MULTIZONE_EFFECT.pack(self.instanceid, self.effect_type, self.reserved1, self.speed, self.duration, self.reserved2, self.reserved3, *self.parameters)
         return payload
 
 class StateMultiZoneEffect(Message):
@@ -606,16 +541,7 @@ class StateMultiZoneEffect(Message):
         self.payload_fields.append(("Reserved", self.reserved2))
         self.payload_fields.append(("Reserved", self.reserved3))
         self.payload_fields.append(("Parameters", self.parameters))
-        instanceid = little_endian(bitstring.pack("uint:32", self.instanceid))
-        effect_type = little_endian(bitstring.pack("uint:8", self.effect_type))
-        reserved1 = little_endian(bitstring.pack("uint:16", self.reserved1))
-        speed = little_endian(bitstring.pack("uint:32", self.speed))
-        duration = little_endian(bitstring.pack("uint:64", self.duration))
-        reserved2 = little_endian(bitstring.pack("uint:32", self.reserved2))
-        reserved3 = little_endian(bitstring.pack("uint:32", self.reserved3))
-        payload = instanceid + effect_type + reserved1 + speed + duration + reserved2 + reserved3
-        for parameter in self.parameters:
-            payload += little_endian(bitstring.pack("uint:32", parameter))
+        payload = codec.MULTIZONE_EFFECT.pack(self.instanceid, self.effect_type, self.reserved1, self.speed, self.duration, self.reserved2, self.reserved3, *self.parameters)
         return payload
     
 class MultiZoneSetExtendedColorZones(Message):
@@ -633,17 +559,7 @@ class MultiZoneSetExtendedColorZones(Message):
         self.payload_fields.append(("Colors", self.colors))
         self.payload_fields.append(("Duration", self.duration))
         self.payload_fields.append(("Apply", self.apply))
-
-        duration = little_endian(bitstring.pack("uint:32", self.duration))
-        apply = little_endian(bitstring.pack("uint:8", self.apply))
-        zone_index = little_endian(bitstring.pack("uint:16", self.index))
-        colors_count = little_endian(bitstring.pack("uint:8", self.count))
-        duration = little_endian(bitstring.pack("uint:32", self.duration))
-        apply = little_endian(bitstring.pack("uint:8", self.apply))
-        payload = duration + apply + zone_index + colors_count
-        for color in self.colors: ## Test if color padding is needed to make array length 82
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
-
+        payload = codec.MULTIZONE_SET_EXTENDED_COLOR_ZONES_HEADER.pack(self.duration, self.apply, self.index, self.count) + codec.pack_colors(self.colors)
         return payload
     
 class MultiZoneGetExtendedColorZones(Message):
@@ -663,14 +579,9 @@ class MultiZoneStateExtendedColorZones(Message):
         self.payload_fields.append(("Index", self.index))
         self.payload_fields.append(("Colors Count", self.cCount))
         self.payload_fields.append(("Colors (HSBK)", self.colors))
-        count = little_endian(bitstring.pack("uint:16", self.count))
-        index = little_endian(bitstring.pack("uint:16", self.index))
-        cCount = little_endian(bitstring.pack("uint:8", self.cCount))
-        payload = count + index + cCount
-        for color in self.colors:
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
+        payload = codec.MULTIZONE_STATE_EXTENDED_COLOR_ZONES_HEADER.pack(self.count, self.index, self.cCount) + codec.pack_colors(self.colors)
         return payload
-    
+
 ##### TILE MESSAGES #####
 
 class GetDeviceChain(Message):
@@ -690,28 +601,9 @@ class StateDeviceChain(Message):
         self.payload_fields.append(("Start Index", self.start_index))
         self.payload_fields.append(("Total Count", self.total_count))
         self.payload_fields.append(("Tile Devices", self.tile_devices))
-        start_idex = little_endian(bitstring.pack("uint:8", self.start_index))
-        payload = start_idex
-        for tile in self.tile_devices:
-            reserved1 = little_endian(bitstring.pack("int:16", tile['reserved1']))
-            reserved2 = little_endian(bitstring.pack("int:16", tile['reserved2']))
-            reserved3 = little_endian(bitstring.pack("int:16", tile['reserved3']))
-            reserved4 = little_endian(bitstring.pack("int:16", tile['reserved4']))
-            user_x = little_endian(bitstring.pack("float:32", tile['user_x']))
-            user_y = little_endian(bitstring.pack("float:32", tile['user_y']))
-            width = little_endian(bitstring.pack("uint:8", tile['width']))
-            height = little_endian(bitstring.pack("uint:8", tile['height']))
-            reserved5 = little_endian(bitstring.pack("uint:8", tile['reserved5']))
-            device_version_vendor = little_endian(bitstring.pack("uint:32", tile['device_version_vendor']))
-            device_version_product = little_endian(bitstring.pack("uint:32", tile['device_version_product']))
-            device_version_version = little_endian(bitstring.pack("uint:32", tile['device_version_version']))
-            firmware_build = little_endian(bitstring.pack("uint:64", tile['firmware_build']))
-            reserved6 = little_endian(bitstring.pack("uint:64", tile['reserved6']))
-            firmware_version = little_endian(bitstring.pack("uint:32", tile['firmware_version']))
-            reserved7 = little_endian(bitstring.pack("uint:32", tile['reserved7']))
-            payload += reserved1 + reserved2 + reserved3 + reserved4 + user_x + user_y + width + height + reserved5 + device_version_vendor + device_version_product + device_version_version + firmware_build + reserved6 + firmware_version + reserved7
-        total_count = little_endian(bitstring.pack("uint:8", self.total_count))
-        payload += total_count
+        payload = codec.STATE_DEVICE_CHAIN_START.pack(self.start_index)
+        payload += b"".join(codec.TILE.pack(*[tile[field] for field in codec.TILE_FIELDS]) for tile in self.tile_devices)
+        payload += codec.STATE_DEVICE_CHAIN_END.pack(self.total_count)
         return payload
 
 class SetUserPosition(Message):
@@ -728,11 +620,7 @@ class SetUserPosition(Message):
         self.payload_fields.append(("Reserved", self.reserved))
         self.payload_fields.append(("User X", self.user_x))
         self.payload_fields.append(("User Y", self.user_y))
-        tile_index = little_endian(bitstring.pack("uint:8", self.tile_index))
-        reserved = little_endian(bitstring.pack("uint:16", self.reserved))
-        user_x = little_endian(bitstring.pack("float:32", self.user_x))
-        user_y = little_endian(bitstring.pack("float:32", self.user_y))
-        payload = tile_index + reserved + user_x + user_y
+        payload = codec.SET_USER_POSITION.pack(self.tile_index, self.reserved, self.user_x, self.user_y)
         return payload
 
 class GetTileState64(Message):
@@ -753,13 +641,7 @@ class GetTileState64(Message):
         self.payload_fields.append(("X", self.x))
         self.payload_fields.append(("Y", self.y))
         self.payload_fields.append(("Width", self.width))
-        tile_index = little_endian(bitstring.pack("uint:8", self.tile_index))
-        length = little_endian(bitstring.pack("uint:8", self.length))
-        reserved = little_endian(bitstring.pack("uint:8", self.reserved))
-        x = little_endian(bitstring.pack("uint:8", self.x))
-        y = little_endian(bitstring.pack("uint:8", self.y))
-        width = little_endian(bitstring.pack("uint:8", self.width))
-        payload = tile_index + length + reserved + x + y + width
+        payload = codec.GET_TILE_STATE_64.pack(self.tile_index, self.length, self.reserved, self.x, self.y, self.width)
         return payload
 
 class StateTileState64(Message):
@@ -780,14 +662,7 @@ class StateTileState64(Message):
         self.payload_fields.append(("Y", self.y))
         self.payload_fields.append(("Width", self.width))
         self.payload_fields.append(("Colors[64]", self.colors))
-        tile_index = little_endian(bitstring.pack("uint:8", self.tile_index))
-        reserved = little_endian(bitstring.pack("uint:8", self.reserved))
-        x = little_endian(bitstring.pack("uint:8", self.x))
-        y = little_endian(bitstring.pack("uint:8", self.y))
-        width = little_endian(bitstring.pack("uint:8", self.width))
-        payload = tile_index + reserved + x + y + width
-        for color in self.colors:
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
+        payload = codec.STATE_TILE_STATE_64_HEADER.pack(self.tile_index, self.reserved, self.x, self.y, self.width) + codec.pack_colors(self.colors)
         return payload
 
 class SetTileState64(Message):
@@ -812,16 +687,7 @@ class SetTileState64(Message):
         self.payload_fields.append(("Width", self.width))
         self.payload_fields.append(("Duration", self.duration))
         self.payload_fields.append(("Colors", self.colors))
-        tile_index = little_endian(bitstring.pack("uint:8", self.tile_index))
-        length = little_endian(bitstring.pack("uint:8", self.length))
-        reserved = little_endian(bitstring.pack("uint:8", self.reserved))
-        x = little_endian(bitstring.pack("uint:8", self.x))
-        y = little_endian(bitstring.pack("uint:8", self.y))
-        width = little_endian(bitstring.pack("uint:8", self.width))
-        duration = little_endian(bitstring.pack("uint:32", self.duration))
-        payload = tile_index + length + reserved + x + y + width + duration
-        for color in self.colors:
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
+        payload = codec.SET_TILE_STATE_64_HEADER.pack(self.tile_index, self.length, self.reserved, self.x, self.y, self.width, self.duration) + codec.pack_colors(self.colors)
         return payload
 
 class GetTileEffect(Message):
@@ -855,21 +721,9 @@ class SetTileEffect(Message):
         self.payload_fields.append(("Parameters", self.parameters))
         self.payload_fields.append(("Palette Count", self.palette_count))
         self.payload_fields.append(("Palette", self.palette))
-        reserved1 = little_endian(bitstring.pack("uint:8", self.reserved1))
-        reserved2 = little_endian(bitstring.pack("uint:8", self.reserved2))
-        instanceid = little_endian(bitstring.pack("uint:32", self.instanceid))
-        effect_type = little_endian(bitstring.pack("uint:8", self.effect_type))
-        speed = little_endian(bitstring.pack("uint:32", self.speed))
-        duration = little_endian(bitstring.pack("uint:64", self.duration))
-        reserved3 = little_endian(bitstring.pack("uint:32", self.reserved3))
-        reserved4 = little_endian(bitstring.pack("uint:32", self.reserved4))
-        payload = reserved1 + reserved2 + instanceid + effect_type + speed + duration + reserved3 + reserved4
-        for parameter in self.parameters:
-            payload += little_endian(bitstring.pack("uint:32", parameter))
-        palette_count = little_endian(bitstring.pack("uint:8", self.palette_count))
-        payload += palette_count
-        for color in self.palette:
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
+        payload = codec.SET_TILE_EFFECT_HEADER.pack(self.reserved1, self.reserved2, self.instanceid, self.effect_type, self.speed, self.duration,
+                                                   self.reserved3, self.reserved4, *self.parameters, self.palette_count)
+        payload += codec.pack_colors(self.palette)
         return payload
 
 class StateTileEffect(Message):
@@ -897,20 +751,9 @@ class StateTileEffect(Message):
         self.payload_fields.append(("Parameters", self.parameters))
         self.payload_fields.append(("Palette Count", self.palette_count))
         self.payload_fields.append(("Palette", self.palette))
-        reserved1 = little_endian(bitstring.pack("uint:8", self.reserved1))
-        instanceid = little_endian(bitstring.pack("uint:32", self.instanceid))
-        effect_type = little_endian(bitstring.pack("uint:8", self.effect_type))
-        speed = little_endian(bitstring.pack("uint:32", self.speed))
-        duration = little_endian(bitstring.pack("uint:64", self.duration))
-        reserved2 = little_endian(bitstring.pack("uint:32", self.reserved2))
-        reserved3 = little_endian(bitstring.pack("uint:32", self.reserved3))
-        payload = reserved1 + instanceid + effect_type + speed + duration + reserved2 + reserved3
-        for parameter in self.parameters:
-            payload += little_endian(bitstring.pack("uint:32", parameter))
-        palette_count = little_endian(bitstring.pack("uint:8", self.palette_count))
-        payload += palette_count
-        for color in self.palette:
-            payload += b"".join(little_endian(bitstring.pack("uint:16", field)) for field in color)
+        payload = codec.STATE_TILE_EFFECT_HEADER.pack(self.reserved1, self.instanceid, self.effect_type, self.speed, self.duration,
+                                                     self.reserved2, self.reserved3, *self.parameters, self.palette_count)
+        payload += codec.pack_colors(self.palette)
         return payload
 
 ##### Switch Messages #####
@@ -923,9 +766,7 @@ class StateRPower(Message):
     def get_payload(self):
         self.payload_fields.append(("Relay Index", self.relay_index))
         self.payload_fields.append(("Level", self.level))
-        relay_index = little_endian(bitstring.pack("uint:8", self.relay_index))
-        level = little_endian(bitstring.pack("16", self.level))
-        payload = relay_index + level
+        payload = codec.RPOWER.pack(self.relay_index, self.level)
         return payload
 
 class GetRPower(Message):
@@ -935,8 +776,7 @@ class GetRPower(Message):
     
     def get_payload(self):
         self.payload_fields.append(("relay_index", self.relay_index))
-        relay_index = little_endian(bitstring.pack("uint:8", self.relay_index))
-        payload = relay_index
+        payload = codec.GET_RPOWER.pack(self.relay_index)
         return payload
 
 class SetRPower(Message):
@@ -948,9 +788,7 @@ class SetRPower(Message):
     def get_payload(self):
         self.payload_fields.append(("relay_index", self.relay_index))
         self.payload_fields.append(("level", self.level))
-        relay_index = little_endian(bitstring.pack("uint:8", self.relay_index))
-        level = little_endian(bitstring.pack("uint:16", self.level))
-        payload = relay_index + level
+        payload = codec.RPOWER.pack(self.relay_index, self.level)
         return payload
         
 
@@ -982,6 +820,7 @@ MSG_IDS = {     GetService: 2,
                 StateGroup: 53,
                 EchoRequest: 58,
                 EchoResponse: 59,
+                StateUnhandled: 223,
                 LightGet: 101,
                 LightSetColor: 102,
                 LightSetWaveform: 103,
@@ -989,6 +828,7 @@ MSG_IDS = {     GetService: 2,
                 LightGetPower: 116,
                 LightSetPower: 117,
                 LightStatePower: 118,
+                LightSetWaveformOptional: 119,
                 LightGetInfrared: 120,
                 LightStateInfrared: 121,
                 LightSetInfrared: 122,
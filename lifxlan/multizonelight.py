@@ -4,53 +4,58 @@
 import math
 import random
 
-from .device import WorkflowException
+from . import codec
+from .device import WorkflowException, is_last_zone_segment
 from .errors import InvalidParameterException
 from .light import Light
-from .msgtypes import MultiZoneGetColorZones, MultiZoneSetColorZones, MultiZoneStateMultiZone, MultiZoneStateZone, GetMultiZoneEffect, SetMultiZoneEffect, StateMultiZoneEffect, MultiZoneGetExtendedColorZones, MultiZoneSetExtendedColorZones, MultiZoneStateExtendedColorZones
+from .msgtypes import Acknowledgement, MultiZoneGetColorZones, MultiZoneSetColorZones, MultiZoneStateMultiZone, MultiZoneStateZone, GetMultiZoneEffect, SetMultiZoneEffect, StateMultiZoneEffect, MultiZoneGetExtendedColorZones, MultiZoneSetExtendedColorZones, MultiZoneStateExtendedColorZones, StateUnhandled
+from .products import extended_multizone_min_firmware
 
 
 class MultiZoneLight(Light):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
-        super(MultiZoneLight, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
+        super(MultiZoneLight, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
+        self.extended_multizone = None # whether extended multizone messages work, once known
+        self.zone_frame_stats = {"frames": 0, "packets": 0, "last_frame_packets": 0}
 
-    # 0 indexed, NOT inclusive, works like python list indices
+    # 0 indexed, NOT inclusive, works like python list indices. Read with the
+    # extended multizone messages if the device supports them. Returns an
+    # (N, 4) array instead of a list when NumPy colors are enabled.
     def get_color_zones(self, start=None, end=None):
-        response = self.req_with_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":0, "end_index":255})
-        total_zones = response.count
-        # validate indices
-        if start != None and end != None:
-            # automatically truncate if the end is too large
-            if end > total_zones:
-                end = total_zones
-            if start >= total_zones:
-                raise ValueError("In the function get_color_zones, starting index is greater than the total available zones (provided start = {}, end = {} for a device with {} total zones).".format(start, end, total_zones))
-            if end <= start:
-                raise ValueError("In the function get_color_zones, end must be greater than start (provided start = {}, end = {}).".format(start, end, total_zones))
-        if (start != None and end == None) or (start == None and end != None):
-            raise ValueError("In the function get_color_zones, start and end indices must both be provided, or neither provided.")
-
-        # get all zones
-        all_zones = []
-        for i in range(total_zones):
-            all_zones.append(None)
-        for i in range(int(math.ceil(total_zones/8.0))):
-            response = self.req_with_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":0+(i*8), "end_index":7+(i*8)})
-            first_included_zone = response.index
-            if first_included_zone + 8 > total_zones:
-                last_included_zone = total_zones-1
-                last_index = last_included_zone - first_included_zone
-            else:
-                last_included_zone = first_included_zone + 7
-                last_index = 8
-            all_zones[first_included_zone:last_included_zone+1] = response.color[:last_index+1]
-        self.color = all_zones
-
-        if start != None and end != None:
-            self.color = all_zones[start:end]
-
+        if self.supports_extended_multizone():
+            try:
+                all_zones = self.extended_get_color_zones()
+            except WorkflowException:
+                # a StateUnhandled reply turns extended_multizone off, and the
+                # zones are read the old way; anything else is a real failure
+                if self.extended_multizone:
+                    raise
+        if not self.extended_multizone:
+            all_zones = codec.color_array(self.get_all_color_zones())
+        self.color = select_zones(all_zones, start, end)
+        self.cache_state("zone_frame", zone_frame_colors(all_zones))
         return self.color
 
+    # Reads every zone with the original multizone messages. A single
+    # GetColorZones(0, 255) makes the device send every 8-zone StateMultiZone,
+    # so they're all collected from that one request and only segments that
+    # went missing are asked for again.
+    def get_all_color_zones(self):
+        zones = {} # zone index: color
+        def has_all_zones(response):
+            return add_zone_colors(zones, response) <= len(zones)
+        responses = self.req_with_multiple_resp(MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":0, "end_index":255},
+                                                is_complete=has_all_zones, partial=True)
+        total_zones = responses[0].count
+        requests = []
+        for (first, last) in missing_zone_segments(zones, total_zones):
+            requests.append((MultiZoneGetColorZones, [MultiZoneStateZone, MultiZoneStateMultiZone], {"start_index":first, "end_index":last}))
+        for response in self.req_with_resp_pipelined(requests):
+            add_zone_colors(zones, response)
+        if len(zones) < total_zones:
+            raise WorkflowException("WorkflowException: Did not receive all {} zones from {} (Name: {}) in response to {}".format(total_zones, self.mac_addr, self.label, MultiZoneGetColorZones))
+        return [zones[i] for i in range(total_zones)]
+
     def set_zone_color(self, start_index, end_index, color, duration=0, rapid=False, apply=1):
         if len(color) == 4:
             try:
@@ -65,83 +70,267 @@ class MultiZoneLight(Light):
             except WorkflowException as e:
                 raise
 
-    # Sets colors for all zones given a list of HSVK colors
+    # Sets colors for all zones given a list of HSVK colors. Neighboring zones
+    # with the same color are set with one range message, or the whole list is
+    # sent in extended messages (82 zones each) if the device supports them
+    # and that takes fewer packets. Returns the number of packets sent.
     def set_zone_colors(self, colors, duration=0, rapid=False):
-        for (i, color) in enumerate(colors):
-            apply = 0
-            if i == len(colors)-1:
-                apply = 1
-            self.set_zone_color(i, i+1, color, duration, rapid, apply)
+        colors = [tuple(color) for color in colors]
+        return self.write_zone_frame(colors, zone_runs(colors), duration, rapid)
+
+    # Like set_zone_colors, but only sends the zones that changed since the
+    # last frame written by set_zone_colors or push_zone_frame (or read by
+    # get_color_zones). Anything else that changes the zone colors, such as
+    # set_color, makes the next frame go out in full. With rapid=True a lost
+    # packet goes unnoticed until set_zone_colors is called again.
+    def push_zone_frame(self, colors, duration=0, rapid=False):
+        colors = [tuple(color) for color in colors]
+        previous = self.state_cache.get("zone_frame", (None, None))[0]
+        return self.write_zone_frame(colors, changed_zone_runs(previous, colors), duration, rapid)
+
+    # Writes colors with a message per run in runs, or in full with extended
+    # messages if that takes fewer packets
+    def write_zone_frame(self, colors, runs, duration=0, rapid=False):
+        extended_packets = extended_zone_packets(len(colors))
+        if extended_packets < len(runs) and self.supports_extended_multizone():
+            self.extended_set_zone_color(colors, 0, duration, rapid)
+            packets = extended_packets
+        else:
+            self.set_zone_runs(runs, duration, rapid)
+            packets = len(runs)
+        self.cache_state("zone_frame", colors)
+        record_zone_frame(self.zone_frame_stats, packets)
+        return packets
+
+    # runs is a list of (start, end, color) with inclusive zone indices. Only
+    # the last message applies the changes.
+    def set_zone_runs(self, runs, duration=0, rapid=False, apply=1):
+        if len(runs) == 0:
+            return
+        payloads = zone_run_payloads(runs, duration, apply)
+        try:
+            if rapid:
+                for payload in payloads:
+                    self.fire_and_forget(MultiZoneSetColorZones, payload, num_repeats=1)
+            else:
+                # the queued changes can be in flight together, but the message
+                # that applies them has to go out after they have all arrived
+                self.req_with_resp_pipelined([(MultiZoneSetColorZones, Acknowledgement, payload) for payload in payloads[:-1]])
+                self.req_with_ack(MultiZoneSetColorZones, payloads[-1])
+        except WorkflowException as e:
+            raise
+
+    # Whether the device supports the extended multizone messages, worked out
+    # once from its product and host firmware version. Products this library
+    # doesn't know are asked: firmware without support answers StateUnhandled
+    # (or, if older still, nothing at all).
+    def supports_extended_multizone(self):
+        if self.extended_multizone == None:
+            product = self.product if self.product != None else self.get_product()
+            min_firmware = extended_multizone_min_firmware.get(product)
+            if min_firmware == None:
+                self.extended_multizone = self.probe_extended_multizone()
+            else:
+                self.extended_multizone = min_firmware == (0, 0) or self.get_host_firmware_version_tuple() >= min_firmware
+        return self.extended_multizone
+
+    def probe_extended_multizone(self):
+        try:
+            responses = self.req_with_multiple_resp(MultiZoneGetExtendedColorZones, [MultiZoneStateExtendedColorZones, StateUnhandled], is_complete=is_extended_zones_answer)
+        except WorkflowException:
+            return False
+        return type(responses[-1]) != StateUnhandled
+
+    # frames: set_zone_colors and push_zone_frame calls, packets: packets
+    # they sent in total, last_frame_packets: packets sent by the latest one
+    def get_zone_frame_stats(self):
+        return dict(self.zone_frame_stats)
 
     # Uses new protocol for extended color zones, 0-indexed, end is exclusive.
+    # Returns an (N, 4) array instead of a list when NumPy colors are enabled (see codec.use_numpy_colors).
     def extended_get_color_zones(self, start=None, end=None):
-        responses = self.req_with_multiple_resp(MultiZoneGetExtendedColorZones, [MultiZoneStateExtendedColorZones])
-        colors = []
-
-        if (start != None and end == None) or (start == None and end != None):
-            raise ValueError("In the function extended_get_color_zones, start and end indices must both be provided, or neither provided.")
-        elif start is not None and end is not None:
-            if end < start:
-                raise ValueError("In the function extended_get_color_zones, end must be greater than start (provided start = {}, end = {}).".format(start, end))
-
-        for response in responses:
-            for i in range(response.index, response.index + response.cCount):
-                if (start is None and end is None) or (i >= start and i < end):
-                    if i < response.count:
-                        colors.append(response.colors[i - response.index])
-                    else:
-                        raise WorkflowException("extended_get_color_zones response exceeds total count: segment index={}, color count={}, zone count={}".format(response.index, response.cCount, response.count))
-                        break
-
-        return colors   
+        responses = self.req_with_multiple_resp(MultiZoneGetExtendedColorZones, [MultiZoneStateExtendedColorZones, StateUnhandled], is_complete=is_extended_zones_answer)
+        if type(responses[-1]) == StateUnhandled:
+            self.extended_multizone = False
+            raise WorkflowException("WorkflowException: {} (Name: {}) does not support extended multizone messages".format(self.mac_addr, self.label))
+        return extended_zone_colors(responses, start, end)
 
+    # colors may also be an (N, 4) uint16 array
     def extended_set_zone_color(self, colors, index=0, duration=0, rapid=False, apply=1):
-        if not isinstance(colors, list):
-            colors = [colors]
-        if all((isinstance(color, tuple) or isinstance(color, list)) and len(color) == 4 for color in colors):
-            requests = int(math.ceil(len(colors)/82.0))
-            try:
-                for i in range(requests):
-                    start_index = i * 82
-                    applyFlag = 1 if (i == requests - 1) and (apply == 1) else 0
-                    segment_colors = colors[start_index:start_index + 82]
-
-                    if rapid:
-                        self.fire_and_forget(MultiZoneSetExtendedColorZones,
-                                             {"index": start_index + index, "colors": segment_colors,
-                                              "duration": duration, "count" : len(segment_colors), "apply": applyFlag}, num_repeats=1)
-                    else:
-                        self.req_with_ack(MultiZoneSetExtendedColorZones, {"index": start_index + index, "colors": segment_colors,
-                                                                           "duration": duration, "apply": applyFlag, "count": len(segment_colors)})
-            except WorkflowException as e:
-                raise
+        try:
+            for payload in extended_zone_payloads(colors, index, duration, apply):
+                if rapid:
+                    self.fire_and_forget(MultiZoneSetExtendedColorZones, payload, num_repeats=1)
+                else:
+                    self.req_with_ack(MultiZoneSetExtendedColorZones, payload)
+        except WorkflowException as e:
+            raise
 
     def get_multizone_effect(self):
         response = self.req_with_resp(GetMultiZoneEffect, StateMultiZoneEffect)
-        effect = {"instanceid": response.instanceid,
-                  "type": response.effect_type,
-                  "speed": response.speed,
-                  "duration": response.duration,
-                  "parameters": response.parameters}
-        return effect
+        return multizone_effect_from_state(response)
 
     def set_multizone_effect(self, effect_type=0, speed=0, duration=0, instanceid=0, parameters=[], rapid=False):
-        if len(parameters)>8:
-            raise InvalidParameterException("Maximum parameters size is 8, {} given.".format(len(parameters)))
-
-        if len(parameters) < 8:
-            for i in range(len(parameters), 8):
-                parameters.append(0)
-
-        payload = {"instanceid": instanceid,
-                   "type": effect_type,
-                   "reserved1": 0,
-                   "speed": speed,
-                   "duration": duration,
-                   "reserved2": 0,
-                   "reserved3": 0,
-                   "parameters": parameters}
+        payload = multizone_effect_payload(effect_type, speed, duration, instanceid, parameters)
         if not rapid:
             self.req_with_ack(SetMultiZoneEffect, payload)
         else:
             self.fire_and_forget(SetMultiZoneEffect, payload, num_repeats=1)
+
+
+################################################################################
+#                                                                              #
+#                               Zone Functions                                 #
+#                                                                              #
+################################################################################
+
+# These don't touch the network, so MultiZoneLight and AsyncMultiZoneLight share them
+
+# all_zones[start:end] for get_color_zones, after checking the indices. An end
+# past the last zone is truncated.
+def select_zones(all_zones, start, end):
+    total_zones = len(all_zones)
+    if (start != None and end == None) or (start == None and end != None):
+        raise ValueError("In the function get_color_zones, start and end indices must both be provided, or neither provided.")
+    if start == None:
+        return all_zones
+    if end > total_zones:
+        end = total_zones
+    if start >= total_zones:
+        raise ValueError("In the function get_color_zones, starting index is greater than the total available zones (provided start = {}, end = {} for a device with {} total zones).".format(start, end, total_zones))
+    if end <= start:
+        raise ValueError("In the function get_color_zones, end must be greater than start (provided start = {}, end = {}).".format(start, end))
+    return all_zones[start:end]
+
+# The colors of zones start to end (exclusive, or all of them) from the
+# StateExtendedColorZones replies to one GetExtendedColorZones
+def extended_zone_colors(responses, start=None, end=None):
+    if (start != None and end == None) or (start == None and end != None):
+        raise ValueError("In the function extended_get_color_zones, start and end indices must both be provided, or neither provided.")
+    elif start is not None and end is not None:
+        if end < start:
+            raise ValueError("In the function extended_get_color_zones, end must be greater than start (provided start = {}, end = {}).".format(start, end))
+    segments = []
+    for response in responses:
+        first = response.index
+        last = response.index + response.cCount
+        if start is not None and end is not None:
+            first = max(first, start)
+            last = min(last, end)
+        if first >= last:
+            continue
+        if last > response.count:
+            raise WorkflowException("extended_get_color_zones response exceeds total count: segment index={}, color count={}, zone count={}".format(response.index, response.cCount, response.count))
+        segments.append(response.colors[first - response.index:last - response.index])
+    return codec.join_colors(segments)
+
+# Packets needed to set count zones with SetExtendedColorZones
+def extended_zone_packets(count):
+    return int(math.ceil(count/82.0))
+
+# SetExtendedColorZones payloads for colors, 82 zones each, starting at zone
+# index. Only the last one applies the changes (if apply is 1). Returns no
+# payloads if colors aren't HSBK colors.
+def extended_zone_payloads(colors, index=0, duration=0, apply=1):
+    if codec.is_color_array(colors):
+        colors = colors.reshape(-1, 4)
+    elif not isinstance(colors, list):
+        colors = [colors]
+    if not (codec.is_color_array(colors) or all((isinstance(color, tuple) or isinstance(color, list)) and len(color) == 4 for color in colors)):
+        return []
+    requests = extended_zone_packets(len(colors))
+    payloads = []
+    for i in range(requests):
+        start_index = i * 82
+        segment_colors = colors[start_index:start_index + 82]
+        payloads.append({"index": start_index + index, "colors": segment_colors, "duration": duration,
+                         "count": len(segment_colors), "apply": 1 if (i == requests - 1) and (apply == 1) else 0})
+    return payloads
+
+# SetColorZones payloads for runs (see zone_runs). Only the last one applies the changes.
+def zone_run_payloads(runs, duration=0, apply=1):
+    payloads = []
+    for (start_index, end_index, color) in runs:
+        payloads.append({"start_index": start_index, "end_index": end_index, "color": color, "duration": duration, "apply": 0})
+    if len(payloads) > 0:
+        payloads[-1]["apply"] = apply
+    return payloads
+
+# The runs of colors (see zone_runs) that have a zone whose color differs in
+# previous, the last frame written, or all of them if previous is None or
+# has a different zone count. A run is resent whole if any of its zones
+# changed, since that costs the same one message as sending just the
+# changed part.
+def changed_zone_runs(previous, colors):
+    runs = zone_runs(colors)
+    if previous == None or len(previous) != len(colors):
+        return runs
+    return [run for run in runs if any(previous[i] != run[2] for i in range(run[0], run[1] + 1))]
+
+# colors (a list or an (N, 4) array) as the list of HSBK tuples that
+# push_zone_frame compares the next frame against
+def zone_frame_colors(colors):
+    if codec.is_color_array(colors):
+        colors = colors.tolist()
+    return [tuple(color) for color in colors]
+
+def record_zone_frame(stats, packets):
+    stats["frames"] += 1
+    stats["packets"] += packets
+    stats["last_frame_packets"] = packets
+
+def multizone_effect_payload(effect_type=0, speed=0, duration=0, instanceid=0, parameters=[]):
+    if len(parameters)>8:
+        raise InvalidParameterException("Maximum parameters size is 8, {} given.".format(len(parameters)))
+    return {"instanceid": instanceid,
+            "type": effect_type,
+            "reserved1": 0,
+            "speed": speed,
+            "duration": duration,
+            "reserved2": 0,
+            "reserved3": 0,
+            "parameters": list(parameters) + [0] * (8 - len(parameters))}
+
+def multizone_effect_from_state(response):
+    return {"instanceid": response.instanceid,
+            "type": response.effect_type,
+            "speed": response.speed,
+            "duration": response.duration,
+            "parameters": response.parameters}
+
+# The last reply to GetExtendedColorZones, or StateUnhandled if it isn't supported
+def is_extended_zones_answer(response):
+    return type(response) == StateUnhandled or is_last_zone_segment(response)
+
+# Records the colors in a StateZone or StateMultiZone reply in zones (zone
+# index: color), and returns the device's total zone count
+def add_zone_colors(zones, response):
+    colors = response.color
+    if isinstance(response, MultiZoneStateZone):
+        colors = [colors]
+    for (i, color) in enumerate(colors):
+        if response.index + i < response.count:
+            zones[response.index + i] = color
+    return response.count
+
+# (first, last) for each 8-zone segment (as the device sends them) that has a
+# zone missing from zones
+def missing_zone_segments(zones, total_zones):
+    segments = []
+    for first in range(0, total_zones, 8):
+        last = min(first + 7, total_zones - 1)
+        if any(i not in zones for i in range(first, last + 1)):
+            segments.append((first, last))
+    return segments
+
+# Compresses colors into (start, end, color) runs of neighboring zones with
+# the same color, with inclusive indices
+def zone_runs(colors):
+    runs = []
+    for (i, color) in enumerate(colors):
+        color = tuple(color)
+        if runs and runs[-1][2] == color:
+            runs[-1] = (runs[-1][0], i, color)
+        else:
+            runs.append((i, i, color))
+    return runs
@@ -0,0 +1,113 @@
+# coding=utf-8
+# packettemplate.py
+# A PacketTemplate is a fully packed message kept in a bytearray so that it can
+# be sent over and over (e.g. one packet per animation frame) without building
+# a new Message each time. The header is packed once; before each send only
+# the sequence number and whichever payload fields changed are patched in
+# place with pack_into.
+
+from . import codec
+from .errors import InvalidParameterException
+from .message import BROADCAST_MAC, HEADER_SIZE_BYTES
+from .msgtypes import LightSetColor, LightSetInfrared, LightSetPower, LightSetWaveform, LightSetWaveformOptional, \
+    MultiZoneSetColorZones, MultiZoneSetExtendedColorZones, SetPower, SetTileState64
+from .unpack import unpack_lifx_message
+
+
+def scalar(layout):
+    return layout.pack_into
+
+# (offset into the payload, packer) for each field that can be patched in place.
+# Message types not listed here can still be templated, but any change to their
+# payload rebuilds the template.
+TEMPLATE_FIELDS = {
+    SetPower: {"power_level": (0, scalar(codec.UINT16))},
+    LightSetColor: {"color": (1, codec.pack_color_into),
+                    "duration": (9, scalar(codec.UINT32))},
+    LightSetWaveform: {"transient": (1, scalar(codec.UINT8)),
+                       "color": (2, codec.pack_color_into),
+                       "period": (10, scalar(codec.UINT32)),
+                       "cycles": (14, scalar(codec.FLOAT32)),
+                       "duty_cycle": (18, scalar(codec.INT16)),
+                       "waveform": (20, scalar(codec.UINT8))},
+    LightSetWaveformOptional: {"transient": (1, scalar(codec.UINT8)),
+                               "color": (2, codec.pack_color_into),
+                               "period": (10, scalar(codec.UINT32)),
+                               "cycles": (14, scalar(codec.FLOAT32)),
+                               "duty_cycle": (18, scalar(codec.INT16)),
+                               "waveform": (20, scalar(codec.UINT8)),
+                               "set_hue": (21, scalar(codec.UINT8)),
+                               "set_saturation": (22, scalar(codec.UINT8)),
+                               "set_brightness": (23, scalar(codec.UINT8)),
+                               "set_kelvin": (24, scalar(codec.UINT8))},
+    LightSetPower: {"power_level": (0, scalar(codec.UINT16)),
+                    "duration": (2, scalar(codec.UINT32))},
+    LightSetInfrared: {"infrared_brightness": (0, scalar(codec.UINT16))},
+    MultiZoneSetColorZones: {"start_index": (0, scalar(codec.UINT8)),
+                             "end_index": (1, scalar(codec.UINT8)),
+                             "color": (2, codec.pack_color_into),
+                             "duration": (10, scalar(codec.UINT32)),
+                             "apply": (14, scalar(codec.UINT8))},
+    MultiZoneSetExtendedColorZones: {"duration": (0, scalar(codec.UINT32)),
+                                     "apply": (4, scalar(codec.UINT8)),
+                                     "index": (5, scalar(codec.UINT16)),
+                                     "count": (7, scalar(codec.UINT8)),
+                                     "colors": (8, codec.pack_colors_into)},
+    SetTileState64: {"tile_index": (0, scalar(codec.UINT8)),
+                     "length": (1, scalar(codec.UINT8)),
+                     "reserved": (2, scalar(codec.UINT8)),
+                     "x": (3, scalar(codec.UINT8)),
+                     "y": (4, scalar(codec.UINT8)),
+                     "width": (5, scalar(codec.UINT8)),
+                     "duration": (6, scalar(codec.UINT32)),
+                     "colors": (10, codec.pack_colors_into)},
+}
+
+# fields whose length decides the size of the packet
+ARRAY_FIELDS = ("colors",)
+
+
+class PacketTemplate(object):
+    def __init__(self, msg_type, target_addr, source_id, payload={}, ack_requested=False, response_requested=False):
+        msg = msg_type(target_addr, source_id, 0, payload, ack_requested, response_requested)
+        self.msg_type = msg_type
+        self.fields = TEMPLATE_FIELDS.get(msg_type, {})
+        self.array_lengths = dict((name, len(payload[name])) for name in ARRAY_FIELDS if name in payload)
+        self.packed_message = bytearray(msg.packed_message)
+        self.seq_num = 0
+
+    # True if payload can be written into this template without changing its size or layout
+    def fits(self, payload):
+        for name in payload:
+            if name not in self.fields:
+                return False
+            if name in self.array_lengths and len(payload[name]) != self.array_lengths[name]:
+                return False
+        return True
+
+    def set_payload(self, payload):
+        if not self.fits(payload):
+            raise InvalidParameterException("{} cannot be patched into a {} template.".format(payload, self.msg_type.__name__))
+        for (name, value) in payload.items():
+            offset, pack_into = self.fields[name]
+            pack_into(self.packed_message, HEADER_SIZE_BYTES + offset, value)
+
+    def set_seq_num(self, seq_num):
+        self.seq_num = seq_num & 0xff
+        self.packed_message[codec.HEADER_SEQ_NUM_OFFSET] = self.seq_num
+
+    # advance to the next (wrapping) sequence number and return it
+    def next_seq_num(self):
+        self.set_seq_num(self.seq_num + 1)
+        return self.seq_num
+
+    def set_target(self, target_addr):
+        codec.TARGET.pack_into(self.packed_message, codec.HEADER_TARGET_OFFSET, codec.mac_to_bytes(target_addr))
+        tagged = 1 if target_addr == BROADCAST_MAC else 0
+        codec.UINT16.pack_into(self.packed_message, codec.HEADER_FLAGS_OFFSET, codec.make_flags(tagged))
+
+    def set_source_id(self, source_id):
+        codec.UINT32.pack_into(self.packed_message, codec.HEADER_SOURCE_OFFSET, source_id)
+
+    def __str__(self):
+        return str(unpack_lifx_message(bytes(self.packed_message)))
@@ -1794,3 +1794,27 @@ features_map = {
                     "relays": False,
                     "buttons": False}
                 }
+
+# Host firmware (major, minor) from which each multizone product supports the
+# extended multizone messages. Products missing here have to be asked.
+extended_multizone_min_firmware = {
+                                   31: (2, 77),
+                                   32: (2, 77),
+                                   38: (2, 77),
+                                   117: (0, 0),
+                                   118: (0, 0),
+                                   119: (0, 0),
+                                   120: (0, 0),
+                                   141: (0, 0),
+                                   142: (0, 0),
+                                   143: (0, 0),
+                                   144: (0, 0),
+                                   161: (0, 0),
+                                   162: (0, 0),
+                                   203: (0, 0),
+                                   204: (0, 0),
+                                   205: (0, 0),
+                                   206: (0, 0),
+                                   213: (0, 0),
+                                   214: (0, 0),
+                                  }
@@ -0,0 +1,89 @@
+# coding=utf-8
+# ratelimit.py
+# Token buckets that pace outgoing packets. Each Device has one, since a bulb
+# can only handle about 20 messages per second, and each Transport has one for
+# all traffic on its socket (everything going through the same access point).
+# Both are unlimited unless set_rate_limit is called. Senders are delayed
+# rather than allowed to exceed the rate, and fire-and-forget messages that
+# are still waiting to go out are replaced by newer ones that supersede them
+# (see COALESCE_FIELDS), so with a limit set, rapid updates can be dropped.
+
+from threading import Lock
+from time import time
+
+from .msgtypes import LightSetColor, LightSetInfrared, LightSetPower, LightSetWaveformOptional, MultiZoneSetColorZones, \
+    MultiZoneSetExtendedColorZones, SetPower, SetTileState64
+
+DEFAULT_DEVICE_RATE = None # unlimited; 20 messages per second is what a bulb can handle
+DEFAULT_DEVICE_BURST = 10
+DEFAULT_TOTAL_RATE = None # unlimited
+
+# Messages that overwrite a piece of device state, keyed by the payload fields
+# that say which piece. A queued fire-and-forget message is dropped in favor
+# of a newer one of the same type with the same values for these fields.
+COALESCE_FIELDS = {
+    SetPower: (),
+    LightSetPower: (),
+    LightSetColor: (),
+    LightSetInfrared: (),
+    LightSetWaveformOptional: ("set_hue", "set_saturation", "set_brightness", "set_kelvin"),
+    MultiZoneSetColorZones: ("start_index", "end_index", "apply"),
+    MultiZoneSetExtendedColorZones: ("index", "count", "apply"),
+    SetTileState64: ("tile_index", "length", "x", "y", "width"),
+}
+
+# Returns the key under which msg_type with payload can be coalesced, or None
+def coalesce_key(msg_type, payload):
+    fields = COALESCE_FIELDS.get(msg_type)
+    if fields == None:
+        return None
+    return (msg_type,) + tuple(payload.get(name) for name in fields)
+
+
+class TokenBucket(object):
+    # rate is in messages per second (None means unlimited), burst is how many
+    # messages can go out back to back after an idle period
+    def __init__(self, rate=None, burst=1):
+        self.lock = Lock()
+        self.set_rate(rate, burst)
+        self.throttled_count = 0
+        self.throttled_secs = 0.0
+        self.coalesced_count = 0
+
+    def set_rate(self, rate, burst=None):
+        with self.lock:
+            self.rate = rate
+            if burst != None:
+                self.burst = burst
+            self.tokens = self.burst
+            self.last_refill = time()
+
+    # Takes a token and returns how many seconds the caller has to wait before
+    # sending (0 if it can send right away). The bucket can go into debt, so
+    # callers that arrive while it is empty are spaced out in arrival order.
+    def reserve(self):
+        if self.rate == None:
+            return 0
+        with self.lock:
+            now = time()
+            self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            self.tokens -= 1
+            if self.tokens >= 0:
+                return 0
+            delay = -self.tokens / float(self.rate)
+            self.throttled_count += 1
+            self.throttled_secs += delay
+            return delay
+
+    def record_coalesced(self):
+        with self.lock:
+            self.coalesced_count += 1
+
+    def get_stats(self):
+        with self.lock:
+            return {"rate": self.rate,
+                    "burst": self.burst,
+                    "throttled": self.throttled_count,
+                    "throttled_secs": self.throttled_secs,
+                    "coalesced": self.coalesced_count}
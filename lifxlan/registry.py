@@ -0,0 +1,80 @@
+# coding=utf-8
+# registry.py
+# A JSON file that remembers what is known about each device (keyed by MAC)
+# between runs: where it is, what product it is, and any label, group,
+# location, firmware and tile layout that were fetched. A LifxLAN object
+# given a registry_path hands out devices from it right away on startup and
+# revalidates them with a discovery in the background.
+
+from threading import Lock
+from time import time
+import json
+import os
+
+from .tilechain import Tile
+
+REGISTRY_FORMAT_VERSION = 1
+
+# device attributes copied to and from the registry as they are
+DEVICE_FIELDS = ("ip_addr", "port", "service", "vendor", "product", "version", "product_features",
+                 "host_firmware_version", "wifi_firmware_version", "label", "group", "location", "extended_multizone")
+
+
+class DeviceRegistry(object):
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        self.entries = {} # mac_addr: {field: value, "updated_at": timestamp}
+        self.load()
+
+    # A missing or unreadable file just means nothing is known yet.
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if type(data) == dict and data.get("format") == REGISTRY_FORMAT_VERSION:
+            with self.lock:
+                self.entries = data.get("devices", {})
+
+    # Written to a temporary file first so a crash can't leave half a registry
+    def save(self):
+        with self.lock:
+            text = json.dumps({"format": REGISTRY_FORMAT_VERSION, "devices": self.entries}, separators=(",", ":"), sort_keys=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    def get_entries(self):
+        with self.lock:
+            return dict((mac_addr, dict(entry)) for (mac_addr, entry) in self.entries.items())
+
+    # Records what device currently knows about itself. Fields it doesn't know
+    # (None) keep the value from before.
+    def update(self, device):
+        entry = {}
+        for field in DEVICE_FIELDS:
+            value = getattr(device, field, None)
+            if value != None:
+                entry[field] = value
+        tile_info = getattr(device, "tile_info", None)
+        if tile_info != None:
+            entry["tile_info"] = [tile.__dict__ for tile in tile_info]
+        entry["updated_at"] = time()
+        with self.lock:
+            self.entries.setdefault(device.mac_addr, {}).update(entry)
+
+    def remove(self, mac_addr):
+        with self.lock:
+            self.entries.pop(mac_addr, None)
+
+    # Copies what the registry knows about device onto it
+    def restore(self, device, entry):
+        for field in DEVICE_FIELDS:
+            if field in entry:
+                setattr(device, field, entry[field])
+        if "tile_info" in entry and hasattr(device, "tile_info"):
+            device.tile_info = [Tile(**tile) for tile in entry["tile_info"]]
+            device.tile_count = len(device.tile_info)
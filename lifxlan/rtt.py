@@ -0,0 +1,49 @@
+# coding=utf-8
+# rtt.py
+# Round trip time estimate for one device, used to decide how long to wait for
+# a reply before retransmitting. This is the TCP retransmit timer (RFC 6298):
+# a smoothed mean plus four times the mean deviation of the measured RTTs,
+# doubled after every timeout until a fresh measurement comes in. Replies to
+# retransmitted requests are not measured, since it is unknown which
+# transmission they answer.
+
+from threading import Lock
+
+INITIAL_RETRANSMIT_SECS = 0.25 # before the first measurement
+MIN_RETRANSMIT_SECS = 0.05
+MAX_RETRANSMIT_SECS = 2.0
+
+
+class RttEstimator(object):
+    def __init__(self):
+        self.lock = Lock()
+        self.srtt = None
+        self.rttvar = None
+        self.retransmit_secs = INITIAL_RETRANSMIT_SECS
+        self.sample_count = 0
+
+    def add_sample(self, rtt):
+        with self.lock:
+            if self.srtt == None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2.0
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.sample_count += 1
+            self.retransmit_secs = min(max(self.srtt + 4 * self.rttvar, MIN_RETRANSMIT_SECS), MAX_RETRANSMIT_SECS)
+
+    # called when a request timed out and had to be sent again
+    def backoff(self):
+        with self.lock:
+            self.retransmit_secs = min(self.retransmit_secs * 2, MAX_RETRANSMIT_SECS)
+
+    def get_retransmit_secs(self):
+        return self.retransmit_secs
+
+    def get_stats(self):
+        with self.lock:
+            return {"srtt": self.srtt,
+                    "rttvar": self.rttvar,
+                    "retransmit_secs": self.retransmit_secs,
+                    "samples": self.sample_count}
@@ -8,9 +8,9 @@ from .errors import InvalidParameterException, WorkflowException
 from .msgtypes import SetRPower, GetRPower, StateRPower
 
 class Switch(Device):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None):
         mac_addr = mac_addr.lower()
-        super(Switch, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+        super(Switch, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
         
     ############################################################################
     #                                                                          #
@@ -1,30 +1,30 @@
 import random
 
+from . import codec
 from .errors import WorkflowException, InvalidParameterException
 from .light import Light
 from .msgtypes import GetTileState64, StateTileState64, SetTileState64, GetDeviceChain, StateDeviceChain, SetUserPosition, SetTileEffect, GetTileEffect, StateTileEffect
 from threading import Thread
 
 class TileChain(Light):
-    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False):
-        super(TileChain, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose)
+    # With load_tiles=False the tile layout is fetched the first time it is needed
+    # (discovery creates TileChains this way so it doesn't wait on each chain)
+    def __init__(self, mac_addr, ip_addr, service=1, port=56700, source_id=random.randrange(2, 1 << 32), verbose=False, transport=None, load_tiles=True):
+        super(TileChain, self).__init__(mac_addr, ip_addr, service, port, source_id, verbose, transport)
         self.tile_info = None
         self.tile_count = None
         self.tile_map = None
         self.canvas_dimensions = None
-        self.get_tile_info()
-        self.get_tile_map()
-        self.get_canvas_dimensions()
+        if load_tiles:
+            self.get_tile_info()
+            self.get_tile_map()
+            self.get_canvas_dimensions()
 
     # returns information about all tiles
     def get_tile_info(self, refresh_cache=False):
         if (self.tile_info == None) or (refresh_cache == True):
             response = self.req_with_resp(GetDeviceChain, StateDeviceChain)
-            tiles = []
-            for tile in response.tile_devices:
-                t = Tile(tile["user_x"], tile["user_y"], tile["width"], tile["height"], tile["device_version_vendor"], tile["device_version_product"], tile["device_version_version"], tile["firmware_build"], tile["firmware_version"])
-                tiles.append(t)
-            self.tile_info = tiles[:response.total_count]
+            self.tile_info = tiles_from_chain(response)
             self.tile_count = response.total_count
         return self.tile_info
 
@@ -35,8 +35,9 @@ class TileChain(Light):
         return self.tile_count
 
     def get_tile_colors(self, start_index, tile_count=1, x=0, y=0, width=8):
-        if (start_index < 0) or (start_index >= self.tile_count):
-            raise InvalidParameterException("{} is not a valid start_index for TileChain with {} tiles.".format(start_index, self.tile_count))
+        num_tiles = self.get_tile_count()
+        if (start_index < 0) or (start_index >= num_tiles):
+            raise InvalidParameterException("{} is not a valid start_index for TileChain with {} tiles.".format(start_index, num_tiles))
 
         colors = []
         for i in range(tile_count):
@@ -48,18 +49,19 @@ class TileChain(Light):
                        "width": width}
             response = self.req_with_resp(GetTileState64, StateTileState64, payload)
             colors.append(response.colors)
-        return colors
+        return codec.stack_colors(colors)
 
     def get_tilechain_colors(self):
         tilechain_colors = []
-        for i in range(self.tile_count):
+        for i in range(self.get_tile_count()):
             tile_colors = self.get_tile_colors(i)
             tilechain_colors.append(tile_colors[0])
-        return tilechain_colors
+        return codec.stack_colors(tilechain_colors)
 
     def set_tile_colors(self, start_index, colors, duration=0, tile_count=1, x=0, y=0, width=8, rapid=False):
-        if (start_index < 0) or (start_index >= self.tile_count):
-            raise InvalidParameterException("{} is not a valid start_index for TileChain with {} tiles.".format(start_index, self.tile_count))
+        num_tiles = self.get_tile_count()
+        if (start_index < 0) or (start_index >= num_tiles):
+            raise InvalidParameterException("{} is not a valid start_index for TileChain with {} tiles.".format(start_index, num_tiles))
 
         payload = {"tile_index": start_index,
                    "length": tile_count,
@@ -76,7 +78,7 @@ class TileChain(Light):
 
     def set_tilechain_colors(self, tilechain_colors, duration=0, rapid=False):
         threads = []
-        for i in range(self.tile_count):
+        for i in range(self.get_tile_count()):
             t = Thread(target = self.set_tile_colors, args = ((i, tilechain_colors[i], duration, 1, 0, 0, 8, rapid)))
             threads.append(t)
             t.start()
@@ -100,19 +102,7 @@ class TileChain(Light):
         if (matrix_x != canvas_x) or (matrix_y != canvas_y):
             raise InvalidParameterException("Warning: TileChain canvas wants a {} x {} matrix, but given matrix is {} x {}.".format(canvas_x, canvas_y, matrix_x, matrix_y))
 
-        tile_width = 8 # hardcoded, argh
-        tile_height = 8
-        default_color = (0, 0, 0, 0)
-        tile_map = self.get_tile_map()
-        tile_colors = [[default_color for i in range(tile_width * tile_height)] for j in range(num_tiles)]
-
-        rows = canvas_y
-        cols = canvas_x
-        for row in range(rows):
-            for col in range(cols):
-                if tile_map[row][col] != 0:
-                    (tile_num, color_num) = tile_map[row][col]
-                    tile_colors[tile_num][color_num] = hsvk_matrix[row][col]
+        tile_colors = matrix_to_tile_colors(hsvk_matrix, self.get_tile_map(), num_tiles)
 
         threads = []
         for (i, tile_color) in enumerate(tile_colors):
@@ -134,114 +124,32 @@ class TileChain(Light):
 
     def get_xy_vals(self):
         tiles = self.get_tile_info()
-        num_tiles = self.get_tile_count()
-        x_vals = []
-        y_vals = []
-        for tile in tiles[:num_tiles]:
-            x_vals.append(tile.user_x)
-            y_vals.append(tile.user_y)
-        x_vals = self.center_axis(x_vals)
-        y_vals = self.center_axis(y_vals)
-        return x_vals, y_vals
+        return tile_xy_vals(tiles[:self.get_tile_count()])
 
     def center_axis(self, axis_vals):
-        if 0.0 not in axis_vals:
-            smallest_val = min([abs(val) for val in axis_vals])
-            closest_val = 0.0
-            for val in axis_vals:
-                if abs(val) == smallest_val:
-                    closest_val = val
-            axis_vals = [(-1*closest_val) + val for val in axis_vals]
-        return axis_vals
-
-    # all become non-negative -- shifts (0, 0) to the left/top
+        return center_axis(axis_vals)
+
     def shift_axis_upper_left(self, axis_vals, is_y = False):
-        if is_y:
-            axis_vals = [-1*val for val in axis_vals]
-        smallest_val = min(axis_vals)
-        axis_vals = [(-1*smallest_val) + val for val in axis_vals]
-        return axis_vals
+        return shift_axis_upper_left(axis_vals, is_y)
 
     def get_canvas_dimensions(self, refresh_cache=False):
         if (self.canvas_dimensions == None) or (refresh_cache == True):
             x_vals, y_vals = self.get_xy_vals()
-            min_x = min(x_vals)
-            max_x = max(x_vals)
-            min_y = min(y_vals)
-            max_y = max(y_vals)
-            x_tilespan = (max_x - min_x) + 1
-            y_tilespan = (max_y - min_y) + 1
-            tile_width = 8 #TO DO: get these programmatically for each light from the tile info
-            tile_height = 8 #TO DO: get these programmatically for each light from the tile info
-            canvas_x = int(x_tilespan * tile_width)
-            canvas_y = int(y_tilespan * tile_height)
-            self.canvas_dimensions = (canvas_x, canvas_y)
+            self.canvas_dimensions = canvas_dimensions(x_vals, y_vals)
         return self.canvas_dimensions
 
     def get_tile_map(self, refresh_cache=False):
         if (self.tile_map == None) or (refresh_cache == True):
-            num_tiles = self.get_tile_count()
-            tile_width = 8 #TO DO: get these programmatically for each light from the tile info
-            tile_height = 8 #TO DO: get these programmatically for each light from the tile info
-            (x, y) = self.get_canvas_dimensions()
-            #print(x, y)
-            tile_map = [[0 for i in range(x)] for j in range(y)]
-
-            tiles = self.get_tile_info()
             x_vals, y_vals = self.get_xy_vals()
-            x_vals = self.shift_axis_upper_left(x_vals)
-            y_vals = self.shift_axis_upper_left(y_vals, is_y=True)
-
-            for i in range(num_tiles):
-                tile = tiles[i]
-                x_start_tilespan = x_vals[i]
-                y_start_tilespan = y_vals[i]
-                #print(i, x_start_tilespan, y_start_tilespan)
-                x_start_pixel = int(x_start_tilespan * tile_width)
-                y_start_pixel = int(y_start_tilespan * tile_height)
-                for j in range(y_start_pixel, y_start_pixel + tile_width):
-                    for k in range(x_start_pixel, x_start_pixel + tile_height):
-                        j0 = j - y_start_pixel
-                        k0 = k - x_start_pixel
-                        tile_map[j][k] = (i, (j0*tile_width + k0))
-
-            #for row in tile_map:
-            #    print(row)
-            self.tile_map = tile_map
+            self.tile_map = make_tile_map(x_vals, y_vals)
         return self.tile_map
 
     def get_tile_effect(self):
         response = self.req_with_resp(GetTileEffect, StateTileEffect)
-        effect = {"instanceid": response.instanceid,
-                  "type": response.effect_type,
-                  "speed": response.speed,
-                  "duration": response.duration,
-                  "parameters": response.parameters,
-                  "palette": response.palette}
-        return effect
+        return tile_effect_from_state(response)
 
     def set_tile_effect(self, effect_type=0, speed=0, duration=0, palette=[], instanceid=0, parameters=[], rapid=False):
-        if len(palette)>16:
-            raise InvalidParameterException("Maximum palette size is 16, {} given.".format(len(palette)))
-        if len(parameters)>8:
-            raise InvalidParameterException("Maximum parameters size is 8, {} given.".format(len(parameters)))
-
-        # parameters is not currently used by any effect, so just zero these out for now
-        if len(parameters) < 8:
-            for i in range(len(parameters), 8):
-                parameters.append(0)
-
-        payload = {"reserved1": 0,
-                   "reserved2": 0,
-                   "instanceid": instanceid,
-                   "type": effect_type,
-                   "speed": speed,
-                   "duration": duration,
-                   "reserved3": 0,
-                   "reserved4": 0,
-                   "parameters": parameters,
-                   "palette_count": len(palette),
-                   "palette": palette}
+        payload = tile_effect_payload(effect_type, speed, duration, palette, instanceid, parameters)
         if not rapid:
             self.req_with_ack(SetTileEffect, payload)
         else:
@@ -273,3 +181,107 @@ class Tile(object):
         s += "\n  Firmware Build: " + str(self.firmware_build)
         s += "\n  Firmware Version: " + str(self.firmware_version)
         return s
+
+
+################################################################################
+#                                                                              #
+#                              Layout Functions                                #
+#                                                                              #
+################################################################################
+
+# These don't touch the network, so TileChain and AsyncTileChain share them
+
+TILE_WIDTH = 8 #TO DO: get these programmatically for each light from the tile info
+TILE_HEIGHT = 8
+
+# The Tiles described by a StateDeviceChain reply
+def tiles_from_chain(response):
+    tiles = []
+    for tile in response.tile_devices[:response.total_count]:
+        tiles.append(Tile(tile["user_x"], tile["user_y"], tile["width"], tile["height"], tile["device_version_vendor"], tile["device_version_product"], tile["device_version_version"], tile["firmware_build"], tile["firmware_version"]))
+    return tiles
+
+# The tiles' user_x and user_y values, each centered with center_axis
+def tile_xy_vals(tiles):
+    x_vals = center_axis([tile.user_x for tile in tiles])
+    y_vals = center_axis([tile.user_y for tile in tiles])
+    return x_vals, y_vals
+
+def center_axis(axis_vals):
+    if 0.0 not in axis_vals:
+        smallest_val = min([abs(val) for val in axis_vals])
+        closest_val = 0.0
+        for val in axis_vals:
+            if abs(val) == smallest_val:
+                closest_val = val
+        axis_vals = [(-1*closest_val) + val for val in axis_vals]
+    return axis_vals
+
+# all become non-negative -- shifts (0, 0) to the left/top
+def shift_axis_upper_left(axis_vals, is_y = False):
+    if is_y:
+        axis_vals = [-1*val for val in axis_vals]
+    smallest_val = min(axis_vals)
+    axis_vals = [(-1*smallest_val) + val for val in axis_vals]
+    return axis_vals
+
+# (width, height) in pixels of the canvas covering tiles at x_vals, y_vals
+def canvas_dimensions(x_vals, y_vals):
+    x_tilespan = (max(x_vals) - min(x_vals)) + 1
+    y_tilespan = (max(y_vals) - min(y_vals)) + 1
+    return (int(x_tilespan * TILE_WIDTH), int(y_tilespan * TILE_HEIGHT))
+
+# For each canvas pixel (row by row), the (tile index, color index) it is
+# drawn by, or 0 if no tile covers it
+def make_tile_map(x_vals, y_vals):
+    (x, y) = canvas_dimensions(x_vals, y_vals)
+    tile_map = [[0 for i in range(x)] for j in range(y)]
+    x_vals = shift_axis_upper_left(x_vals)
+    y_vals = shift_axis_upper_left(y_vals, is_y=True)
+    for i in range(len(x_vals)):
+        x_start_pixel = int(x_vals[i] * TILE_WIDTH)
+        y_start_pixel = int(y_vals[i] * TILE_HEIGHT)
+        for j in range(y_start_pixel, y_start_pixel + TILE_HEIGHT):
+            for k in range(x_start_pixel, x_start_pixel + TILE_WIDTH):
+                j0 = j - y_start_pixel
+                k0 = k - x_start_pixel
+                tile_map[j][k] = (i, (j0*TILE_WIDTH + k0))
+    return tile_map
+
+# Splits a canvas-sized matrix of HSBK colors into the colors of each tile
+def matrix_to_tile_colors(hsvk_matrix, tile_map, num_tiles):
+    default_color = (0, 0, 0, 0)
+    tile_colors = [[default_color for i in range(TILE_WIDTH * TILE_HEIGHT)] for j in range(num_tiles)]
+    for (row, pixels) in enumerate(tile_map):
+        for (col, pixel) in enumerate(pixels):
+            if pixel != 0:
+                (tile_num, color_num) = pixel
+                tile_colors[tile_num][color_num] = hsvk_matrix[row][col]
+    return tile_colors
+
+def tile_effect_payload(effect_type=0, speed=0, duration=0, palette=[], instanceid=0, parameters=[]):
+    if len(palette)>16:
+        raise InvalidParameterException("Maximum palette size is 16, {} given.".format(len(palette)))
+    if len(parameters)>8:
+        raise InvalidParameterException("Maximum parameters size is 8, {} given.".format(len(parameters)))
+    # parameters is not currently used by any effect, so just zero these out for now
+    parameters = list(parameters) + [0] * (8 - len(parameters))
+    return {"reserved1": 0,
+            "reserved2": 0,
+            "instanceid": instanceid,
+            "type": effect_type,
+            "speed": speed,
+            "duration": duration,
+            "reserved3": 0,
+            "reserved4": 0,
+            "parameters": parameters,
+            "palette_count": len(palette),
+            "palette": palette}
+
+def tile_effect_from_state(response):
+    return {"instanceid": response.instanceid,
+            "type": response.effect_type,
+            "speed": response.speed,
+            "duration": response.duration,
+            "parameters": response.parameters,
+            "palette": response.palette}
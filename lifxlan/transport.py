@@ -0,0 +1,167 @@
+# coding=utf-8
+# transport.py
+# A Transport owns one long-lived UDP socket. A LifxLAN object creates one and
+# shares it with every Device it discovers, so sending a packet is a single
+# sendto() instead of a socket()/bind()/close() round trip per request.
+#
+# Replies are read by one background thread, which unpacks each datagram and
+# routes it to the request waiting on it. Every request is given a rolling
+# 8-bit sequence number per device (per target MAC and source id), and the
+# device echoes it back, so a reply is matched by (target, source_id, seq_num)
+# rather than by its type. Replies to a request that has already given up are
+# dropped instead of being mistaken for the answer to the next one, and any
+# number of requests can be outstanding on the socket at once.
+
+from queue import Queue
+from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_BROADCAST, SO_REUSEADDR, socket, timeout
+from threading import Lock, Thread
+from time import time
+
+from .errors import WorkflowException
+from .message import BROADCAST_MAC
+from .ratelimit import DEFAULT_TOTAL_RATE, TokenBucket
+from .unpack import unpack_lifx_message
+
+RECV_BUFFER_SIZE = 1024
+# how often the receive thread wakes up to notice that the transport was closed
+RECV_POLL_SECS = 0.5
+SEQ_NUM_COUNT = 256
+
+# The queue of replies to one outstanding request
+class Listener(Queue):
+    def __init__(self, key):
+        Queue.__init__(self)
+        self.key = key
+        self.target_addr, self.source_id, self.seq_num = key
+
+
+class Transport(object):
+    listener_class = Listener
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+        self.sock = None
+        self.receiver = None
+        self.listeners = {} # (target_addr, source_id, seq_num): Listener
+        self.seq_nums = {} # (target_addr, source_id): last sequence number used
+        self.lock = Lock()
+        # paces all traffic on this socket; each Device also has its own limit
+        self.rate_limiter = TokenBucket(DEFAULT_TOTAL_RATE)
+
+    # The socket is opened on first use, and reopened if the transport was closed.
+    def open(self):
+        with self.lock:
+            if self.sock == None:
+                sock = socket(AF_INET, SOCK_DGRAM)
+                sock.setsockopt(SOL_SOCKET, SO_REUSEADDR, 1)
+                sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+                sock.settimeout(RECV_POLL_SECS)
+                try:
+                    sock.bind(("", 0))  # allow OS to assign next available source port
+                except Exception as err:
+                    sock.close()
+                    raise WorkflowException("WorkflowException: error {} while trying to open socket".format(str(err)))
+                self.sock = sock
+                self.receiver = Thread(target=self.receive_loop, args=(sock,))
+                self.receiver.daemon = True
+                self.receiver.start()
+            return self.sock
+
+    def close(self):
+        with self.lock:
+            sock = self.sock
+            self.sock = None
+        if sock != None:
+            sock.close()
+
+    def sendto(self, packet, addr):
+        self.open().sendto(packet, addr)
+
+    # Returns the next sequence number for requests from source_id to target_addr
+    # (BROADCAST_MAC for broadcasts), wrapping at 8 bits.
+    def next_seq_num(self, target_addr, source_id):
+        with self.lock:
+            return self.advance_seq_num(target_addr.lower(), source_id)
+
+    # Reserves a sequence number for a request to target_addr and returns a
+    # Listener that will receive the replies carrying it, until stop_listening
+    # is called. Start listening before sending so a fast reply can't be missed.
+    def listen(self, target_addr, source_id):
+        self.open()
+        return self.add_listener(target_addr, source_id)
+
+    def add_listener(self, target_addr, source_id):
+        target_addr = target_addr.lower()
+        with self.lock:
+            for i in range(SEQ_NUM_COUNT):
+                seq_num = self.advance_seq_num(target_addr, source_id)
+                if not self.seq_num_in_use(target_addr, source_id, seq_num):
+                    listener = self.listener_class((target_addr, source_id, seq_num))
+                    self.listeners[listener.key] = listener
+                    return listener
+        raise WorkflowException("WorkflowException: {} requests are already waiting on {}".format(SEQ_NUM_COUNT, target_addr))
+
+    def stop_listening(self, listener):
+        with self.lock:
+            if self.listeners.get(listener.key) is listener:
+                del self.listeners[listener.key]
+
+    # must be called with lock held
+    def advance_seq_num(self, target_addr, source_id):
+        seq_num = (self.seq_nums.get((target_addr, source_id), -1) + 1) % SEQ_NUM_COUNT
+        self.seq_nums[(target_addr, source_id)] = seq_num
+        return seq_num
+
+    # Replies to a broadcast come back addressed from each device, so a
+    # broadcast and a unicast request from the same source can't share a
+    # sequence number while both are outstanding. Must be called with lock held.
+    def seq_num_in_use(self, target_addr, source_id, seq_num):
+        if (target_addr, source_id, seq_num) in self.listeners or (BROADCAST_MAC, source_id, seq_num) in self.listeners:
+            return True
+        if target_addr == BROADCAST_MAC:
+            for (t, s, n) in self.listeners:
+                if s == source_id and n == seq_num:
+                    return True
+        return False
+
+    ############################################################################
+    #                                                                          #
+    #                               Receive Loop                               #
+    #                                                                          #
+    ############################################################################
+
+    def receive_loop(self, sock):
+        while self.sock is sock:
+            try:
+                data, (ip_addr, port) = sock.recvfrom(RECV_BUFFER_SIZE)
+            except timeout:
+                continue
+            except OSError:
+                break # socket was closed
+            self.handle_datagram(data, ip_addr)
+
+    def handle_datagram(self, data, ip_addr):
+        try:
+            response = unpack_lifx_message(data)
+        except Exception:
+            if self.verbose:
+                print("RECV: ignoring {} byte datagram from {} that is not a LIFX message".format(len(data), ip_addr))
+            return
+        self.dispatch(response, ip_addr)
+
+    def dispatch(self, response, ip_addr):
+        response.ip_addr = ip_addr
+        response.received_time = time() # for round trip times; the reader may be busy
+        source_id = response.source_id
+        seq_num = response.seq_num
+        with self.lock:
+            listener = self.listeners.get((response.target_addr, source_id, seq_num))
+            if listener == None:
+                listener = self.listeners.get((BROADCAST_MAC, source_id, seq_num))
+        if listener != None:
+            listener.put_nowait(response)
+        elif self.verbose:
+            print("RECV: dropping reply that no request is waiting for: " + str(response))
+
+# Shared by Devices that were created directly rather than by a LifxLAN object
+default_transport = Transport()
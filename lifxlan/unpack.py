@@ -2,9 +2,7 @@
 # unpack.py
 # Author: Meghan Clark
 
-import binascii
-import struct
-
+from . import codec
 from .message import HEADER_SIZE_BYTES, Message
 from .msgtypes import *
 
@@ -13,438 +11,26 @@ from .msgtypes import *
 # If the message type is not one of the officially released ones above, it will create just a Message out of it
 # If it's not in the LIFX protocol format, uhhhhh...we'll put that on a to-do list.
 def unpack_lifx_message(packed_message):
-    header_str = packed_message[0:HEADER_SIZE_BYTES]
-    payload_str = packed_message[HEADER_SIZE_BYTES:]
-
-    size = struct.unpack("<H", header_str[0:2])[0]
-    flags = struct.unpack("<H", header_str[2:4])[0]
+    data = memoryview(packed_message)
+    size, flags, source_id, target, response_flags, seq_num, message_type = codec.HEADER.unpack_from(data)
     origin = (flags >> 14) & 3
     tagged = (flags >> 13) & 1
     addressable = (flags >> 12) & 1
     protocol = flags & 4095
-    source_id = struct.unpack("<I", header_str[4:8])[0]
-    target_addr = ":".join([('%02x' % b) for b in struct.unpack("<" + ("B"*6), header_str[8:14])])
-    response_flags = struct.unpack("<B", header_str[22:23])[0]
+    target_addr = target[:6].hex(":")
     ack_requested = response_flags & 2
     response_requested = response_flags & 1
-    seq_num = struct.unpack("<B", header_str[23:24])[0]
-    message_type = struct.unpack("<H", header_str[32:34])[0]
-
-    message = None
-    if message_type == MSG_IDS[GetService]:
-        message = GetService(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateService]:
-        service = struct.unpack("<B", payload_str[0:1])[0]
-        port = struct.unpack("<I", payload_str[1:5])[0]
-        payload = {"service": service, "port": port}
-        message = StateService(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetHostInfo]:
-        message = GetHostInfo(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateHostInfo]:
-        signal = struct.unpack("<f", payload_str[0:4])[0]
-        tx = struct.unpack("<I", payload_str[4:8])[0]
-        rx = struct.unpack("<I", payload_str[8:12])[0]
-        reserved1 = struct.unpack("<h", payload_str[12:14])[0]
-        payload = {"signal": signal, "tx": tx, "rx": rx, "reserved1": reserved1}
-        message = StateHostInfo(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetHostFirmware]:
-        message = GetHostFirmware(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateHostFirmware]:
-        build = struct.unpack("<Q", payload_str[0:8])[0]
-        reserved1 = struct.unpack("<Q", payload_str[8:16])[0]
-        version = struct.unpack("<I", payload_str[16:20])[0]
-        payload = {"build": build, "reserved1": reserved1, "version": version}
-        message = StateHostFirmware(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetWifiInfo]:
-        message = GetWifiInfo(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateWifiInfo]:
-        signal = struct.unpack("<f", payload_str[0:4])[0]
-        tx = struct.unpack("<I", payload_str[4:8])[0]
-        rx = struct.unpack("<I", payload_str[8:12])[0]
-        reserved1 = struct.unpack("<h", payload_str[12:14])[0]
-        payload = {"signal": signal, "tx": tx, "rx": rx, "reserved1": reserved1}
-        message = StateWifiInfo(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetWifiFirmware]:
-        message = GetWifiFirmware(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateWifiFirmware]:
-        build = struct.unpack("<Q", payload_str[0:8])[0]
-        reserved1 = struct.unpack("<Q", payload_str[8:16])[0]
-        version = struct.unpack("<I", payload_str[16:20])[0]
-        payload = {"build": build, "reserved1": reserved1, "version": version}
-        message = StateWifiFirmware(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetPower]:
-        message = GetPower(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateRPower]:
-        relay_index = struct.unpack("<c", payload_str[0:1])[0]
-        relay_index = ord(relay_index) #8bit
-        level = struct.unpack("<H", payload_str[1:3])[0]
-        payload = {"relay_index": relay_index, "level": level}
-        message = StateRPower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetPower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"power_level": power_level}
-        message = SetPower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StatePower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"power_level": power_level}
-        message = StatePower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetLabel]:
-        message = GetLabel(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetLabel]:
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[0:32])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        payload = {"label": label}
-        message = SetLabel(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateLabel]:
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[0:32])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        payload = {"label": label}
-        message = StateLabel(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetLocation]:
-        message = GetLocation(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateLocation]:
-        location = [b for b in struct.unpack("<" + ("B"*16), payload_str[0:16])]
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[16:48])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        updated_at = struct.unpack("<Q", payload_str[48:56])[0]
-        payload = {"location": location, "label": label, "updated_at": updated_at}
-        message = StateLocation(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetGroup]:
-        message = GetGroup(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateGroup]:
-        group = [b for b in struct.unpack("<" + ("B"*16), payload_str[0:16])]
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[16:48])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        updated_at = struct.unpack("<Q", payload_str[48:56])[0]
-        payload = {"group": group, "label": label, "updated_at": updated_at}
-        message = StateGroup(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetVersion]:
-        message = GetVersion(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateVersion]:
-        vendor = struct.unpack("<I", payload_str[0:4])[0]
-        product = struct.unpack("<I", payload_str[4:8])[0]
-        version = struct.unpack("<I", payload_str[8:12])[0]
-        payload = {"vendor": vendor, "product": product, "version": version}
-        message = StateVersion(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetInfo]:
-        message = GetInfo(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateInfo]:
-        time = struct.unpack("<Q", payload_str[0:8])[0]
-        uptime = struct.unpack("<Q", payload_str[8:16])[0]
-        downtime = struct.unpack("<Q", payload_str[16:24])[0]
-        payload = {"time": time, "uptime": uptime, "downtime": downtime}
-        message = StateInfo(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[Acknowledgement]:
-        message = Acknowledgement(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[EchoRequest]:
-        byte_array_len = len(payload_str)
-        byte_array = [b for b in struct.unpack("<" + ("B"*byte_array_len), payload_str[0:byte_array_len])]
-        payload = {"byte_array": byte_array}
-        message = EchoRequest(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[EchoResponse]:
-        byte_array_len = len(payload_str)
-        byte_array = [b for b in struct.unpack("<" + ("B"*byte_array_len), payload_str[0:byte_array_len])]
-        payload = {"byte_array": byte_array}
-        message = EchoResponse(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightGet]:
-        message = LightGet(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightSetColor]:
-        reserved = struct.unpack("<B", payload_str[0:1])[0]
-        color = struct.unpack("<" + ("H"*4), payload_str[1:9])
-        duration = struct.unpack("<I", payload_str[9:13])[0]
-        payload = {"color": color, "duration": duration}
-        message = LightSetColor(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightState]:
-        color = struct.unpack("<" + ("H"*4), payload_str[0:8])
-        reserved1 = struct.unpack("<H", payload_str[8:10])[0]
-        power_level = struct.unpack("<H", payload_str[10:12])[0]
-        label = binascii.unhexlify("".join(["%2.2x" % (b & 0x000000ff) for b in struct.unpack("<" + ("b"*32), payload_str[12:44])])).replace(b'\x00', b'')
-        label = label.decode('utf-8')
-        reserved2 = struct.unpack("<Q", payload_str[44:52])[0]
-        payload = {"color": color, "reserved1": reserved1, "power_level": power_level, "label": label, "reserved2": reserved2}
-        message = LightState(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightGetPower]:
-        message = LightGetPower(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightSetPower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        duration = struct.unpack("<I", payload_str[2:6])[0]
-        payload = {"power_level": power_level, "duration": duration}
-        message = LightSetPower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightStatePower]:
-        power_level = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"power_level": power_level}
-        message = LightStatePower(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightGetInfrared]:  # 120
-        message = LightGetInfrared(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightStateInfrared]:  # 121
-        infrared_brightness = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"infrared_brightness": infrared_brightness}
-        message = LightStateInfrared(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[LightSetInfrared]:  # 122
-        infrared_brightness = struct.unpack("<H", payload_str[0:2])[0]
-        payload = {"infrared_brightness": infrared_brightness}
-        message = LightSetInfrared(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneSetColorZones]: #501
-        start_index = struct.unpack("<c", payload_str[0:1])[0]
-        start_index = ord(start_index) # 8 bit
-        end_index = struct.unpack("<c", payload_str[1:2])[0]
-        end_index = ord(end_index) #8 bit
-        color = struct.unpack("<" + ("H" * 4), payload_str[2:10])
-        duration = struct.unpack("<I", payload_str[10:14])[0]
-        apply = struct.unpack("<c", payload_str[14:15])[0]
-        apply = ord(apply) #8 bit
-        payload = {"start_index": start_index, "end_index": end_index, "color": color, "duration": duration, "apply": apply}
-        message = MultiZoneSetColorZones(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneGetColorZones]: #502
-        start_index = struct.unpack("<c", payload_str[0:1])[0]
-        start_index = ord(start_index) # 8 bit
-        end_index = struct.unpack("<c", payload_str[1:2])[0]
-        end_index = ord(end_index) #8 bit
-        payload = {"start_index": start_index, "end_index": end_index}
-        message = MultiZoneGetColorZones(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneStateZone]: #503
-        count = struct.unpack("<c", payload_str[0:1])[0]
-        count = ord(count) # 8 bit
-        index = struct.unpack("<c", payload_str[1:2])[0]
-        index = ord(index) #8 bit
-        color = struct.unpack("<" + ("H" * 4), payload_str[2:10])
-        payload = {"count": count, "index": index, "color": color}
-        message = MultiZoneStateZone(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneStateMultiZone]: #506
-        count = struct.unpack("<c", payload_str[0:1])[0]
-        count = ord(count) # 8 bit
-        index = struct.unpack("<c", payload_str[1:2])[0]
-        index = ord(index) #8 bit
-        colors = []
-        for i in range(8):
-            color = struct.unpack("<" + ("H" * 4), payload_str[2+(i*8):10+(i*8)])
-            colors.append(color)
-        payload = {"count": count, "index": index, "color": colors}
-        message = MultiZoneStateMultiZone(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetMultiZoneEffect]: #507
-        message = GetMultiZoneEffect(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetMultiZoneEffect]: #508
-        instanceid = struct.unpack("<I", payload_str[0:4])[0]
-        effect_type = struct.unpack("<B", payload_str[4:5])[0]
-        reserved1 = struct.unpack("<H", payload_str[5:7])[0]
-        speed = struct.unpack("<I", payload_str[7:11])[0]
-        duration = struct.unpack("<Q", payload_str[11:19])[0]
-        reserved2 = struct.unpack("<I", payload_str[19:23])[0]
-        reserved3 = struct.unpack("<I", payload_str[23:27])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[27+(i*4):31+(i*4)])[0]
-            parameters.append(parameter)
-        payload = {"instanceid": instanceid, "type": effect_type, "reserved1": reserved1, "speed": speed,
-                   "duration": duration, "reserved2": reserved2, "reserved3": reserved3, "parameters": parameters}
-        message = SetMultiZoneEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateMultiZoneEffect]: #509
-        instanceid = struct.unpack("<I", payload_str[0:4])[0]
-        effect_type = struct.unpack("<B", payload_str[4:5])[0]
-        reserved1 = struct.unpack("<H", payload_str[5:7])[0]
-        speed = struct.unpack("<I", payload_str[7:11])[0]
-        duration = struct.unpack("<Q", payload_str[11:19])[0]
-        reserved2 = struct.unpack("<I", payload_str[19:23])[0]
-        reserved3 = struct.unpack("<I", payload_str[23:27])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[27+(i*4):31+(i*4)])[0]
-            parameters.append(parameter)
-        payload = {"instanceid": instanceid, "type": effect_type, "reserved1": reserved1, "speed": speed,
-                   "duration": duration, "reserved2": reserved2, "reserved3": reserved3, "parameters": parameters}
-        message = StateMultiZoneEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneSetExtendedColorZones]: #510
-        duration = struct.unpack("<I", payload_str[0:4])[0]
-        apply = struct.unpack("<B", payload_str[4:5])[0] # Enum.MultiZoneExtendedApplicationRequest
-        index = struct.unpack("<H", payload_str[5:7])[0]
-        count = struct.unpack("<B", payload_str[7:8])[0]
-        colors = []
-        for i in range(count):
-            color = struct.unpack("<" + ("H" * 4), payload_str[8+(i*8):16+(i*8)])
-            colors.append(color)
-        payload = {"duration": duration, "apply": apply, "index": index, "count": count, "colors": colors}
-        message = MultiZoneSetExtendedColorZones(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneGetExtendedColorZones]: #511
-        message = MultiZoneGetExtendedColorZones(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[MultiZoneStateExtendedColorZones]: #512
-        count = struct.unpack("<H", payload_str[0:2])[0]
-        index = struct.unpack("<H", payload_str[2:4])[0]
-        cCount = struct.unpack("<B", payload_str[4:5])[0]
-        colors = []
-        for i in range(cCount):
-            color = struct.unpack("<" + ("H" * 4), payload_str[5+(i*8):13+(i*8)])
-            colors.append(color)
-        payload = {"count": count, "index": index, "colors": colors, "cCount": cCount}
-        message = MultiZoneStateExtendedColorZones(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetDeviceChain]: #701
-        message = GetDeviceChain(target_addr, source_id, seq_num, {}, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateDeviceChain]: #702
-        start_index = struct.unpack("<B", payload_str[0:1])[0]
-        tile_devices = []
-        tilesize_bytes = 55
-        for i in range(16):
-            offset = (i * tilesize_bytes)
-            tile = {"reserved1": struct.unpack("<h", payload_str[1+offset:3+offset])[0],
-                    "reserved2": struct.unpack("<h", payload_str[3+offset:5+offset])[0],
-                    "reserved3": struct.unpack("<h", payload_str[5+offset:7+offset])[0],
-                    "reserved4": struct.unpack("<h", payload_str[7+offset:9+offset])[0],
-                    "user_x": struct.unpack("<f", payload_str[9+offset:13+offset])[0],
-                    "user_y": struct.unpack("<f", payload_str[13+offset:17+offset])[0],
-                    "width": struct.unpack("<B", payload_str[17+offset:18+offset])[0],
-                    "height": struct.unpack("<B", payload_str[18+offset:19+offset])[0],
-                    "reserved5": struct.unpack("<B", payload_str[19+offset:20+offset])[0],
-                    "device_version_vendor": struct.unpack("<I", payload_str[20+offset:24+offset])[0],
-                    "device_version_product": struct.unpack("<I", payload_str[24+offset:28+offset])[0],
-                    "device_version_version": struct.unpack("<I", payload_str[28+offset:32+offset])[0],
-                    "firmware_build": struct.unpack("<Q", payload_str[32+offset:40+offset])[0],
-                    "reserved6": struct.unpack("<Q", payload_str[40+offset:48+offset])[0],
-                    "firmware_version": struct.unpack("<I", payload_str[48+offset:52+offset])[0],
-                    "reserved7": struct.unpack("<I", payload_str[52+offset:56+offset])[0]}
-            tile_devices.append(tile)
-        total_count = struct.unpack("<B", payload_str[881:882])[0]
-        payload = {"start_index": start_index, "total_count": total_count, "tile_devices": tile_devices}
-        message = StateDeviceChain(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetUserPosition]: #703
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        reserved = struct.unpack("<H", payload_str[1:3])[0]
-        user_x = struct.unpack("<f", payload_str[3:7])[0]
-        user_y = struct.unpack("<f", payload_str[7:11])[0]
-        payload = {"tile_index": tile_index, "reserved": reserved, "user_x": user_x, "user_y": user_y}
-        message = SetUserPosition(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetTileState64]: #707
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        length = struct.unpack("<B", payload_str[1:2])[0]
-        reserved = struct.unpack("<B", payload_str[2:3])[0]
-        x = struct.unpack("<B", payload_str[3:4])[0]
-        y = struct.unpack("<B", payload_str[4:5])[0]
-        width = struct.unpack("<B", payload_str[5:6])[0]
-        payload = {"tile_index": tile_index, "length": length, "reserved": reserved, "x": x, "y": y, "width": width}
-        message = GetTileState64(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateTileState64]: #711
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        reserved = struct.unpack("<B", payload_str[1:2])[0]
-        x = struct.unpack("<B", payload_str[2:3])[0]
-        y = struct.unpack("<B", payload_str[3:4])[0]
-        width = struct.unpack("<B", payload_str[4:5])[0]
-        colors = []
-        for i in range(64):
-            color = struct.unpack("<" + ("H" * 4), payload_str[5+(i*8):13+(i*8)])
-            colors.append(color)
-        payload = {"tile_index": tile_index, "reserved": reserved, "x": x, "y": y, "width": width, "colors": colors}
-        message = StateTileState64(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetTileState64]: #715
-        tile_index = struct.unpack("<B", payload_str[0:1])[0]
-        length = struct.unpack("<B", payload_str[1:2])[0]
-        reserved = struct.unpack("<B", payload_str[2:3])[0]
-        x = struct.unpack("<B", payload_str[3:4])[0]
-        y = struct.unpack("<B", payload_str[4:5])[0]
-        width = struct.unpack("<B", payload_str[5:6])[0]
-        duration = struct.unpack("<I", payload_str[6:10])[0]
-        colors = []
-        for i in range(64):
-            color = struct.unpack("<" + ("H" * 4), payload_str[10+(i*8):18+(i*8)])
-            colors.append(color)
-        payload = {"tile_index": tile_index, "length": length, "reserved": reserved, "x": x, "y": y, "width": width, "duration": duration, "colors": colors}
-        message = SetTileState64(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[GetTileEffect]: #718
-        message = GetTileEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[SetTileEffect]: #719
-        reserved1 = struct.unpack("<B", payload_str[0:1])[0]
-        reserved2 = struct.unpack("<B", payload_str[1:2])[0]
-        instanceid = struct.unpack("<I", payload_str[2:6])[0]
-        effect_type = struct.unpack("<B", payload_str[6:7])[0]
-        speed = struct.unpack("<I", payload_str[7:11])[0]
-        duration = struct.unpack("<Q", payload_str[11:19])[0]
-        reserved3 = struct.unpack("<I", payload_str[19:23])[0]
-        reserved4 = struct.unpack("<I", payload_str[23:27])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[27+(i*4):31+(i*4)])[0]
-            parameters.append(parameter)
-        palette_count = struct.unpack("<B", payload_str[59:60])[0]
-        palette = []
-        for i in range(palette_count):
-            color = struct.unpack("<" + ("H" * 4), payload_str[60+(i*8):68+(i*8)])
-            palette.append(color)
-        payload = {"reserved1": reserved1, "reserved2": reserved2, "instanceid": instanceid, "type": effect_type, "speed": speed, "duration": duration,
-                   "reserved3": reserved3, "reserved4": reserved4, "parameters": parameters, "palette_count": palette_count, "palette": palette}
-        message = SetTileEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
-    elif message_type == MSG_IDS[StateTileEffect]: #720
-        reserved1 = struct.unpack("<B", payload_str[0:1])[0]
-        instanceid = struct.unpack("<I", payload_str[1:5])[0]
-        effect_type = struct.unpack("<B", payload_str[5:6])[0]
-        speed = struct.unpack("<I", payload_str[6:10])[0]
-        duration = struct.unpack("<Q", payload_str[10:18])[0]
-        reserved2 = struct.unpack("<I", payload_str[18:22])[0]
-        reserved3 = struct.unpack("<I", payload_str[22:26])[0]
-        parameters = []
-        for i in range(8):
-            parameter = struct.unpack("<I", payload_str[26+(i*4):30+(i*4)])[0]
-            parameters.append(parameter)
-        palette_count = struct.unpack("<B", payload_str[58:59])[0]
-        palette = []
-        for i in range(palette_count):
-            color = struct.unpack("<" + ("H" * 4), payload_str[59+(i*8):67+(i*8)])
-            palette.append(color)
-        payload = {"reserved1": reserved1, "instanceid": instanceid, "type": effect_type, "speed": speed, "duration": duration,
-                   "reserved2": reserved2, "reserved3": reserved3, "parameters": parameters, "palette_count": palette_count, "palette": palette}
-        message = StateTileEffect(target_addr, source_id, seq_num, payload, ack_requested, response_requested)
-
+    payload_str = data[HEADER_SIZE_BYTES:]
+
+    decoder = PAYLOAD_DECODERS.get(message_type)
+    if decoder != None:
+        # Skip the subclass constructor so the payload is only decoded if one
+        # of its fields is actually read. Callers that filter on the header
+        # alone (type, source_id, target_addr) never pay for it.
+        msg_type, decode_payload = decoder
+        message = msg_type.__new__(msg_type)
+        Message.__init__(message, message_type, target_addr, source_id, seq_num, ack_requested, response_requested)
+        message._decode_payload = lazy_payload(decode_payload, payload_str)
     else:
         message = Message(message_type, target_addr, source_id, seq_num, ack_requested, response_requested)
 
@@ -454,8 +40,201 @@ def unpack_lifx_message(packed_message):
     message.addressable = addressable
     message.protocol = protocol
     message.source_id = source_id
-    message.header = header_str
-    message.payload = payload_str
+    # header and payload are sliced out of packed_message on first use (see Message.__getattr__)
     message.packed_message = packed_message
 
     return message
+
+
+################################################################################
+#                                                                              #
+#                             Payload Decoders                                 #
+#                                                                              #
+################################################################################
+
+# Each decoder takes the payload bytes (a memoryview past the header) and
+# returns the payload dict that the matching msgtypes constructor expects.
+
+# payload keys that the msgtypes constructors store under another attribute name
+PAYLOAD_ATTRS = {"type": "effect_type"}
+
+def lazy_payload(decode_payload, payload_str):
+    def decode():
+        payload = decode_payload(payload_str)
+        return dict((PAYLOAD_ATTRS.get(key, key), value) for (key, value) in payload.items())
+    return decode
+
+# Labels are cut off at 32 bytes, possibly partway through a multibyte
+# character, so an incomplete character at the end is dropped
+def decode_label(buf):
+    return bytes(buf).replace(b'\x00', b'').decode('utf-8', errors='ignore')
+
+def decode_colors(buf, offset, count):
+    return list(codec.COLOR.iter_unpack(buf[offset:offset + count * codec.COLOR.size]))
+
+def decode_empty(payload_str):
+    return {}
+
+def decode_fields(layout, names):
+    def decode(payload_str):
+        return dict(zip(names, layout.unpack_from(payload_str)))
+    return decode
+
+def decode_label_payload(payload_str):
+    return {"label": decode_label(payload_str[0:32])}
+
+def decode_state_location(payload_str):
+    location, label, updated_at = codec.STATE_LOCATION.unpack_from(payload_str)
+    return {"location": list(location), "label": decode_label(label), "updated_at": updated_at}
+
+def decode_state_group(payload_str):
+    group, label, updated_at = codec.STATE_GROUP.unpack_from(payload_str)
+    return {"group": list(group), "label": decode_label(label), "updated_at": updated_at}
+
+def decode_byte_array(payload_str):
+    return {"byte_array": list(payload_str)}
+
+def decode_light_set_color(payload_str):
+    fields = codec.LIGHT_SET_COLOR.unpack_from(payload_str)
+    return {"color": fields[1:5], "duration": fields[5]}
+
+def decode_light_set_waveform(payload_str):
+    fields = codec.LIGHT_SET_WAVEFORM.unpack_from(payload_str)
+    return {"transient": fields[1], "color": fields[2:6], "period": fields[6], "cycles": fields[7],
+            "duty_cycle": fields[8], "waveform": fields[9]}
+
+def decode_light_set_waveform_optional(payload_str):
+    fields = codec.LIGHT_SET_WAVEFORM_OPTIONAL.unpack_from(payload_str)
+    return {"transient": fields[1], "color": fields[2:6], "period": fields[6], "cycles": fields[7],
+            "duty_cycle": fields[8], "waveform": fields[9], "set_hue": fields[10], "set_saturation": fields[11],
+            "set_brightness": fields[12], "set_kelvin": fields[13]}
+
+def decode_light_state(payload_str):
+    fields = codec.LIGHT_STATE.unpack_from(payload_str)
+    return {"color": fields[0:4], "reserved1": fields[4], "power_level": fields[5], "label": decode_label(fields[6]),
+            "reserved2": fields[7]}
+
+def decode_multizone_set_color_zones(payload_str):
+    fields = codec.MULTIZONE_SET_COLOR_ZONES.unpack_from(payload_str)
+    return {"start_index": fields[0], "end_index": fields[1], "color": fields[2:6], "duration": fields[6], "apply": fields[7]}
+
+def decode_multizone_state_zone(payload_str):
+    fields = codec.MULTIZONE_STATE_ZONE.unpack_from(payload_str)
+    return {"count": fields[0], "index": fields[1], "color": fields[2:6]}
+
+def decode_multizone_state_multizone(payload_str):
+    count, index = codec.MULTIZONE_STATE_MULTIZONE_HEADER.unpack_from(payload_str)
+    return {"count": count, "index": index, "color": decode_colors(payload_str, 2, 8)}
+
+def decode_multizone_effect(payload_str):
+    fields = codec.MULTIZONE_EFFECT.unpack_from(payload_str)
+    return {"instanceid": fields[0], "type": fields[1], "reserved1": fields[2], "speed": fields[3], "duration": fields[4],
+            "reserved2": fields[5], "reserved3": fields[6], "parameters": list(fields[7:15])}
+
+def decode_multizone_set_extended_color_zones(payload_str):
+    duration, apply, index, count = codec.MULTIZONE_SET_EXTENDED_COLOR_ZONES_HEADER.unpack_from(payload_str)
+    colors = codec.unpack_color_array(payload_str, codec.MULTIZONE_SET_EXTENDED_COLOR_ZONES_HEADER.size, count)
+    return {"duration": duration, "apply": apply, "index": index, "count": count, "colors": colors}
+
+def decode_multizone_state_extended_color_zones(payload_str):
+    count, index, cCount = codec.MULTIZONE_STATE_EXTENDED_COLOR_ZONES_HEADER.unpack_from(payload_str)
+    colors = codec.unpack_color_array(payload_str, codec.MULTIZONE_STATE_EXTENDED_COLOR_ZONES_HEADER.size, cCount)
+    return {"count": count, "index": index, "colors": colors, "cCount": cCount}
+
+def decode_state_device_chain(payload_str):
+    start_index = codec.STATE_DEVICE_CHAIN_START.unpack_from(payload_str)[0]
+    tiles_end = codec.STATE_DEVICE_CHAIN_START.size + 16 * codec.TILE.size
+    tile_devices = [dict(zip(codec.TILE_FIELDS, tile)) for tile in codec.TILE.iter_unpack(payload_str[codec.STATE_DEVICE_CHAIN_START.size:tiles_end])]
+    total_count = codec.STATE_DEVICE_CHAIN_END.unpack_from(payload_str, tiles_end)[0]
+    return {"start_index": start_index, "total_count": total_count, "tile_devices": tile_devices}
+
+def decode_state_tile_state_64(payload_str):
+    tile_index, reserved, x, y, width = codec.STATE_TILE_STATE_64_HEADER.unpack_from(payload_str)
+    colors = codec.unpack_color_array(payload_str, codec.STATE_TILE_STATE_64_HEADER.size, 64)
+    return {"tile_index": tile_index, "reserved": reserved, "x": x, "y": y, "width": width, "colors": colors}
+
+def decode_set_tile_state_64(payload_str):
+    tile_index, length, reserved, x, y, width, duration = codec.SET_TILE_STATE_64_HEADER.unpack_from(payload_str)
+    colors = codec.unpack_color_array(payload_str, codec.SET_TILE_STATE_64_HEADER.size, 64)
+    return {"tile_index": tile_index, "length": length, "reserved": reserved, "x": x, "y": y, "width": width,
+            "duration": duration, "colors": colors}
+
+def decode_set_tile_effect(payload_str):
+    fields = codec.SET_TILE_EFFECT_HEADER.unpack_from(payload_str)
+    palette_count = fields[16]
+    return {"reserved1": fields[0], "reserved2": fields[1], "instanceid": fields[2], "type": fields[3], "speed": fields[4],
+            "duration": fields[5], "reserved3": fields[6], "reserved4": fields[7], "parameters": list(fields[8:16]),
+            "palette_count": palette_count, "palette": decode_colors(payload_str, codec.SET_TILE_EFFECT_HEADER.size, palette_count)}
+
+def decode_state_tile_effect(payload_str):
+    fields = codec.STATE_TILE_EFFECT_HEADER.unpack_from(payload_str)
+    palette_count = fields[15]
+    return {"reserved1": fields[0], "instanceid": fields[1], "type": fields[2], "speed": fields[3], "duration": fields[4],
+            "reserved2": fields[5], "reserved3": fields[6], "parameters": list(fields[7:15]),
+            "palette_count": palette_count, "palette": decode_colors(payload_str, codec.STATE_TILE_EFFECT_HEADER.size, palette_count)}
+
+
+# message type -> (message class, payload decoder)
+PAYLOAD_DECODERS = {
+    MSG_IDS[GetService]: (GetService, decode_empty),
+    MSG_IDS[StateService]: (StateService, decode_fields(codec.STATE_SERVICE, ("service", "port"))),
+    MSG_IDS[GetHostInfo]: (GetHostInfo, decode_empty),
+    MSG_IDS[StateHostInfo]: (StateHostInfo, decode_fields(codec.STATE_HOST_INFO, ("signal", "tx", "rx", "reserved1"))),
+    MSG_IDS[GetHostFirmware]: (GetHostFirmware, decode_empty),
+    MSG_IDS[StateHostFirmware]: (StateHostFirmware, decode_fields(codec.STATE_HOST_FIRMWARE, ("build", "reserved1", "version"))),
+    MSG_IDS[GetWifiInfo]: (GetWifiInfo, decode_empty),
+    MSG_IDS[StateWifiInfo]: (StateWifiInfo, decode_fields(codec.STATE_WIFI_INFO, ("signal", "tx", "rx", "reserved1"))),
+    MSG_IDS[GetWifiFirmware]: (GetWifiFirmware, decode_empty),
+    MSG_IDS[StateWifiFirmware]: (StateWifiFirmware, decode_fields(codec.STATE_WIFI_FIRMWARE, ("build", "reserved1", "version"))),
+    MSG_IDS[GetPower]: (GetPower, decode_empty),
+    MSG_IDS[SetPower]: (SetPower, decode_fields(codec.POWER, ("power_level",))),
+    MSG_IDS[StatePower]: (StatePower, decode_fields(codec.POWER, ("power_level",))),
+    MSG_IDS[GetLabel]: (GetLabel, decode_empty),
+    MSG_IDS[SetLabel]: (SetLabel, decode_label_payload),
+    MSG_IDS[StateLabel]: (StateLabel, decode_label_payload),
+    MSG_IDS[GetVersion]: (GetVersion, decode_empty),
+    MSG_IDS[StateVersion]: (StateVersion, decode_fields(codec.STATE_VERSION, ("vendor", "product", "version"))),
+    MSG_IDS[GetInfo]: (GetInfo, decode_empty),
+    MSG_IDS[StateInfo]: (StateInfo, decode_fields(codec.STATE_INFO, ("time", "uptime", "downtime"))),
+    MSG_IDS[Acknowledgement]: (Acknowledgement, decode_empty),
+    MSG_IDS[GetLocation]: (GetLocation, decode_empty),
+    MSG_IDS[StateLocation]: (StateLocation, decode_state_location),
+    MSG_IDS[GetGroup]: (GetGroup, decode_empty),
+    MSG_IDS[StateGroup]: (StateGroup, decode_state_group),
+    MSG_IDS[EchoRequest]: (EchoRequest, decode_byte_array),
+    MSG_IDS[EchoResponse]: (EchoResponse, decode_byte_array),
+    MSG_IDS[StateUnhandled]: (StateUnhandled, decode_fields(codec.STATE_UNHANDLED, ("unhandled_type",))),
+    MSG_IDS[LightGet]: (LightGet, decode_empty),
+    MSG_IDS[LightSetColor]: (LightSetColor, decode_light_set_color),
+    MSG_IDS[LightSetWaveform]: (LightSetWaveform, decode_light_set_waveform),
+    MSG_IDS[LightState]: (LightState, decode_light_state),
+    MSG_IDS[LightGetPower]: (LightGetPower, decode_empty),
+    MSG_IDS[LightSetPower]: (LightSetPower, decode_fields(codec.LIGHT_SET_POWER, ("power_level", "duration"))),
+    MSG_IDS[LightStatePower]: (LightStatePower, decode_fields(codec.POWER, ("power_level",))),
+    MSG_IDS[LightSetWaveformOptional]: (LightSetWaveformOptional, decode_light_set_waveform_optional),
+    MSG_IDS[LightGetInfrared]: (LightGetInfrared, decode_empty),
+    MSG_IDS[LightStateInfrared]: (LightStateInfrared, decode_fields(codec.INFRARED, ("infrared_brightness",))),
+    MSG_IDS[LightSetInfrared]: (LightSetInfrared, decode_fields(codec.INFRARED, ("infrared_brightness",))),
+    MSG_IDS[MultiZoneSetColorZones]: (MultiZoneSetColorZones, decode_multizone_set_color_zones),
+    MSG_IDS[MultiZoneGetColorZones]: (MultiZoneGetColorZones, decode_fields(codec.MULTIZONE_GET_COLOR_ZONES, ("start_index", "end_index"))),
+    MSG_IDS[MultiZoneStateZone]: (MultiZoneStateZone, decode_multizone_state_zone),
+    MSG_IDS[MultiZoneStateMultiZone]: (MultiZoneStateMultiZone, decode_multizone_state_multizone),
+    MSG_IDS[GetMultiZoneEffect]: (GetMultiZoneEffect, decode_empty),
+    MSG_IDS[SetMultiZoneEffect]: (SetMultiZoneEffect, decode_multizone_effect),
+    MSG_IDS[StateMultiZoneEffect]: (StateMultiZoneEffect, decode_multizone_effect),
+    MSG_IDS[MultiZoneSetExtendedColorZones]: (MultiZoneSetExtendedColorZones, decode_multizone_set_extended_color_zones),
+    MSG_IDS[MultiZoneGetExtendedColorZones]: (MultiZoneGetExtendedColorZones, decode_empty),
+    MSG_IDS[MultiZoneStateExtendedColorZones]: (MultiZoneStateExtendedColorZones, decode_multizone_state_extended_color_zones),
+    MSG_IDS[GetDeviceChain]: (GetDeviceChain, decode_empty),
+    MSG_IDS[StateDeviceChain]: (StateDeviceChain, decode_state_device_chain),
+    MSG_IDS[SetUserPosition]: (SetUserPosition, decode_fields(codec.SET_USER_POSITION, ("tile_index", "reserved", "user_x", "user_y"))),
+    MSG_IDS[GetTileState64]: (GetTileState64, decode_fields(codec.GET_TILE_STATE_64, ("tile_index", "length", "reserved", "x", "y", "width"))),
+    MSG_IDS[StateTileState64]: (StateTileState64, decode_state_tile_state_64),
+    MSG_IDS[SetTileState64]: (SetTileState64, decode_set_tile_state_64),
+    MSG_IDS[GetTileEffect]: (GetTileEffect, decode_empty),
+    MSG_IDS[SetTileEffect]: (SetTileEffect, decode_set_tile_effect),
+    MSG_IDS[StateTileEffect]: (StateTileEffect, decode_state_tile_effect),
+    MSG_IDS[GetRPower]: (GetRPower, decode_fields(codec.GET_RPOWER, ("relay_index",))),
+    MSG_IDS[SetRPower]: (SetRPower, decode_fields(codec.RPOWER, ("relay_index", "level"))),
+    MSG_IDS[StateRPower]: (StateRPower, decode_fields(codec.RPOWER, ("relay_index", "level"))),
+}
@@ -13,9 +13,11 @@ setup(name='lifxlan',
       license=metadata['license'],
       packages=['lifxlan'],
       install_requires=[
-        "bitstring",
         "ifaddr"
       ],
+      extras_require={
+        "numpy": ["numpy"]
+      },
       zip_safe=False,
       # See https://pypi.python.org/pypi?%3Aaction=list_classifiers
       classifiers=[
@@ -0,0 +1,82 @@
+# coding=utf-8
+# A stand-in for a LIFX device on the loopback interface, for tests that need
+# real replies to come back over the socket.
+
+from socket import AF_INET, SOCK_DGRAM, socket
+from threading import Thread
+
+import pytest
+
+from lifxlan import lifxlan
+from lifxlan.message import BROADCAST_MAC
+from lifxlan.msgtypes import Acknowledgement
+from lifxlan.unpack import unpack_lifx_message
+
+
+class FakeDevice(object):
+    # replies maps each message type the device answers to (response_type,
+    # payload), or to a list of them for several replies. Message types in
+    # ignore_broadcasts are only answered when sent to the device directly.
+    def __init__(self, mac_addr, replies, ip_addr="127.0.0.1", port=0, ignore_broadcasts=()):
+        self.mac_addr = mac_addr
+        self.replies = replies
+        self.ignore_broadcasts = ignore_broadcasts
+        self.received = []
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.bind((ip_addr, port))
+        (self.ip_addr, self.port) = self.sock.getsockname()
+        self.thread = Thread(target=self.serve)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def serve(self):
+        while True:
+            try:
+                (data, addr) = self.sock.recvfrom(2048)
+            except OSError:
+                return
+            request = unpack_lifx_message(data)
+            if request.target_addr not in (self.mac_addr, BROADCAST_MAC):
+                continue
+            self.received.append(request)
+            if request.ack_requested:
+                self.send(Acknowledgement, {}, request, addr)
+            if request.response_requested:
+                if request.target_addr == BROADCAST_MAC and type(request) in self.ignore_broadcasts:
+                    continue
+                for (response_type, payload) in self.answer(request):
+                    self.send(response_type, payload, request, addr)
+
+    # the (response_type, payload) replies to request
+    def answer(self, request):
+        answers = self.replies.get(type(request), [])
+        return answers if type(answers) == list else [answers]
+
+    def send(self, response_type, payload, request, addr):
+        response = response_type(self.mac_addr, request.source_id, request.seq_num, dict(payload))
+        try:
+            self.sock.sendto(response.packed_message, addr)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+# Makes LifxLAN broadcasts go to fake devices on 127.0.0.1 and 127.0.0.2,
+# which have to share a port, like devices on a LAN share 56700
+@pytest.fixture
+def broadcast_to(monkeypatch):
+    devices = []
+    def make_devices(*device_args):
+        port = 0
+        for (mac_addr, replies, kwargs) in device_args:
+            device = FakeDevice(mac_addr, replies, "127.0.0.{}".format(len(devices) + 1), port, **kwargs)
+            port = device.port
+            devices.append(device)
+        monkeypatch.setattr(lifxlan, "UDP_BROADCAST_IP_ADDRS", [device.ip_addr for device in devices])
+        monkeypatch.setattr(lifxlan, "UDP_BROADCAST_PORT", port)
+        return devices
+    yield make_devices
+    for device in devices:
+        device.close()
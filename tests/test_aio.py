@@ -0,0 +1,69 @@
+# coding=utf-8
+# Tests for the asyncio client: devices created directly share one transport
+# per event loop, and AsyncMultiZoneLight.push_zone_frame only sends the zone
+# runs that changed, like MultiZoneLight.push_zone_frame.
+
+import asyncio
+
+from lifxlan.aio import AsyncLight, AsyncMultiZoneLight, AsyncTransport, default_transports
+from lifxlan.msgtypes import LightSetColor
+
+MAC_ADDR = "d0:73:d5:00:00:01"
+RED = (0, 65535, 65535, 3500)
+BLUE = (43634, 65535, 65535, 3500)
+
+
+class RecordingMultiZoneLight(AsyncMultiZoneLight):
+    def __init__(self, extended=False):
+        super(RecordingMultiZoneLight, self).__init__(MAC_ADDR, "192.0.2.1", transport=AsyncTransport())
+        self.extended_multizone = extended
+        self.sent = [] # ("runs", runs) or ("extended", colors)
+
+    async def set_zone_runs(self, runs, duration=0, rapid=False, apply=1):
+        self.sent.append(("runs", runs))
+
+    async def extended_set_zone_color(self, colors, index=0, duration=0, rapid=False, apply=1):
+        self.sent.append(("extended", colors))
+
+
+def test_devices_share_a_transport_per_event_loop():
+    async def transports():
+        return (AsyncLight(MAC_ADDR, "192.0.2.1").transport, AsyncMultiZoneLight("d0:73:d5:00:00:02", "192.0.2.2").transport)
+    (first, second) = asyncio.run(transports())
+    assert first is second
+    assert isinstance(first, AsyncTransport)
+    (third, fourth) = asyncio.run(transports())
+    assert third is fourth
+    assert third is not first
+    # the closed loop's transport is dropped
+    assert list(default_transports.values()) == [third]
+
+def test_given_transport_is_kept():
+    transport = AsyncTransport()
+    async def get_transport():
+        return AsyncLight(MAC_ADDR, "192.0.2.1", transport=transport).transport
+    assert asyncio.run(get_transport()) is transport
+
+def test_push_zone_frame_sends_only_changed_runs():
+    light = RecordingMultiZoneLight()
+    frame = [RED] * 4 + [BLUE] * 4
+    assert asyncio.run(light.push_zone_frame(frame)) == 2
+    changed = list(frame)
+    changed[5] = RED
+    assert asyncio.run(light.push_zone_frame(changed)) == 1
+    assert light.sent[-1] == ("runs", [(5, 5, RED)])
+    assert asyncio.run(light.push_zone_frame(changed)) == 0
+    assert light.get_zone_frame_stats() == {"frames": 3, "packets": 3, "last_frame_packets": 0}
+
+def test_push_zone_frame_resends_everything_after_a_set_color():
+    light = RecordingMultiZoneLight()
+    frame = [RED] * 4 + [BLUE] * 4
+    asyncio.run(light.push_zone_frame(frame))
+    light.invalidate_state(LightSetColor)
+    assert asyncio.run(light.push_zone_frame(frame)) == 2
+
+def test_push_zone_frame_uses_extended_messages_when_shorter():
+    light = RecordingMultiZoneLight(extended=True)
+    frame = [RED if i % 2 else BLUE for i in range(16)]
+    assert asyncio.run(light.push_zone_frame(frame)) == 1
+    assert light.sent == [("extended", frame)]
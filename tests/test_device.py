@@ -0,0 +1,189 @@
+# coding=utf-8
+# Regression tests for the request window: a failed send has to give back its
+# slot and listener, the window can be resized while requests are out, and a
+# reply that is already queued is not thrown away at the deadline. Also
+# covers requests that ask for both an acknowledgement and a state reply, and
+# getters answering from the state cache when given a max_age.
+
+from threading import Thread
+from time import time
+
+import pytest
+
+from conftest import FakeDevice
+from lifxlan.device import PendingRequest, RequestWindow, StateCache
+from lifxlan.errors import WorkflowException
+from lifxlan.light import Light
+from lifxlan.msgtypes import Acknowledgement, LightGet, LightGetPower, LightSetColor, LightSetPower, LightState, \
+    LightStatePower
+from lifxlan.transport import Transport
+
+
+class UnreachableTransport(Transport):
+    def sendto(self, packet, addr):
+        raise OSError("Network is unreachable")
+
+
+@pytest.fixture
+def light():
+    transport = UnreachableTransport()
+    light = Light("D0:73:D5:00:00:01", "192.0.2.1", transport=transport)
+    yield light
+    transport.close()
+
+def test_failed_send_releases_window_and_listener(light):
+    for i in range(light.request_window_size + 2):
+        with pytest.raises(OSError):
+            light.get_power()
+    assert light.request_window.in_use == 0
+    assert light.transport.listeners == {}
+
+def test_failed_pipelined_send_releases_window_and_listener(light):
+    with pytest.raises(OSError):
+        light.req_with_resp_pipelined([(LightGetPower, LightStatePower)] * 6)
+    assert light.request_window.in_use == 0
+    assert light.transport.listeners == {}
+
+def test_mac_addr_is_lowercased(light):
+    assert light.mac_addr == "d0:73:d5:00:00:01"
+
+def test_growing_window_wakes_blocked_request():
+    window = RequestWindow(1)
+    window.acquire()
+    waiter = Thread(target=window.acquire)
+    waiter.start()
+    waiter.join(0.1)
+    assert waiter.is_alive()
+    window.resize(2)
+    waiter.join(1)
+    assert not waiter.is_alive()
+    assert window.in_use == 2
+
+def test_shrinking_window_keeps_requests_in_flight():
+    window = RequestWindow(3)
+    for i in range(3):
+        window.acquire()
+    window.resize(1)
+    assert window.in_use == 3
+    window.release()
+    assert not window.acquire(False)
+    window.release()
+    window.release()
+    assert window.acquire(False)
+
+def test_set_request_window_resizes_in_place(light):
+    window = light.request_window
+    light.set_request_window(8)
+    assert light.request_window is window
+    assert window.size == 8
+    assert light.request_window_size == 8
+
+def test_over_release_raises():
+    window = RequestWindow(1)
+    with pytest.raises(ValueError):
+        window.release()
+
+def test_queued_reply_is_returned_after_the_deadline():
+    transport = Transport()
+    light = Light("d0:73:d5:00:00:01", "192.0.2.1", transport=transport)
+    light.request_window.acquire()
+    request = PendingRequest(light, LightGetPower, [LightStatePower])
+    # sent long enough ago that the deadline has already passed
+    request.sent_time = time() - 10
+    reply = LightStatePower(light.mac_addr, light.source_id, request.listener.seq_num, {"power_level": 65535})
+    transport.handle_datagram(reply.packed_message, "192.0.2.1")
+    try:
+        responses = request.wait(timeout_secs=1, max_attempts=1)
+    finally:
+        transport.close()
+    assert [r.power_level for r in responses] == [65535]
+    assert light.request_window.in_use == 0
+    assert transport.listeners == {}
+
+def test_req_with_ack_resp_returns_both_replies():
+    device = FakeDevice("d0:73:d5:00:00:01", {LightSetPower: (LightStatePower, {"power_level": 65535})})
+    transport = Transport()
+    light = Light(device.mac_addr, device.ip_addr, port=device.port, transport=transport)
+    try:
+        (ack, state) = light.req_with_ack_resp(LightSetPower, LightStatePower, {"power_level": 65535, "duration": 0})
+    finally:
+        transport.close()
+        device.close()
+    assert (type(ack), type(state), state.power_level) == (Acknowledgement, LightStatePower, 65535)
+    # one packet asked for both
+    assert [(type(m), m.ack_requested, m.response_requested) for m in device.received] == [(LightSetPower, 1, 1)]
+
+def test_req_with_ack_resp_needs_both_replies():
+    # acknowledges, but never sends the state reply
+    device = FakeDevice("d0:73:d5:00:00:01", {})
+    transport = Transport()
+    light = Light(device.mac_addr, device.ip_addr, port=device.port, transport=transport)
+    try:
+        with pytest.raises(WorkflowException):
+            light.req_with_ack_resp(LightSetPower, LightStatePower, {"power_level": 65535, "duration": 0}, timeout_secs=0.2, max_attempts=1)
+    finally:
+        transport.close()
+        device.close()
+
+def test_state_cache():
+    cache = StateCache()
+    assert not cache.is_cached("power_level", 10)
+    assert cache.cache_state("power_level", 65535) == 65535
+    assert cache.is_cached("power_level", 10)
+    # None means the caller wants a fresh value
+    assert not cache.is_cached("power_level", None)
+    cache.state_cache["power_level"] = (65535, time() - 11)
+    assert not cache.is_cached("power_level", 10)
+
+def test_set_messages_invalidate_what_they_change():
+    cache = StateCache()
+    for name in ("power_level", "color", "label"):
+        cache.cache_state(name, 0)
+    cache.invalidate_state(LightSetColor)
+    assert sorted(cache.state_cache) == ["label", "power_level"]
+    cache.invalidate_state(LightGetPower)
+    assert sorted(cache.state_cache) == ["label", "power_level"]
+
+@pytest.fixture
+def fake_light():
+    device = FakeDevice("d0:73:d5:00:00:01", {
+        LightGetPower: (LightStatePower, {"power_level": 65535}),
+        LightGet: (LightState, {"color": (1, 2, 3, 3500), "reserved1": 0, "power_level": 0, "label": "Kitchen", "reserved2": 0})})
+    transport = Transport()
+    light = Light(device.mac_addr, device.ip_addr, port=device.port, transport=transport)
+    yield (device, light)
+    transport.close()
+    device.close()
+
+def requests_of(device, msg_type):
+    return len([m for m in device.received if type(m) == msg_type])
+
+def test_getter_answers_from_the_cache_within_max_age(fake_light):
+    (device, light) = fake_light
+    assert light.get_power(max_age=10) == 65535
+    assert light.get_power(max_age=10) == 65535
+    assert requests_of(device, LightGetPower) == 1
+    # without max_age the device is always asked
+    light.get_power()
+    assert requests_of(device, LightGetPower) == 2
+
+def test_getter_asks_again_once_max_age_has_passed(fake_light):
+    (device, light) = fake_light
+    light.get_power(max_age=10)
+    light.state_cache["power_level"] = (65535, time() - 11)
+    light.get_power(max_age=10)
+    assert requests_of(device, LightGetPower) == 2
+
+def test_setter_invalidates_the_cache(fake_light):
+    (device, light) = fake_light
+    light.get_power(max_age=10)
+    light.set_power(0, rapid=True)
+    light.get_power(max_age=10)
+    assert requests_of(device, LightGetPower) == 2
+
+def test_get_color_caches_everything_it_received(fake_light):
+    (device, light) = fake_light
+    assert light.get_color(max_age=10) == (1, 2, 3, 3500)
+    assert light.get_power(max_age=10) == 0
+    assert light.get_label(max_age=10) == "Kitchen"
+    assert [type(m) for m in device.received] == [LightGet]
@@ -0,0 +1,217 @@
+# coding=utf-8
+# Tests for background discovery: devices are merged into the device list in
+# place, a device whose StateVersion went missing keeps its object, and every
+# callback gets every event even if one of them raises. Also covers
+# discover_iter handing out devices as they answer and stopping early once the
+# LAN goes quiet, and classifying devices from the broadcast GetVersion with
+# a unicast one only for devices that missed it.
+
+from time import time
+
+import pytest
+
+from lifxlan.discovery import DEVICE_ADDED, DEVICE_IP_CHANGED, DEVICE_REMOVED, DiscoveryReplies, DiscoveryThread
+from lifxlan.lifxlan import LifxLAN, device_kind
+from lifxlan.light import Light
+from lifxlan.message import BROADCAST_MAC
+from lifxlan.msgtypes import GetService, GetVersion, StateService, StateVersion
+from lifxlan.multizonelight import MultiZoneLight
+from lifxlan.switch import Switch
+from lifxlan.tilechain import TileChain
+
+MULTIZONE = (1, 31, 0) # LIFX Z
+
+
+class ScriptedLifxLAN(LifxLAN):
+    def __init__(self):
+        super(ScriptedLifxLAN, self).__init__()
+        self.found = [] # (mac_addr, ip_addr, version) answering the next discovery
+
+    def discover_iter(self, timeout_secs=1, quiet_secs=None):
+        return iter([self.make_device(mac_addr, ip_addr, 1, 56700, version) for (mac_addr, ip_addr, version) in self.found])
+
+
+@pytest.fixture
+def lan():
+    lan = ScriptedLifxLAN()
+    yield lan
+    lan.close()
+
+def run_round(lan, thread):
+    events = []
+    lan.add_device_callback(lambda event, device: events.append((event, device)))
+    thread.discover()
+    return events
+
+def test_new_devices_are_added(lan):
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.1", MULTIZONE), ("d0:73:d5:00:00:02", "192.0.2.2", None)]
+    events = run_round(lan, DiscoveryThread(lan))
+    assert [(event, device.mac_addr) for (event, device) in events] == [(DEVICE_ADDED, "d0:73:d5:00:00:01"), (DEVICE_ADDED, "d0:73:d5:00:00:02")]
+    assert [type(d) for d in lan.devices] == [MultiZoneLight, Light]
+
+def test_address_changes_are_applied_in_place(lan):
+    thread = DiscoveryThread(lan)
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.1", MULTIZONE)]
+    thread.discover()
+    device = lan.devices[0]
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.9", MULTIZONE)]
+    assert run_round(lan, thread) == [(DEVICE_IP_CHANGED, device)]
+    assert lan.devices == [device]
+    assert device.ip_addr == "192.0.2.9"
+
+def test_missing_version_keeps_the_existing_device(lan):
+    thread = DiscoveryThread(lan)
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.1", MULTIZONE)]
+    thread.discover()
+    device = lan.devices[0]
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.1", None)]
+    assert run_round(lan, thread) == []
+    assert lan.devices == [device]
+    assert type(device) == MultiZoneLight
+    assert device.product == 31
+
+def test_device_is_removed_after_missed_rounds(lan):
+    thread = DiscoveryThread(lan, missed_rounds=2)
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.1", MULTIZONE)]
+    thread.discover()
+    device = lan.devices[0]
+    lan.found = []
+    assert run_round(lan, thread) == []
+    lan.device_callbacks = []
+    assert run_round(lan, thread) == [(DEVICE_REMOVED, device)]
+    assert lan.devices == []
+
+def test_failing_callback_does_not_drop_events(lan, capsys):
+    def fail(event, device):
+        raise ValueError("callback bug")
+    lan.add_device_callback(fail)
+    lan.found = [("d0:73:d5:00:00:01", "192.0.2.1", MULTIZONE), ("d0:73:d5:00:00:02", "192.0.2.2", MULTIZONE)]
+    events = run_round(lan, DiscoveryThread(lan))
+    assert [device.mac_addr for (event, device) in events] == ["d0:73:d5:00:00:01", "d0:73:d5:00:00:02"]
+    (out, err) = capsys.readouterr()
+    assert "callback bug" in out + err
+
+
+def state_service(mac_addr, source_id, received_time):
+    response = StateService(mac_addr, source_id, 0, {"service": 1, "port": 56700})
+    response.ip_addr = "192.0.2.1"
+    response.received_time = received_time
+    return response
+
+def state_version(mac_addr, source_id, received_time):
+    response = StateVersion(mac_addr, source_id, 0, {"vendor": 1, "product": 31, "version": 0})
+    response.received_time = received_time
+    return response
+
+def test_replies_complete_a_device_in_either_order():
+    replies = DiscoveryReplies(7)
+    assert replies.add(state_version("d0:73:d5:00:00:01", 7, 1.0)) == None
+    (service, version) = replies.add(state_service("d0:73:d5:00:00:01", 7, 2.0))
+    assert (service.target_addr, version) == ("d0:73:d5:00:00:01", (1, 31, 0))
+    assert replies.add(state_service("d0:73:d5:00:00:02", 7, 3.0)) == None
+    assert [r.target_addr for r in replies.get_unversioned()] == ["d0:73:d5:00:00:02"]
+    assert replies.last_seen_time == 3.0
+
+def test_duplicate_and_foreign_replies_are_ignored():
+    replies = DiscoveryReplies(7)
+    replies.add(state_service("d0:73:d5:00:00:01", 7, 1.0))
+    # a repeated reply does not count as the LAN still being busy
+    assert replies.add(state_service("d0:73:d5:00:00:01", 7, 5.0)) == None
+    assert replies.add(state_service("d0:73:d5:00:00:02", 8, 5.0)) == None
+    assert replies.add(state_service(BROADCAST_MAC, 7, 5.0)) == None
+    assert (replies.addr_seen, replies.last_seen_time) == (set(["d0:73:d5:00:00:01"]), 1.0)
+
+def test_stop_time():
+    replies = DiscoveryReplies(7)
+    replies.last_seen_time = 100.0
+    assert replies.get_stop_time(105.0, None) == 105.0
+    assert replies.get_stop_time(105.0, 0.5) == 100.5
+    assert replies.get_stop_time(100.2, 0.5) == 100.2
+
+def test_waits_until_num_devices_are_completed():
+    replies = DiscoveryReplies(7, num_devices=1)
+    assert replies.is_waiting()
+    replies.add(state_service("d0:73:d5:00:00:01", 7, 1.0))
+    # seen, but its StateVersion is still to come
+    assert replies.is_waiting()
+    replies.add(state_version("d0:73:d5:00:00:01", 7, 1.0))
+    assert not replies.is_waiting()
+
+# two LIFX Zs; the ones listed in deaf_to_version only answer a unicast GetVersion
+def make_fake_lan(broadcast_to, deaf_to_version=()):
+    version = {"vendor": 1, "product": 31, "version": 0}
+    devices = broadcast_to(*[(mac_addr, {GetVersion: (StateVersion, version)},
+                              {"ignore_broadcasts": (GetVersion,)} if mac_addr in deaf_to_version else {})
+                             for mac_addr in ("d0:73:d5:00:00:01", "d0:73:d5:00:00:02")])
+    for device in devices:
+        device.replies[GetService] = (StateService, {"service": 1, "port": device.port})
+    return devices
+
+@pytest.fixture
+def fake_lan(broadcast_to):
+    return make_fake_lan(broadcast_to)
+
+def test_discovery_stops_once_the_lan_is_quiet(fake_lan):
+    lan = LifxLAN()
+    start_time = time()
+    try:
+        devices = list(lan.discover_iter(timeout_secs=5, quiet_secs=0.2))
+    finally:
+        lan.close()
+    assert time() - start_time < 2
+    assert sorted((d.mac_addr, d.ip_addr, d.port) for d in devices) == \
+        [("d0:73:d5:00:00:01", "127.0.0.1", fake_lan[0].port), ("d0:73:d5:00:00:02", "127.0.0.2", fake_lan[1].port)]
+    assert [type(d) for d in devices] == [MultiZoneLight, MultiZoneLight]
+    # classified from the broadcast, so nothing was unicast
+    assert [[type(m) for m in device.received] for device in fake_lan] == [[GetService, GetVersion]] * 2
+
+def test_discovery_stops_once_num_lights_have_answered(fake_lan):
+    lan = LifxLAN(num_lights=2)
+    start_time = time()
+    try:
+        devices = list(lan.discover_iter(timeout_secs=5, quiet_secs=None))
+    finally:
+        lan.close()
+    assert time() - start_time < 2
+    assert len(devices) == 2
+
+def test_devices_are_handed_out_as_they_answer(fake_lan):
+    lan = LifxLAN()
+    try:
+        devices = lan.discover_iter(timeout_secs=5, quiet_secs=None)
+        start_time = time()
+        next(devices)
+        # long before the timeout ends the discovery
+        assert time() - start_time < 2
+        devices.close()
+    finally:
+        lan.close()
+
+@pytest.mark.parametrize("version, kind", [(None, "light"), ((1, 1, 0), "light"), ((1, 31, 0), "multizone"),
+                                           ((1, 55, 0), "chain"), ((1, 70, 0), "switch"), ((1, 9999, 0), "device")])
+def test_device_kind(version, kind):
+    assert device_kind(version) == kind
+
+def test_make_device_fills_in_the_version():
+    lan = LifxLAN()
+    try:
+        devices = [lan.make_device("d0:73:d5:00:00:01", "192.0.2.1", 1, 56700, version) for version in
+                   [(1, 31, 0), (1, 55, 0), (1, 70, 0), None]]
+    finally:
+        lan.close()
+    assert [type(d) for d in devices] == [MultiZoneLight, TileChain, Switch, Light]
+    assert (devices[0].product, devices[0].product_features["multizone"]) == (31, True)
+    assert devices[3].product == None
+
+def test_device_that_missed_the_broadcast_version_is_asked_directly(broadcast_to):
+    fake_lan = make_fake_lan(broadcast_to, deaf_to_version=("d0:73:d5:00:00:02",))
+    lan = LifxLAN()
+    try:
+        devices = list(lan.discover_iter(timeout_secs=5, quiet_secs=0.2))
+    finally:
+        lan.close()
+    assert [(d.mac_addr, type(d), d.product) for d in devices] == \
+        [("d0:73:d5:00:00:01", MultiZoneLight, 31), ("d0:73:d5:00:00:02", MultiZoneLight, 31)]
+    assert [[(type(m), m.target_addr) for m in device.received] for device in fake_lan] == [
+        [(GetService, BROADCAST_MAC), (GetVersion, BROADCAST_MAC)],
+        [(GetService, BROADCAST_MAC), (GetVersion, BROADCAST_MAC), (GetVersion, "d0:73:d5:00:00:02")]]
@@ -0,0 +1,128 @@
+# coding=utf-8
+# Regression tests for looking devices up by label: the label index is kept
+# between lookups, and a name that matches nothing rediscovers at most once.
+# Group lookups ask every device again once the memberships are max_age old.
+# Broadcasts that ask for an acknowledgement and a state reply pair them up
+# per device.
+
+import pytest
+
+from lifxlan.lifxlan import LifxLAN
+from lifxlan.light import Light
+from lifxlan.msgtypes import Acknowledgement, LightSetPower, LightStatePower, StateGroup, StateLabel
+
+
+class CountingLifxLAN(LifxLAN):
+    def __init__(self, labels, groups={}):
+        super(CountingLifxLAN, self).__init__()
+        self.labels = labels # mac_addr: label
+        self.groups = groups # mac_addr: group label
+        self.discoveries = 0
+        self.broadcasts = 0
+
+    def discover_iter(self, timeout_secs=1, quiet_secs=None):
+        self.discoveries += 1
+        return iter([Light(mac_addr, "192.0.2.1", transport=self.transport) for mac_addr in self.labels])
+
+    def broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=1, max_attempts=1, mac_addrs=None):
+        self.broadcasts += 1
+        if response_type == StateGroup:
+            return [StateGroup(mac_addr, self.source_id, 0, {"group": group.encode().ljust(16, b"\0"), "label": group, "updated_at": 0})
+                    for (mac_addr, group) in self.groups.items() if mac_addrs == None or mac_addr in mac_addrs]
+        return [StateLabel(mac_addr, self.source_id, 0, {"label": label}) for (mac_addr, label) in self.labels.items()
+                if mac_addrs == None or mac_addr in mac_addrs]
+
+    def reset_counts(self):
+        self.discoveries = 0
+        self.broadcasts = 0
+
+
+@pytest.fixture
+def lan():
+    lan = CountingLifxLAN(dict(("d0:73:d5:00:00:0{}".format(i), "L{}".format(i)) for i in range(3)))
+    yield lan
+    lan.close()
+
+def test_first_lookup_discovers_and_reads_labels_once(lan):
+    assert lan.get_device_by_name("L1").mac_addr == "d0:73:d5:00:00:01"
+    assert (lan.discoveries, lan.broadcasts) == (1, 1)
+
+def test_later_lookups_reuse_the_index(lan):
+    lan.get_device_by_name("L1")
+    lan.reset_counts()
+    assert lan.get_device_by_name("L2").mac_addr == "d0:73:d5:00:00:02"
+    assert lan.get_device_by_name("L1").mac_addr == "d0:73:d5:00:00:01"
+    assert [d.mac_addr for d in lan.get_devices_by_name(["L0", "L2"]).get_device_list()] == ["d0:73:d5:00:00:00", "d0:73:d5:00:00:02"]
+    assert (lan.discoveries, lan.broadcasts) == (0, 0)
+
+def test_unknown_name_rediscovers_once(lan):
+    lan.get_device_by_name("L1")
+    lan.reset_counts()
+    assert lan.get_device_by_name("Nope") == None
+    assert (lan.discoveries, lan.broadcasts) == (1, 1)
+    lan.reset_counts()
+    assert lan.get_device_by_name("Nope") == None
+    assert (lan.discoveries, lan.broadcasts) == (0, 0)
+
+def test_index_follows_renamed_devices(lan):
+    lan.get_device_by_name("L1")
+    lan.labels["d0:73:d5:00:00:01"] = "Renamed"
+    for d in lan.devices:
+        if d.mac_addr == "d0:73:d5:00:00:01":
+            d.label = "Renamed"
+    lan.reset_counts()
+    assert lan.get_device_by_name("Renamed").mac_addr == "d0:73:d5:00:00:01"
+    assert lan.get_device_by_name("L1") == None
+    assert lan.discoveries <= 1
+
+
+@pytest.fixture
+def group_lan():
+    labels = dict(("d0:73:d5:00:00:0{}".format(i), "L{}".format(i)) for i in range(3))
+    groups = {"d0:73:d5:00:00:00": "Kitchen", "d0:73:d5:00:00:01": "Kitchen", "d0:73:d5:00:00:02": "Hall"}
+    lan = CountingLifxLAN(labels, groups)
+    lan.update_device_list()
+    lan.reset_counts()
+    yield lan
+    lan.close()
+
+def kitchen(lan, max_age=30):
+    return sorted(d.mac_addr for d in lan.get_devices_by_group("Kitchen", max_age).get_device_list())
+
+def test_group_lookups_within_max_age_reuse_the_index(group_lan):
+    assert kitchen(group_lan) == ["d0:73:d5:00:00:00", "d0:73:d5:00:00:01"]
+    assert group_lan.broadcasts == 1
+    group_lan.reset_counts()
+    assert kitchen(group_lan) == ["d0:73:d5:00:00:00", "d0:73:d5:00:00:01"]
+    assert group_lan.get_devices_by_group("Nope").get_device_list() == []
+    assert group_lan.broadcasts == 0
+
+def test_stale_group_hit_asks_every_device_again(group_lan):
+    kitchen(group_lan)
+    group_lan.groups["d0:73:d5:00:00:01"] = "Hall"
+    group_lan.group_index.refresh_time -= 31
+    group_lan.reset_counts()
+    assert kitchen(group_lan) == ["d0:73:d5:00:00:00"]
+    assert group_lan.broadcasts == 1
+
+def test_stale_group_miss_asks_every_device_again(group_lan):
+    assert group_lan.get_devices_by_group("Office").get_device_list() == []
+    group_lan.groups["d0:73:d5:00:00:02"] = "Office"
+    group_lan.reset_counts()
+    assert group_lan.get_devices_by_group("Office").get_device_list() == []
+    assert group_lan.broadcasts == 0
+    assert [d.mac_addr for d in group_lan.get_devices_by_group("Office", 0).get_device_list()] == ["d0:73:d5:00:00:02"]
+    assert group_lan.broadcasts == 1
+
+
+def test_broadcast_with_ack_resp_pairs_replies_per_device(broadcast_to):
+    replies = {LightSetPower: (LightStatePower, {"power_level": 65535})}
+    broadcast_to(("d0:73:d5:00:00:01", replies, {}), ("d0:73:d5:00:00:02", replies, {}))
+    lan = LifxLAN(num_lights=2)
+    try:
+        pairs = lan.broadcast_with_ack_resp(LightSetPower, LightStatePower, {"power_level": 65535, "duration": 0}, timeout_secs=1)
+    finally:
+        lan.close()
+    assert sorted(ack.target_addr for (ack, state) in pairs) == ["d0:73:d5:00:00:01", "d0:73:d5:00:00:02"]
+    for (ack, state) in pairs:
+        assert (type(ack), type(state), state.target_addr, state.power_level) == (Acknowledgement, LightStatePower, ack.target_addr, 65535)
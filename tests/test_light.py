@@ -0,0 +1,47 @@
+# coding=utf-8
+# Tests for setting one component of a light's color: a single
+# SetWaveformOptional packet that changes only that component, with no
+# LightGet first, for a light and for every light in a group.
+
+import pytest
+
+from conftest import FakeDevice
+from lifxlan.group import Group
+from lifxlan.light import COLOR_COMPONENT_FLAGS, Light, color_component_payload
+from lifxlan.msgtypes import LightSetWaveformOptional
+from lifxlan.transport import Transport
+
+
+@pytest.mark.parametrize("index", range(4))
+def test_color_component_payload(index):
+    payload = color_component_payload(index, 1234, 500)
+    assert [payload[flag] for flag in COLOR_COMPONENT_FLAGS] == [int(i == index) for i in range(4)]
+    assert payload["color"][index] == 1234
+    # one cycle that ends on the new value and stays there
+    assert (payload["transient"], payload["period"], payload["cycles"]) == (0, 500, 1)
+
+@pytest.fixture
+def fake_lights():
+    devices = [FakeDevice("d0:73:d5:00:00:0{}".format(i), {}) for i in range(1, 3)]
+    transport = Transport()
+    lights = [Light(device.mac_addr, device.ip_addr, port=device.port, transport=transport) for device in devices]
+    yield (devices, lights)
+    transport.close()
+    for device in devices:
+        device.close()
+
+@pytest.mark.parametrize("setter, index", [("set_hue", 0), ("set_saturation", 1), ("set_brightness", 2), ("set_colortemp", 3)])
+def test_setter_sends_one_packet(fake_lights, setter, index):
+    (devices, lights) = fake_lights
+    getattr(lights[0], setter)(3500, 250)
+    [msg] = devices[0].received
+    assert (type(msg), msg.ack_requested, msg.period) == (LightSetWaveformOptional, 1, 250)
+    assert [getattr(msg, flag) for flag in COLOR_COMPONENT_FLAGS] == [int(i == index) for i in range(4)]
+    assert msg.color[index] == 3500
+
+def test_group_sends_one_packet_per_light(fake_lights):
+    (devices, lights) = fake_lights
+    for light in lights:
+        light.product_features = {"color": True}
+    Group(lights).set_brightness(0)
+    assert [[(type(m), m.set_brightness) for m in device.received] for device in devices] == [[(LightSetWaveformOptional, 1)]] * 2
@@ -0,0 +1,40 @@
+# coding=utf-8
+# Tests for packing messages with the precompiled structs in codec.py: the
+# bytes have to match the LIFX LAN protocol documentation exactly.
+
+from binascii import unhexlify
+
+from lifxlan.message import BROADCAST_MAC, HEADER_SIZE_BYTES
+from lifxlan.msgtypes import GetPower, GetService, LightSetColor, SetLabel
+
+
+def test_set_color_matches_the_protocol_documentation():
+    # the SetColor example from the LIFX LAN protocol documentation
+    msg = LightSetColor(BROADCAST_MAC, 0, 0, {"color": [21845, 65535, 65535, 3500], "duration": 1024})
+    assert msg.packed_message == unhexlify("31000034000000000000000000000000000000000000000000000000000000006600000000"
+                                           "5555ffffffffac0d00040000")
+
+def test_unicast_header_fields():
+    msg = GetPower("d0:73:d5:01:02:03", 0x12345678, 7, ack_requested=True, response_requested=True)
+    header = msg.packed_message
+    assert len(header) == HEADER_SIZE_BYTES
+    assert header[0:2] == b"\x24\x00" # size
+    assert header[2:4] == b"\x00\x14" # protocol 1024, addressable, not tagged
+    assert header[4:8] == b"\x78\x56\x34\x12" # source id
+    assert header[8:16] == b"\xd0\x73\xd5\x01\x02\x03\x00\x00" # target
+    assert header[22] == 0x03 # ack and response requested
+    assert header[23] == 7 # sequence number
+    assert header[32:34] == b"\x14\x00" # GetPower
+    assert msg.get_frame() + msg.get_frame_addr() + msg.get_protocol_header() == header
+
+def test_get_service_is_always_broadcast():
+    msg = GetService("d0:73:d5:01:02:03", 2, 0)
+    assert msg.packed_message[2:4] == b"\x00\x34"
+    assert msg.packed_message[8:16] == b"\x00" * 8
+
+def test_label_is_padded_to_32_bytes():
+    msg = SetLabel("d0:73:d5:01:02:03", 2, 0, {"label": u"Kitchen ☕"})
+    payload = msg.packed_message[HEADER_SIZE_BYTES:]
+    assert len(payload) == 32
+    assert payload == u"Kitchen ☕".encode("utf-8").ljust(32, b"\0")
+    assert msg.size == HEADER_SIZE_BYTES + 32
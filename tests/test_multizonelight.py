@@ -0,0 +1,199 @@
+# coding=utf-8
+# Regression tests for deciding whether a multizone light supports the
+# extended multizone messages: firmware versions compare as (major, minor)
+# integers, and products missing from the table are asked. Also checks that
+# get_color_zones returns arrays when NumPy colors are enabled, and that the
+# legacy zone read asks once and only re-requests the segments that were lost.
+# set_zone_colors sends one SetColorZones per run of same-colored zones.
+
+import pytest
+
+from conftest import FakeDevice
+from lifxlan import codec
+from lifxlan.device import firmware_version, firmware_version_tuple
+from lifxlan.msgtypes import MultiZoneGetColorZones, MultiZoneSetColorZones, MultiZoneStateMultiZone, MultiZoneStateZone
+from lifxlan.multizonelight import MultiZoneLight, add_zone_colors, changed_zone_runs, missing_zone_segments, zone_run_payloads, \
+    zone_runs
+from lifxlan.transport import Transport
+
+
+def make_light(product, firmware):
+    light = MultiZoneLight("d0:73:d5:00:00:01", "192.0.2.1", transport=Transport())
+    light.product = product
+    light.firmware_requests = 0
+    light.probes = 0
+    def get_host_firmware_version_tuple(max_age=None):
+        light.firmware_requests += 1
+        return firmware
+    def probe_extended_multizone():
+        light.probes += 1
+        return True
+    light.get_host_firmware_version_tuple = get_host_firmware_version_tuple
+    light.probe_extended_multizone = probe_extended_multizone
+    return light
+
+def test_firmware_version_tuple():
+    assert firmware_version_tuple((2 << 16) | 100) == (2, 100)
+    assert firmware_version_tuple((3 << 16) | 70) == (3, 70)
+    # a float would put 2.100 before 2.8
+    assert firmware_version_tuple((2 << 16) | 100) > firmware_version_tuple((2 << 16) | 8)
+
+def test_firmware_version_keeps_the_whole_minor_version():
+    assert firmware_version((2 << 16) | 77) == 2.77
+    assert firmware_version((3 << 16) | 300) == 3.3
+    assert firmware_version((3 << 16) | 0x105) == 3.261
+
+@pytest.mark.parametrize("firmware, expected", [((2, 8), False), ((2, 76), False), ((2, 77), True), ((2, 100), True), ((3, 0), True)])
+def test_min_firmware_is_compared_as_integers(firmware, expected):
+    light = make_light(31, firmware)
+    assert light.supports_extended_multizone() == expected
+    assert light.probes == 0
+
+def test_products_that_always_support_it_skip_the_firmware_request():
+    light = make_light(117, (1, 0))
+    assert light.supports_extended_multizone()
+    assert light.firmware_requests == 0
+
+def test_unknown_product_is_probed_once():
+    light = make_light(9999, (3, 70))
+    assert light.supports_extended_multizone()
+    assert light.supports_extended_multizone()
+    assert light.probes == 1
+    assert light.firmware_requests == 0
+
+
+ZONES = [(i, 65535, 32768, 3500) for i in range(10)]
+RED = (0, 65535, 65535, 3500)
+BLUE = (43634, 65535, 65535, 3500)
+
+@pytest.fixture
+def numpy_colors():
+    pytest.importorskip("numpy")
+    codec.use_numpy_colors()
+    yield
+    codec.use_numpy_colors(False)
+
+def make_zone_light(extended):
+    light = MultiZoneLight("d0:73:d5:00:00:01", "192.0.2.1", transport=Transport())
+    light.extended_multizone = extended
+    light.extended_get_color_zones = lambda: codec.join_colors([codec.color_array(ZONES)])
+    light.get_all_color_zones = lambda: list(ZONES)
+    return light
+
+@pytest.mark.parametrize("extended", [True, False])
+def test_get_color_zones_returns_an_array_in_numpy_mode(numpy_colors, extended):
+    light = make_zone_light(extended)
+    zones = light.get_color_zones()
+    assert codec.is_color_array(zones)
+    assert zones.shape == (10, 4)
+    assert zones.tolist() == [list(color) for color in ZONES]
+    assert light.get_color_zones(2, 4).tolist() == [list(color) for color in ZONES[2:4]]
+    # push_zone_frame compares against plain tuples
+    assert light.state_cache["zone_frame"][0] == ZONES
+
+@pytest.mark.parametrize("extended", [True, False])
+def test_get_color_zones_returns_a_list_by_default(extended):
+    light = make_zone_light(extended)
+    assert light.get_color_zones() == ZONES
+
+
+def test_changed_zone_runs():
+    previous = [RED] * 4 + [BLUE] * 4
+    colors = list(previous)
+    colors[1] = BLUE
+    assert changed_zone_runs(previous, colors) == [(1, 1, BLUE)]
+    colors[4] = RED
+    # the whole run containing a changed zone is resent
+    assert changed_zone_runs(previous, colors) == [(1, 1, BLUE), (2, 4, RED)]
+    assert changed_zone_runs(previous, previous) == []
+    # a different zone count or no previous frame sends everything
+    assert changed_zone_runs(None, previous) == zone_runs(previous)
+    assert changed_zone_runs(previous[:4], previous) == zone_runs(previous)
+
+
+def test_add_zone_colors():
+    zones = {}
+    assert add_zone_colors(zones, MultiZoneStateZone("d0:73:d5:00:00:01", 7, 0, {"count": 10, "index": 3, "color": RED})) == 10
+    # the last segment is padded past the zone count
+    add_zone_colors(zones, MultiZoneStateMultiZone("d0:73:d5:00:00:01", 7, 0, {"count": 10, "index": 8, "color": [BLUE] * 8}))
+    assert zones == {3: RED, 8: BLUE, 9: BLUE}
+
+def test_missing_zone_segments():
+    zones = dict((i, RED) for i in range(20))
+    assert missing_zone_segments(zones, 20) == []
+    del zones[9]
+    del zones[19]
+    assert missing_zone_segments(zones, 20) == [(8, 15), (16, 19)]
+    assert missing_zone_segments({}, 3) == [(0, 2)]
+
+class FakeZoneDevice(FakeDevice):
+    # answers GetColorZones with a StateMultiZone per 8 zones, leaving out the
+    # segments starting at the indices in lost the first time they are asked for
+    def __init__(self, colors, lost=()):
+        self.colors = colors
+        self.lost = set(lost)
+        super(FakeZoneDevice, self).__init__("d0:73:d5:00:00:01", {})
+
+    def answer(self, request):
+        if type(request) != MultiZoneGetColorZones:
+            return []
+        answers = []
+        for index in range(request.start_index - request.start_index % 8, min(request.end_index + 1, len(self.colors)), 8):
+            if index in self.lost:
+                self.lost.remove(index)
+                continue
+            colors = (self.colors[index:index + 8] + [(0, 0, 0, 0)] * 8)[:8]
+            answers.append((MultiZoneStateMultiZone, {"count": len(self.colors), "index": index, "color": colors}))
+        return answers
+
+@pytest.fixture
+def zone_device():
+    devices = []
+    transport = Transport()
+    def make_zone_device(colors, lost=()):
+        device = FakeZoneDevice(colors, lost)
+        devices.append(device)
+        return (device, MultiZoneLight(device.mac_addr, device.ip_addr, port=device.port, transport=transport))
+    yield make_zone_device
+    transport.close()
+    for device in devices:
+        device.close()
+
+def zone_requests(device):
+    return [(m.start_index, m.end_index) for m in device.received if type(m) == MultiZoneGetColorZones]
+
+def test_all_zones_are_read_with_one_request(zone_device):
+    colors = [(i, 65535, 32768, 3500) for i in range(20)]
+    (device, light) = zone_device(colors)
+    assert light.get_all_color_zones() == colors
+    assert zone_requests(device) == [(0, 255)]
+
+def test_only_lost_segments_are_asked_for_again(zone_device):
+    colors = [(i, 65535, 32768, 3500) for i in range(20)]
+    (device, light) = zone_device(colors, lost=(8, 16))
+    assert light.get_all_color_zones() == colors
+    assert zone_requests(device) == [(0, 255), (8, 15), (16, 19)]
+
+
+def test_zone_runs():
+    assert zone_runs([RED, RED, BLUE, RED, RED, RED]) == [(0, 1, RED), (2, 2, BLUE), (3, 5, RED)]
+    assert zone_runs([list(RED)] * 3) == [(0, 2, RED)]
+    assert zone_runs([]) == []
+
+def test_only_the_last_run_payload_applies():
+    payloads = zone_run_payloads([(0, 1, RED), (2, 2, BLUE), (3, 5, RED)], duration=100)
+    assert [(p["start_index"], p["end_index"], p["color"], p["apply"]) for p in payloads] == \
+        [(0, 1, RED, 0), (2, 2, BLUE, 0), (3, 5, RED, 1)]
+    assert set(p["duration"] for p in payloads) == set([100])
+    assert zone_run_payloads([(0, 5, RED)], apply=0)[0]["apply"] == 0
+    assert zone_run_payloads([]) == []
+
+def test_set_zone_colors_sends_a_message_per_run(zone_device):
+    (device, light) = zone_device([RED] * 8)
+    light.extended_multizone = False
+    assert light.set_zone_colors([RED] * 3 + [BLUE] * 2 + [RED] * 3) == 3
+    sent = sorted((m.start_index, m.end_index, m.color, m.apply) for m in device.received if type(m) == MultiZoneSetColorZones)
+    assert sent == [(0, 2, RED, 0), (3, 4, BLUE, 0), (5, 7, RED, 1)]
+    # the message that applies the changes goes out last
+    assert device.received[-1].apply == 1
+    assert light.zone_frame_stats["packets"] == 3
@@ -0,0 +1,74 @@
+# coding=utf-8
+# Tests for packet templates: a template patched with a new payload, sequence
+# number or target has to be byte for byte the message that would have been
+# built from scratch.
+
+import pytest
+
+from lifxlan.errors import InvalidParameterException
+from lifxlan.light import Light
+from lifxlan.message import BROADCAST_MAC
+from lifxlan.msgtypes import LightSetColor, LightSetPower, LightSetWaveformOptional, MultiZoneSetColorZones, \
+    MultiZoneSetExtendedColorZones, SetTileState64
+from lifxlan.packettemplate import PacketTemplate
+from lifxlan.transport import Transport
+
+MAC_ADDR = "d0:73:d5:00:00:01"
+RED = (0, 65535, 65535, 3500)
+BLUE = (43634, 65535, 32768, 4000)
+
+# (msg_type, payload the template is built with, payload patched in)
+PATCH_CASES = [
+    (LightSetColor, {"color": RED, "duration": 0}, {"color": BLUE, "duration": 250}),
+    (LightSetPower, {"power_level": 0, "duration": 0}, {"power_level": 65535, "duration": 1000}),
+    (LightSetWaveformOptional, {"transient": 0, "color": RED, "period": 0, "cycles": 1.0, "duty_cycle": 0, "waveform": 0,
+                                "set_hue": 1, "set_saturation": 0, "set_brightness": 0, "set_kelvin": 0},
+                               {"color": BLUE, "cycles": 2.5, "duty_cycle": -100, "set_hue": 0, "set_brightness": 1}),
+    (MultiZoneSetColorZones, {"start_index": 0, "end_index": 3, "color": RED, "duration": 0, "apply": 1},
+                             {"start_index": 4, "end_index": 9, "color": BLUE, "apply": 0}),
+    (MultiZoneSetExtendedColorZones, {"duration": 0, "apply": 1, "index": 0, "count": 3, "colors": [RED] * 3},
+                                     {"index": 82, "colors": [BLUE, RED, BLUE]}),
+    (SetTileState64, {"tile_index": 0, "length": 1, "reserved": 0, "x": 0, "y": 0, "width": 8, "duration": 0, "colors": [RED] * 64},
+                     {"tile_index": 3, "colors": [BLUE] * 64}),
+]
+
+@pytest.mark.parametrize("msg_type, payload, patch", PATCH_CASES, ids=[case[0].__name__ for case in PATCH_CASES])
+def test_patched_template_matches_a_new_message(msg_type, payload, patch):
+    template = PacketTemplate(msg_type, MAC_ADDR, 1234, payload)
+    template.set_payload(patch)
+    template.set_seq_num(42)
+    expected = msg_type(MAC_ADDR, 1234, 42, dict(payload, **patch))
+    assert bytes(template.packed_message) == expected.packed_message
+
+def test_payload_that_changes_the_layout_does_not_fit():
+    template = PacketTemplate(MultiZoneSetExtendedColorZones, MAC_ADDR, 1234, {"duration": 0, "apply": 1, "index": 0, "count": 3, "colors": [RED] * 3})
+    assert template.fits({"colors": [BLUE] * 3})
+    assert not template.fits({"colors": [BLUE] * 4})
+    assert not template.fits({"no_such_field": 1})
+    with pytest.raises(InvalidParameterException):
+        template.set_payload({"colors": [BLUE] * 4})
+
+def test_sequence_number_wraps():
+    template = PacketTemplate(LightSetPower, MAC_ADDR, 1234, {"power_level": 0, "duration": 0})
+    template.set_seq_num(255)
+    assert template.next_seq_num() == 0
+    assert bytes(template.packed_message) == LightSetPower(MAC_ADDR, 1234, 0, {"power_level": 0, "duration": 0}).packed_message
+
+def test_retargeting_sets_the_tagged_flag():
+    payload = {"power_level": 65535, "duration": 0}
+    template = PacketTemplate(LightSetPower, MAC_ADDR, 1234, payload)
+    template.set_target(BROADCAST_MAC)
+    template.set_source_id(99)
+    assert bytes(template.packed_message) == LightSetPower(BROADCAST_MAC, 99, 0, payload).packed_message
+    template.set_target(MAC_ADDR)
+    assert bytes(template.packed_message) == LightSetPower(MAC_ADDR, 99, 0, payload).packed_message
+
+def test_device_reuses_its_template_until_the_layout_changes():
+    transport = Transport()
+    light = Light(MAC_ADDR, "192.0.2.1", transport=transport)
+    payload = {"duration": 0, "apply": 1, "index": 0, "count": 3, "colors": [RED] * 3}
+    template = light.get_packet_template(MultiZoneSetExtendedColorZones, payload)
+    assert light.get_packet_template(MultiZoneSetExtendedColorZones, {"colors": [BLUE] * 3}) is template
+    longer = dict(payload, count=4, colors=[BLUE] * 4)
+    assert light.get_packet_template(MultiZoneSetExtendedColorZones, longer) is not template
+    transport.close()
@@ -0,0 +1,73 @@
+# coding=utf-8
+# Tests for the token buckets that pace outgoing packets, and for coalescing
+# queued fire-and-forget messages that a newer one supersedes.
+
+import pytest
+
+from lifxlan import ratelimit
+from lifxlan.light import Light
+from lifxlan.msgtypes import GetPower, LightSetColor, LightSetWaveformOptional, MultiZoneSetColorZones
+from lifxlan.ratelimit import TokenBucket, coalesce_key
+from lifxlan.transport import Transport
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit, "time", lambda: now[0])
+    return now
+
+def test_unlimited_bucket_never_delays(clock):
+    bucket = TokenBucket()
+    assert [bucket.reserve() for i in range(100)] == [0] * 100
+    assert bucket.get_stats()["throttled"] == 0
+
+def test_burst_then_spaced_out_at_the_rate(clock):
+    bucket = TokenBucket(10, burst=2)
+    assert [bucket.reserve() for i in range(5)] == pytest.approx([0, 0, 0.1, 0.2, 0.3])
+    stats = bucket.get_stats()
+    assert (stats["throttled"], stats["throttled_secs"]) == (3, pytest.approx(0.6))
+
+def test_tokens_refill_up_to_the_burst(clock):
+    bucket = TokenBucket(10, burst=2)
+    bucket.reserve()
+    bucket.reserve()
+    clock[0] += 0.1
+    assert bucket.reserve() == 0
+    assert bucket.reserve() == pytest.approx(0.1)
+    clock[0] += 60
+    assert [bucket.reserve() for i in range(3)] == pytest.approx([0, 0, 0.1])
+
+def test_set_rate_none_removes_the_limit(clock):
+    bucket = TokenBucket(1, burst=1)
+    bucket.reserve()
+    bucket.set_rate(None)
+    assert bucket.reserve() == 0
+
+def test_coalesce_key():
+    assert coalesce_key(LightSetColor, {"color": (1, 2, 3, 4), "duration": 0}) == (LightSetColor,)
+    assert coalesce_key(GetPower, {}) == None
+    # only messages that overwrite the same piece of state coalesce
+    hue = coalesce_key(LightSetWaveformOptional, {"set_hue": 1, "set_saturation": 0, "set_brightness": 0, "set_kelvin": 0})
+    brightness = coalesce_key(LightSetWaveformOptional, {"set_hue": 0, "set_saturation": 0, "set_brightness": 1, "set_kelvin": 0})
+    assert hue != brightness
+    assert coalesce_key(MultiZoneSetColorZones, {"start_index": 0, "end_index": 3, "apply": 1, "color": (1, 2, 3, 4)}) == \
+        coalesce_key(MultiZoneSetColorZones, {"start_index": 0, "end_index": 3, "apply": 1, "color": (5, 6, 7, 8)})
+
+def test_queued_message_is_replaced_by_a_newer_one():
+    transport = Transport()
+    light = Light("d0:73:d5:00:00:01", "192.0.2.1", transport=transport)
+    key = coalesce_key(LightSetColor, {})
+    # as if another thread's LightSetColor were waiting on the rate limiter
+    light.queued_payloads[key] = {"color": (1, 2, 3, 4), "duration": 0}
+    light.fire_and_forget(LightSetColor, {"color": (5, 6, 7, 8), "duration": 0}, num_repeats=1)
+    transport.close()
+    assert light.queued_payloads[key] == {"color": (5, 6, 7, 8), "duration": 0}
+    assert light.get_rate_limit_stats()["coalesced"] == 1
+
+def test_devices_are_unlimited_by_default():
+    transport = Transport()
+    light = Light("d0:73:d5:00:00:01", "192.0.2.1", transport=transport)
+    transport.close()
+    assert light.get_rate_limit_stats()["rate"] == None
+    assert transport.rate_limiter.get_stats()["rate"] == None
@@ -0,0 +1,109 @@
+# coding=utf-8
+# Tests for the device registry: what a device knows about itself survives a
+# save and load, a bad file just means nothing is known, and a LifxLAN object
+# given a registry hands out the saved devices before any discovery.
+
+from threading import Event
+import json
+
+import pytest
+
+from lifxlan.lifxlan import LifxLAN
+from lifxlan.light import Light
+from lifxlan.multizonelight import MultiZoneLight
+from lifxlan.registry import REGISTRY_FORMAT_VERSION, DeviceRegistry
+from lifxlan.tilechain import Tile, TileChain
+from lifxlan.transport import Transport
+
+
+class RegistryLifxLAN(LifxLAN):
+    def __init__(self, registry_path, found=[]):
+        super(RegistryLifxLAN, self).__init__(registry_path=registry_path)
+        self.found = found # (mac_addr, ip_addr, version) answering a discovery
+        self.discoveries = 0
+        self.answering = Event() # holds discoveries back until set
+        self.answering.set()
+
+    def discover_iter(self, timeout_secs=1, quiet_secs=None):
+        self.answering.wait()
+        self.discoveries += 1
+        return iter([self.make_device(mac_addr, ip_addr, 1, 56700, version) for (mac_addr, ip_addr, version) in self.found])
+
+    def broadcast_with_resp(self, msg_type, response_type, payload={}, timeout_secs=1, max_attempts=1, mac_addrs=None):
+        return []
+
+
+@pytest.fixture
+def transport():
+    transport = Transport()
+    yield transport
+    transport.close()
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "devices.json")
+
+def test_save_and_load(path, transport):
+    light = Light("d0:73:d5:00:00:01", "192.0.2.1", transport=transport)
+    light.vendor, light.product, light.version = 1, 31, 0
+    light.label = "Kitchen"
+    registry = DeviceRegistry(path)
+    registry.update(light)
+    registry.save()
+    entry = DeviceRegistry(path).get_entries()["d0:73:d5:00:00:01"]
+    assert (entry["ip_addr"], entry["port"], entry["product"], entry["label"]) == ("192.0.2.1", 56700, 31, "Kitchen")
+    # never fetched, so never saved
+    assert "group" not in entry
+
+def test_unknown_fields_keep_their_saved_value(path, transport):
+    registry = DeviceRegistry(path)
+    light = Light("d0:73:d5:00:00:01", "192.0.2.1", transport=transport)
+    light.label = "Kitchen"
+    registry.update(light)
+    registry.update(Light("d0:73:d5:00:00:01", "192.0.2.9", transport=transport))
+    entry = registry.get_entries()["d0:73:d5:00:00:01"]
+    assert (entry["ip_addr"], entry["label"]) == ("192.0.2.9", "Kitchen")
+
+@pytest.mark.parametrize("text", ["", "not json", "[]", json.dumps({"format": REGISTRY_FORMAT_VERSION + 1, "devices": {"x": {}}})])
+def test_unreadable_file_is_empty(path, text):
+    with open(path, "w") as f:
+        f.write(text)
+    assert DeviceRegistry(path).get_entries() == {}
+
+def test_missing_file_is_empty(path):
+    assert DeviceRegistry(path).get_entries() == {}
+
+def test_tile_layout_is_restored(path, transport):
+    chain = TileChain("d0:73:d5:00:00:01", "192.0.2.1", transport=transport, load_tiles=False)
+    chain.tile_info = [Tile(0.0, 0.0), Tile(1.0, 0.0, firmware_version=3.7)]
+    registry = DeviceRegistry(path)
+    registry.update(chain)
+    registry.save()
+    restored = TileChain("d0:73:d5:00:00:01", "192.0.2.1", transport=transport, load_tiles=False)
+    DeviceRegistry(path).restore(restored, DeviceRegistry(path).get_entries()["d0:73:d5:00:00:01"])
+    assert [(t.user_x, t.firmware_version) for t in restored.tile_info] == [(0.0, None), (1.0, 3.7)]
+    assert restored.tile_count == 2
+
+def test_saved_devices_are_handed_out_before_discovery(path):
+    lan = RegistryLifxLAN(path, [("d0:73:d5:00:00:01", "192.0.2.1", (1, 31, 0)), ("d0:73:d5:00:00:02", "192.0.2.2", None)])
+    lan.discover_devices()
+    lan.devices[0].label = "Kitchen"
+    lan.save_registry()
+    lan.close()
+
+    lan = RegistryLifxLAN(path, [("d0:73:d5:00:00:01", "192.0.2.9", (1, 31, 0))])
+    lan.answering.clear()
+    try:
+        devices = sorted(lan.get_devices(), key=lambda d: d.mac_addr)
+        assert [(d.mac_addr, type(d), d.ip_addr) for d in devices] == \
+            [("d0:73:d5:00:00:01", MultiZoneLight, "192.0.2.1"), ("d0:73:d5:00:00:02", Light, "192.0.2.2")]
+        assert devices[0].label == "Kitchen"
+        lan.answering.set()
+        lan.revalidation.join()
+    finally:
+        lan.close()
+    # the background discovery moved the device that answered and kept the other
+    assert lan.discoveries == 1
+    assert [d.ip_addr for d in devices] == ["192.0.2.9", "192.0.2.2"]
+    entries = DeviceRegistry(path).get_entries()
+    assert (entries["d0:73:d5:00:00:01"]["ip_addr"], entries["d0:73:d5:00:00:02"]["ip_addr"]) == ("192.0.2.9", "192.0.2.2")
@@ -0,0 +1,73 @@
+# coding=utf-8
+# Tests for the per-device round trip time estimate that decides how long to
+# wait for a reply before retransmitting (RFC 6298).
+
+from time import time
+
+import pytest
+
+from lifxlan.device import PendingRequest
+from lifxlan.light import Light
+from lifxlan.msgtypes import LightGetPower, LightStatePower
+from lifxlan.rtt import INITIAL_RETRANSMIT_SECS, MAX_RETRANSMIT_SECS, MIN_RETRANSMIT_SECS, RttEstimator
+from lifxlan.transport import Transport
+
+
+def test_initial_timeout():
+    rtt = RttEstimator()
+    assert rtt.get_retransmit_secs() == INITIAL_RETRANSMIT_SECS
+    assert rtt.get_stats() == {"srtt": None, "rttvar": None, "retransmit_secs": INITIAL_RETRANSMIT_SECS, "samples": 0}
+
+def test_first_sample():
+    rtt = RttEstimator()
+    rtt.add_sample(0.1)
+    # srtt + 4 * rttvar, with rttvar = rtt / 2
+    assert rtt.get_retransmit_secs() == pytest.approx(0.3)
+
+def test_smoothing():
+    rtt = RttEstimator()
+    rtt.add_sample(0.1)
+    rtt.add_sample(0.2)
+    stats = rtt.get_stats()
+    assert stats["srtt"] == pytest.approx(0.875 * 0.1 + 0.125 * 0.2)
+    assert stats["rttvar"] == pytest.approx(0.75 * 0.05 + 0.25 * 0.1)
+    assert stats["samples"] == 2
+
+def test_steady_fast_device_reaches_the_minimum():
+    rtt = RttEstimator()
+    for i in range(50):
+        rtt.add_sample(0.002)
+    assert rtt.get_retransmit_secs() == MIN_RETRANSMIT_SECS
+
+def test_backoff_doubles_up_to_the_maximum():
+    rtt = RttEstimator()
+    rtt.add_sample(0.1)
+    rtt.backoff()
+    assert rtt.get_retransmit_secs() == pytest.approx(0.6)
+    for i in range(10):
+        rtt.backoff()
+    assert rtt.get_retransmit_secs() == MAX_RETRANSMIT_SECS
+    # a fresh measurement replaces the backed off timeout
+    rtt.add_sample(0.1)
+    assert rtt.get_retransmit_secs() < MAX_RETRANSMIT_SECS
+
+def test_slow_device_is_capped():
+    rtt = RttEstimator()
+    rtt.add_sample(5.0)
+    assert rtt.get_retransmit_secs() == MAX_RETRANSMIT_SECS
+
+def test_reply_to_a_request_is_measured():
+    transport = Transport()
+    light = Light("d0:73:d5:00:00:01", "192.0.2.1", transport=transport)
+    light.request_window.acquire()
+    request = PendingRequest(light, LightGetPower, [LightStatePower])
+    request.sent_time = time() - 0.05
+    reply = LightStatePower(light.mac_addr, light.source_id, request.listener.seq_num, {"power_level": 0})
+    transport.handle_datagram(reply.packed_message, "192.0.2.1")
+    try:
+        request.wait(timeout_secs=1, max_attempts=1)
+    finally:
+        transport.close()
+    stats = light.get_rtt_stats()
+    assert stats["samples"] == 1
+    assert 0.05 <= stats["srtt"] < 1
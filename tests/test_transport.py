@@ -0,0 +1,82 @@
+# coding=utf-8
+# Tests for the shared transport: replies are routed to the request waiting
+# for them by (target, source id, sequence number), and sequence numbers roll
+# over without reusing one that is still waiting for replies.
+
+from queue import Empty
+from socket import AF_INET, SOCK_DGRAM, socket
+
+import pytest
+
+from lifxlan.errors import WorkflowException
+from lifxlan.message import BROADCAST_MAC
+from lifxlan.msgtypes import LightGetPower, LightStatePower
+from lifxlan.transport import SEQ_NUM_COUNT, Transport
+
+MAC_ADDR = "d0:73:d5:00:00:01"
+OTHER_MAC_ADDR = "d0:73:d5:00:00:02"
+
+
+def reply(target_addr, source_id, seq_num, power_level=65535):
+    return LightStatePower(target_addr, source_id, seq_num, {"power_level": power_level}).packed_message
+
+@pytest.fixture
+def transport():
+    transport = Transport()
+    yield transport
+    transport.close()
+
+def test_replies_go_to_the_matching_listener(transport):
+    first = transport.add_listener(MAC_ADDR, 7)
+    second = transport.add_listener(MAC_ADDR, 7)
+    assert first.seq_num != second.seq_num
+    transport.handle_datagram(reply(MAC_ADDR, 7, second.seq_num), "192.0.2.1")
+    assert first.empty()
+    response = second.get_nowait()
+    assert (response.ip_addr, response.power_level) == ("192.0.2.1", 65535)
+
+def test_replies_for_other_sources_and_devices_are_dropped(transport):
+    listener = transport.add_listener(MAC_ADDR, 7)
+    transport.handle_datagram(reply(MAC_ADDR, 8, listener.seq_num), "192.0.2.1")
+    transport.handle_datagram(reply(OTHER_MAC_ADDR, 7, listener.seq_num), "192.0.2.2")
+    transport.handle_datagram(b"not a lifx packet", "192.0.2.3")
+    assert listener.empty()
+
+def test_broadcast_listener_gets_every_device(transport):
+    listener = transport.add_listener(BROADCAST_MAC, 7)
+    transport.handle_datagram(reply(MAC_ADDR, 7, listener.seq_num), "192.0.2.1")
+    transport.handle_datagram(reply(OTHER_MAC_ADDR, 7, listener.seq_num), "192.0.2.2")
+    assert sorted(listener.get_nowait().target_addr for i in range(2)) == [MAC_ADDR, OTHER_MAC_ADDR]
+
+def test_sequence_numbers_skip_those_in_use(transport):
+    waiting = transport.add_listener(MAC_ADDR, 7)
+    for i in range(SEQ_NUM_COUNT - 1):
+        transport.stop_listening(transport.add_listener(MAC_ADDR, 7))
+    # the next number around is the one still waiting, so it is skipped
+    assert transport.add_listener(MAC_ADDR, 7).seq_num == (waiting.seq_num + 1) % SEQ_NUM_COUNT
+
+def test_broadcast_does_not_reuse_a_unicast_sequence_number(transport):
+    unicast = transport.add_listener(MAC_ADDR, 7)
+    assert transport.add_listener(BROADCAST_MAC, 7).seq_num != unicast.seq_num
+
+def test_too_many_outstanding_requests(transport):
+    for i in range(SEQ_NUM_COUNT):
+        transport.add_listener(MAC_ADDR, 7)
+    with pytest.raises(WorkflowException):
+        transport.add_listener(MAC_ADDR, 7)
+    # other devices have their own sequence numbers
+    transport.add_listener(OTHER_MAC_ADDR, 7)
+
+def test_reply_over_the_socket(transport):
+    device = socket(AF_INET, SOCK_DGRAM)
+    device.bind(("127.0.0.1", 0))
+    device.settimeout(2)
+    try:
+        listener = transport.listen(MAC_ADDR, 7)
+        transport.sendto(LightGetPower(MAC_ADDR, 7, listener.seq_num).packed_message, device.getsockname())
+        (request, addr) = device.recvfrom(1024)
+        device.sendto(reply(MAC_ADDR, 7, request[23]), addr)
+        response = listener.get(timeout=2)
+    finally:
+        device.close()
+    assert (type(response), response.seq_num, response.ip_addr) == (LightStatePower, listener.seq_num, "127.0.0.1")
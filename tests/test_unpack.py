@@ -0,0 +1,99 @@
+# coding=utf-8
+# Tests for decoding received packets: every message type decodes back to
+# the fields it was packed from, header and payload bytes are only sliced out
+# when asked for, payloads are only decoded once one of their fields is read,
+# and a payload that is too short to decode makes the message look like it
+# lacks those fields.
+
+import pytest
+
+from lifxlan.device import is_last_zone_segment
+from lifxlan.errors import WorkflowException
+from lifxlan.message import HEADER_SIZE_BYTES, Message
+from lifxlan.msgtypes import *
+from lifxlan.unpack import PAYLOAD_ATTRS, unpack_lifx_message
+
+MAC_ADDR = "d0:73:d5:00:00:01"
+COLOR = (1000, 2000, 3000, 3500)
+
+ROUND_TRIP_CASES = [
+    (GetPower, {}),
+    (StateService, {"service": 1, "port": 56700}),
+    (StateHostFirmware, {"build": 1234567890123, "reserved1": 0, "version": (2 << 16) | 80}),
+    (StatePower, {"power_level": 65535}),
+    (StateLabel, {"label": "Desk lamp"}),
+    (StateVersion, {"vendor": 1, "product": 55, "version": 0}),
+    (StateGroup, {"group": list(range(16)), "label": "Living", "updated_at": 1600000000000000001}),
+    (EchoResponse, {"byte_array": [1, 2, 3] + [0] * 61}),
+    (LightSetColor, {"color": COLOR, "duration": 500}),
+    (LightSetWaveformOptional, {"transient": 0, "color": COLOR, "period": 0, "cycles": 1.0, "duty_cycle": 0, "waveform": 0,
+                                "set_hue": 1, "set_saturation": 0, "set_brightness": 0, "set_kelvin": 0}),
+    (LightState, {"color": COLOR, "reserved1": 0, "power_level": 65535, "label": "Bulb", "reserved2": 0}),
+    (MultiZoneStateMultiZone, {"count": 16, "index": 8, "color": [COLOR] * 8}),
+    (StateMultiZoneEffect, {"instanceid": 5, "type": 1, "reserved1": 0, "speed": 3000, "duration": 0, "reserved2": 0, "reserved3": 0,
+                            "parameters": [0, 1, 0, 0, 0, 0, 0, 0]}),
+    (MultiZoneStateExtendedColorZones, {"count": 16, "index": 0, "cCount": 16, "colors": [COLOR] * 16}),
+    (StateTileState64, {"tile_index": 2, "reserved": 0, "x": 0, "y": 0, "width": 8, "colors": [(i, i * 2, i * 3, 3500) for i in range(64)]}),
+]
+
+
+def extended_zones_packet():
+    msg = MultiZoneStateExtendedColorZones(MAC_ADDR, 2, 5, {"count": 8, "index": 0, "cCount": 8, "colors": [(1, 2, 3, 4)] * 8})
+    return msg.packed_message
+
+def test_header_fields_do_not_decode_the_payload():
+    response = unpack_lifx_message(LightStatePower(MAC_ADDR, 2, 5, {"power_level": 65535}).packed_message)
+    assert (type(response), response.target_addr, response.source_id, response.seq_num) == (LightStatePower, MAC_ADDR, 2, 5)
+    assert "_decode_payload" in response.__dict__
+    assert "power_level" not in response.__dict__
+
+def test_first_field_read_decodes_every_field():
+    response = unpack_lifx_message(extended_zones_packet())
+    assert response.count == 8
+    assert "_decode_payload" not in response.__dict__
+    assert (response.index, response.cCount) == (0, 8)
+    assert list(response.colors) == [(1, 2, 3, 4)] * 8
+
+@pytest.mark.parametrize("length", [36, 38, 40, 60])
+def test_short_payload_has_no_fields(length):
+    response = unpack_lifx_message(extended_zones_packet()[:length])
+    assert not hasattr(response, "count")
+    with pytest.raises(AttributeError):
+        response.colors
+
+def test_short_zone_reply_is_a_workflow_exception():
+    with pytest.raises(WorkflowException):
+        is_last_zone_segment(unpack_lifx_message(extended_zones_packet()[:40]))
+
+
+@pytest.mark.parametrize("msg_type, payload", ROUND_TRIP_CASES, ids=[case[0].__name__ for case in ROUND_TRIP_CASES])
+def test_round_trip(msg_type, payload):
+    msg = msg_type(MAC_ADDR, 0x12345678, 200, dict(payload), ack_requested=True)
+    response = unpack_lifx_message(msg.packed_message)
+    assert type(response) == msg_type
+    # some message types are always broadcast, so compare with what was packed
+    assert (response.target_addr, response.source_id, response.seq_num, response.ack_requested) == (msg.target_addr, 0x12345678, 200, 1)
+    fields = dict((key, getattr(response, PAYLOAD_ATTRS.get(key, key))) for key in payload)
+    # packing the decoded fields again gives the same bytes
+    assert msg_type(MAC_ADDR, 0x12345678, 200, fields, ack_requested=True).packed_message == msg.packed_message
+
+def test_unknown_message_type_is_a_plain_message():
+    packet = bytearray(GetService(MAC_ADDR, 2, 0).packed_message)
+    packet[32:34] = b"\xe7\x03" # message type 999
+    response = unpack_lifx_message(bytes(packet))
+    assert type(response) == Message
+    assert response.message_type == 999
+
+def test_header_and_payload_are_sliced_on_first_use():
+    packet = LightStatePower(MAC_ADDR, 2, 5, {"power_level": 65535}).packed_message
+    response = unpack_lifx_message(packet)
+    assert "header" not in response.__dict__ and "payload" not in response.__dict__
+    assert response.packed_message is packet
+    assert response.header == packet[:HEADER_SIZE_BYTES]
+    assert response.payload == packet[HEADER_SIZE_BYTES:]
+
+def test_label_cut_off_inside_a_character():
+    label = u"Kitchen lights \u2615\u2615\u2615\u2615\u2615\u2615" # 33 bytes in UTF-8
+    packet = bytearray(StateLabel(MAC_ADDR, 2, 0, {"label": "x"}).packed_message)
+    packet[HEADER_SIZE_BYTES:] = label.encode("utf-8")[:32]
+    assert unpack_lifx_message(bytes(packet)).label == label[:-1]